@@ -1,17 +1,18 @@
 """The module for handling pet adoption applications."""
-import sqlite3
 from flask import jsonify
 from enums import ApplicationStatus
+from db import get_db_connection, transaction, existing_ids, MAX_BATCH_SIZE
+from pagination import keyset_query, page_rows, page_headers, Page
+from dashboard import get_stat
+from migrations import APPLICATIONS_STAT, APPLICATIONS_STATUS_STAT
+from serialize import RowSerializer, json_response, dumps
+from models import Application, Pet, User
 
-def get_db_connection():
-    """
-    Create a database connection to the SQLite database.
-    :return: SQLite connection object
-    """
-    conn = sqlite3.connect('petadoption.db')
-    conn.row_factory = sqlite3.Row  # Allows accessing columns by name
-    return conn
+_STATUS_VALUES = {**{s.name: s.value for s in ApplicationStatus},
+                  **{s.value: s.value for s in ApplicationStatus}}
 
+# Applications are listed oldest first; the ID breaks ties within the same second.
+APPLICATION_KEYS = [('a.submitted_at', 'submitted_at'), ('a.application_id', 'application_id')]
 
 def create_application(user_id: int, pet_id: int):
     """
@@ -45,16 +46,17 @@ def get_application_full(application_id: int):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM applications WHERE application_id = ?
-    ''', (application_id,))
-    application = cursor.fetchone()
+    application = _load_application(cursor, application_id)
     conn.close()
     if application is None:
         return jsonify({"error": "Application not found"}), 404
-    application = dict(application)
-    application['status'] = ApplicationStatus(application['status']).name
-    return jsonify(application), 200
+    return jsonify(application.public()), 200
+
+def _load_application(cursor, application_id):
+    cursor.execute(f'SELECT {Application.select_columns()} FROM applications '
+                   'WHERE application_id = ?', (application_id,))
+    row = cursor.fetchone()
+    return Application.from_row(row) if row else None
 
 def get_application(application_id: int):
     """
@@ -66,36 +68,37 @@ def get_application(application_id: int):
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT * FROM applications WHERE application_id = ?', (application_id,))
-    app_row = cursor.fetchone()
-    if not app_row:
+    application = _load_application(cursor, application_id)
+    if application is None:
         conn.close()
         return jsonify({"error": "Application not found"}), 404
 
-    application = dict(app_row)
-
     cursor.execute('''
         SELECT qr.question_id, q.question_text AS question_text, qr.answer_text 
         FROM questionnaire_responses qr
         JOIN questions q ON qr.question_id = q.question_id
         WHERE qr.user_id = ?
-    ''', (application['user_id'],))
+    ''', (application.user_id,))
     responses = [dict(row) for row in cursor.fetchall()]
     conn.close()
 
+    # unlike the lists, this endpoint sends the stored status value, e.g. "Pending"
+    data = application.public()
+    data['status'] = getattr(application.status, 'value', application.status)
     return jsonify({
-        "application": application,
+        "application": data,
         "responses": responses
     }), 200
 
-def get_all_applications():
+def get_all_applications(page=None):
     """
     Retrieve all applications in the system.
+    :param page: (optional) Page to return, see pagination.parse_page_args
     :return: JSON response with a list of all applications
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
+    cursor.execute(*keyset_query('''
         SELECT 
             a.application_id as id,
             a.application_id,
@@ -109,15 +112,81 @@ def get_all_applications():
             a.reviewer_id
         FROM applications a
         JOIN users u ON a.user_id = u.user_id
-    ''')
+    ''', [], [], APPLICATION_KEYS, page))
     applications = cursor.fetchall()
+    serializer = RowSerializer.for_cursor(cursor, Application.PUBLIC_ENUMS)
     conn.close()
+    applications, next_cursor, prev_cursor = page_rows(applications, APPLICATION_KEYS, page)
+    if not applications:
+        return jsonify([]), 200
+    return json_response(serializer.dumps(applications), 200,
+                         page_headers(page, next_cursor, prev_cursor))
+
+
+def _placeholders(values):
+    return ', '.join('?' for _ in values)
+
+def get_review_packets(status=None, page=None):
+    """
+    Retrieve a page of applications with everything a reviewer needs embedded:
+    the applicant, the pet and the applicant's questionnaire answers.
+
+    The page is loaded with four queries however long it is: the applications,
+    then their users, pets and answers, each with one IN list.
+
+    :param status: (optional) Only applications in this status, by name or value
+    :param page: (optional) Page to return, see pagination.parse_page_args;
+                 defaults to the first DEFAULT_LIMIT applications
+    :return: JSON response with a list of review packets
+    """
+    where, params = [], []
+    if status is not None:
+        value = _STATUS_VALUES.get(status)
+        if value is None:
+            return jsonify({"error": "Invalid status"}), 400
+        where.append('a.status = ?')
+        params.append(value)
+    page = page or Page()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(*keyset_query(f"SELECT {Application.select_columns('a', public=True)} "
+                                 "FROM applications a", where, params, APPLICATION_KEYS, page))
+    applications, next_cursor, prev_cursor = page_rows(cursor.fetchall(), APPLICATION_KEYS,
+                                                       page)
     if not applications:
+        conn.close()
         return jsonify([]), 200
-    applications = [dict(row) for row in applications]
-    for app in applications:
-        app['status'] = ApplicationStatus(app['status']).name
-    return jsonify(applications), 200
+
+    user_ids = list({row['user_id'] for row in applications})
+    pet_ids = list({row['pet_id'] for row in applications})
+    cursor.execute(f'SELECT {User.select_columns(public=True)} FROM users '
+                   f'WHERE user_id IN ({_placeholders(user_ids)})', user_ids)
+    users = {user['user_id']: user for user in User.serializer().dicts(cursor.fetchall())}
+    cursor.execute(f'SELECT {Pet.select_columns(public=True)} FROM pets '
+                   f'WHERE pet_id IN ({_placeholders(pet_ids)})', pet_ids)
+    pets = {pet['pet_id']: pet for pet in Pet.serializer().dicts(cursor.fetchall())}
+    cursor.execute(f'''
+        SELECT qr.user_id, qr.question_id, q.question_text, qr.answer_text
+        FROM questionnaire_responses qr
+        JOIN questions q ON qr.question_id = q.question_id
+        WHERE qr.user_id IN ({_placeholders(user_ids)})
+        ORDER BY qr.user_id, qr.question_id
+    ''', user_ids)
+    answers = {}
+    for row in cursor.fetchall():
+        answers.setdefault(row['user_id'], []).append({
+            'question_id': row['question_id'],
+            'question_text': row['question_text'],
+            'answer_text': row['answer_text'],
+        })
+    conn.close()
+
+    packets = Application.serializer().dicts(applications)
+    for packet in packets:
+        packet['applicant'] = users.get(packet['user_id'])
+        packet['pet'] = pets.get(packet['pet_id'])
+        packet['answers'] = answers.get(packet['user_id'], [])
+    return json_response(dumps(packets), 200, page_headers(page, next_cursor, prev_cursor))
 
 
 def update_application_status(application_id: int, status: ApplicationStatus, reviewer_id: int):
@@ -142,6 +211,58 @@ def update_application_status(application_id: int, status: ApplicationStatus, re
         return jsonify({"error": "Application not found"}), 404
     return jsonify("Application updated successfully."), 200
 
+def _is_id(value):
+    """Whether a value from a JSON body is an integer ID; true and false are not."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def update_application_statuses(decisions: list, reviewer_id: int):
+    """
+    Apply many review decisions in one transaction.
+
+    :param decisions: List of {application_id, status}; status is a name or value
+                      of ApplicationStatus, e.g. "APPROVED" or "Approved"
+    :param reviewer_id: ID of the staff member reviewing the applications
+    :return: JSON response with the number of updated applications and a result per item
+    """
+    if not isinstance(decisions, list) or not decisions:
+        return jsonify({"error": "decisions must be a non-empty list"}), 400
+    if len(decisions) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} decisions per batch"}), 400
+    results = []
+    valid = []
+    for decision in decisions:
+        if not isinstance(decision, dict):
+            decision = {}
+        application_id = decision.get('application_id')
+        status = decision.get('status')
+        status = _STATUS_VALUES.get(status) if isinstance(status, str) else None
+        if not _is_id(application_id) or status is None:
+            results.append({"application_id": application_id, "ok": False,
+                            "error": "Needs an application_id and a valid status"})
+            continue
+        results.append({"application_id": application_id, "ok": True, "status": status})
+        valid.append((status, reviewer_id, application_id))
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        with transaction(conn):
+            found = existing_ids(cursor, 'applications', 'application_id',
+                                 [application_id for _, _, application_id in valid])
+            cursor.executemany('''
+                UPDATE applications
+                SET status = ?, reviewed_at = CURRENT_TIMESTAMP, reviewer_id = ?
+                WHERE application_id = ?
+            ''', [row for row in valid if row[2] in found])
+    finally:
+        conn.close()
+    for result in results:
+        if result['ok'] and result['application_id'] not in found:
+            result.update(ok=False, error="Application not found")
+            del result['status']
+    updated = sum(1 for result in results if result['ok'])
+    return jsonify({"updated": updated, "results": results}), 200
+
 def get_user_applications(user_id: int):
     """
     Retrieve all applications submitted by a specific user.
@@ -151,39 +272,35 @@ def get_user_applications(user_id: int):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM applications WHERE user_id = ?
+    cursor.execute(f'''
+        SELECT {Application.select_columns(public=True)} FROM applications WHERE user_id = ?
     ''', (user_id,))
     applications = cursor.fetchall()
     conn.close()
     if not applications:
         return jsonify({"error": "No applications found for this user"}), 404
-    applications = [dict(application) for application in applications]
-    for application in applications:
-        application['status'] = ApplicationStatus(application['status']).name
-    return jsonify(applications), 200
+    return json_response(Application.serializer().dumps(applications))
 
-def get_applications_by_status(status: ApplicationStatus):
+def get_applications_by_status(status: ApplicationStatus, page=None):
     """
     Retrieve applications by their status.
 
     :param status: Status of the applications to retrieve
+    :param page: (optional) Page to return, see pagination.parse_page_args
     :return: JSON response with a list of applications matching the status
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM applications WHERE status = ?
-    ''', (status,))
+    cursor.execute(*keyset_query(f"SELECT {Application.select_columns('a', public=True)} "
+                                 "FROM applications a", ['a.status = ?'], [status],
+                                 APPLICATION_KEYS, page))
     applications = cursor.fetchall()
     conn.close()
-
-    applications = [dict(row) for row in applications]
+    applications, next_cursor, prev_cursor = page_rows(applications, APPLICATION_KEYS, page)
     if not applications:
         return jsonify({"error": "No applications found with this status"}), 404
-    for application in applications:
-        application['status'] = ApplicationStatus(application['status']).name
-    return jsonify(applications), 200
+    return json_response(Application.serializer().dumps(applications), 200,
+                         page_headers(page, next_cursor, prev_cursor))
 
 def get_applications_by_pet(pet_id: int):
     """
@@ -194,18 +311,14 @@ def get_applications_by_pet(pet_id: int):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM applications WHERE pet_id = ?
+    cursor.execute(f'''
+        SELECT {Application.select_columns(public=True)} FROM applications WHERE pet_id = ?
     ''', (pet_id,))
     applications = cursor.fetchall()
     conn.close()
-
-    applications = [dict(row) for row in applications]
     if not applications:
         return jsonify({"error": "No applications found for this pet"}), 404
-    for application in applications:
-        application['status'] = ApplicationStatus(application['status']).name
-    return jsonify(applications), 200
+    return json_response(Application.serializer().dumps(applications))
 
 def get_application_count():
     """
@@ -214,26 +327,21 @@ def get_application_count():
     :return: JSON response with the count of applications
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COUNT(*) FROM applications
-    ''')
-    count = cursor.fetchone()[0]
+    count = get_stat(conn.cursor(), APPLICATIONS_STAT)
     conn.close()
     return jsonify({"application_count": count}), 200
 
 def get_application_count_by_status(status: ApplicationStatus):
     """
     Retrieve the count of applications by their status.
-    :param status: Status of the applications to count
+    :param status: Status of the applications to count, by name or value
     :return: JSON response with the count of applications matching the status
     """
+    value = _STATUS_VALUES.get(status)
+    if value is None:
+        return jsonify({"error": "Invalid status"}), 400
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COUNT(*) FROM applications WHERE status = ?
-    ''', (status,))
-    count = cursor.fetchone()[0]
+    count = get_stat(conn.cursor(), APPLICATIONS_STATUS_STAT + value)
     conn.close()
     return jsonify({"application_count": count}), 200
 
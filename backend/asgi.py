@@ -0,0 +1,176 @@
+"""
+ASGI entry point for the API.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+The Flask handlers stay synchronous; this adapter only changes who waits.
+Reading the request body, keeping idle keep-alive connections open and writing
+responses to slow clients all happen on the event loop, and a thread from a
+bounded pool is taken only while a handler actually runs (including its SQLite
+and bcrypt work). A process can therefore keep far more connections open, e.g.
+dashboards polling with If-None-Match, than it has threads.
+
+Responses up to STREAM_THRESHOLD bytes are buffered and the thread is released
+before they are sent; larger ones (exports, big lists) are streamed from the
+handler thread with the event loop applying backpressure.
+
+No third-party ASGI library is needed; any ASGI 3 server can load
+``asgi:application``.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from main import app
+from database import init_db
+
+ASGI_THREADS = int(os.environ.get('PETADOPTION_ASGI_THREADS', '32'))
+STREAM_THRESHOLD = 256 * 1024
+SPOOL_SIZE = 1024 * 1024  # request bodies larger than this go to a temp file
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi')
+
+
+def build_environ(scope, body):
+    """
+    Translate an ASGI http scope into a WSGI environ.
+    :param scope: ASGI connection scope
+    :param body: File object holding the whole request body, positioned at 0
+    :return: WSGI environ dictionary
+    """
+    size = body.seek(0, os.SEEK_END)
+    body.seek(0)
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    # the body has already been read in full (and de-chunked), so its real size
+    # replaces whatever framing the client used
+    environ.pop('HTTP_TRANSFER_ENCODING', None)
+    environ['CONTENT_LENGTH'] = str(size)
+    return environ
+
+
+def _send_from_thread(loop, send, message):
+    asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+
+def run_wsgi(environ, loop, send):
+    """
+    Run the Flask app for one request on a pool thread.
+    :return: Tuple (status, headers, body) for a buffered response, or None if
+             the response was too large and has already been streamed
+    """
+    response = {}
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response.get('streaming'):
+            raise exc_info[1].with_traceback(exc_info[2])
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers]
+        return written.append
+
+    result = app.wsgi_app(environ, start_response)
+    try:
+        chunks = iter(result)
+        body = written
+        size = sum(len(chunk) for chunk in body)
+        for chunk in chunks:
+            body.append(chunk)
+            size += len(chunk)
+            if size > STREAM_THRESHOLD:
+                break
+        else:
+            return response['status'], response['headers'], b''.join(body)
+        response['streaming'] = True
+        _send_from_thread(loop, send, {'type': 'http.response.start',
+                                       'status': response['status'],
+                                       'headers': response['headers']})
+        _send_from_thread(loop, send, {'type': 'http.response.body',
+                                       'body': b''.join(body), 'more_body': True})
+        for chunk in chunks:
+            if chunk:
+                _send_from_thread(loop, send, {'type': 'http.response.body',
+                                               'body': chunk, 'more_body': True})
+        _send_from_thread(loop, send, {'type': 'http.response.body', 'body': b''})
+        return None
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+async def _lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await loop.run_in_executor(_executor, init_db)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _http(scope, receive, send):
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)  # pylint: disable=consider-using-with
+    try:
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_executor, run_wsgi,
+                                            build_environ(scope, body), loop, send)
+    finally:
+        body.close()
+    if result is not None:
+        status, headers, content = result
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+
+async def application(scope, receive, send):
+    """
+    ASGI 3 application wrapping the Flask app.
+    The lifespan startup runs init_db (pending migrations) once per process.
+    """
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http':
+        await _http(scope, receive, send)
+    else:
+        raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
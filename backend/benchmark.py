@@ -0,0 +1,258 @@
+"""
+HTTP load benchmark.
+
+Seeds a fresh database at the requested scale, starts the production server on
+a local port and replays a weighted mix of browsing, searching, logins,
+application submits and staff polling from many keep-alive clients. Prints
+(or writes) a JSON report with the overall throughput and, per route, the
+request count, error count and p50/p95/p99 latency in milliseconds.
+
+    python benchmark.py --pets 20000 --users 500 --duration 30 --clients 32
+    python benchmark.py --url http://127.0.0.1:5000 ...   # an already running server
+
+Compare the reports of two releases to catch regressions.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlsplit
+import db
+from database import init_db
+from seed import generate, user_email, staff_email, PASSWORD, SPECIES
+
+WORDS = ['friendly', 'energetic', 'calm', 'shy', 'playful', 'gentle', 'curious', 'walks',
+         'treats', 'naps', 'fetch', 'children']
+
+# route name -> relative weight in the traffic mix
+MIX = {
+    'browse_pets': 35,
+    'pet_detail': 15,
+    'filter_pets': 10,
+    'search_pets': 10,
+    'login': 5,
+    'submit_application': 5,
+    'staff_poll_applications': 20,
+}
+
+
+def seed(path, pets, users, rng_seed):
+    """Create a fresh database with generated data, see seed.py."""
+    db.configure(path=path)
+    init_db(first_run=True, mock_data=False)
+    generate(pets, users, seed=rng_seed)
+
+
+def free_port():
+    """Ask the OS for an unused TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(path, port, workers, threads):
+    """Start serve.py against the seeded database and wait until it answers."""
+    env = dict(os.environ, PETADOPTION_DB=path, PETADOPTION_BIND=f'127.0.0.1:{port}',
+               PETADOPTION_WORKERS=str(workers), PETADOPTION_THREADS=str(threads))
+    env.pop('PETADOPTION_MAX_REQUESTS', None)
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, 'serve.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('server did not start')
+
+
+class Client:
+    """One simulated visitor: a keep-alive connection and a logged-in session."""
+    def __init__(self, host, port, rng, pets, users):
+        self.host, self.port = host, port
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.rng = rng
+        self.pets = pets
+        self.users = users
+        self.cursor = None
+        self.cookie = None
+        self.staff_cookie = None
+
+    def request(self, method, path, body=None, cookie=None):
+        """Send one request, reconnecting once if the server closed the connection."""
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        if cookie:
+            headers['Cookie'] = cookie
+        payload = json.dumps(body) if body is not None else None
+        for attempt in (1, 2):
+            try:
+                self.conn.request(method, path, payload, headers)
+                response = self.conn.getresponse()
+                response.read()
+                return response
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                if attempt == 2:
+                    raise
+        return None
+
+    def login(self, email):
+        """Log in and return the session cookie."""
+        response = self.request('POST', '/login', {'email': email, 'password': PASSWORD})
+        cookie = response.getheader('Set-Cookie')
+        return cookie.split(';', 1)[0] if cookie else None
+
+    def run(self, route):
+        """Perform one operation of the mix; returns the response status."""
+        rng = self.rng
+        if route == 'browse_pets':
+            path = '/api/pets?limit=24' + (f'&cursor={self.cursor}' if self.cursor else '')
+            response = self.request('GET', path)
+            self.cursor = response.getheader('X-Next-Cursor') if rng.random() < 0.8 else None
+        elif route == 'pet_detail':
+            response = self.request('GET', f'/api/pets/{rng.randint(1, self.pets)}')
+        elif route == 'filter_pets':
+            species = rng.choice(list(SPECIES))
+            response = self.request('GET', f'/api/pets?species={quote(species)}&status=AVAILABLE'
+                                           '&limit=24')
+        elif route == 'search_pets':
+            response = self.request('GET', f'/api/pets?q={rng.choice(WORDS)}&limit=24')
+        elif route == 'login':
+            response = self.request('POST', '/login', {
+                'email': user_email(rng.randrange(self.users)), 'password': PASSWORD})
+        elif route == 'submit_application':
+            if self.cookie is None:
+                self.cookie = self.login(user_email(rng.randrange(self.users)))
+            response = self.request('POST', '/api/applications',
+                                    {'pet_id': rng.randint(1, self.pets)}, self.cookie)
+        else:
+            if self.staff_cookie is None:
+                self.staff_cookie = self.login(staff_email(0))
+            response = self.request('GET', '/api/applications?status=Pending&limit=50',
+                                    cookie=self.staff_cookie)
+        return response.status
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_load(host, port, args):
+    """Drive the traffic mix from args.clients threads for args.duration seconds."""
+    routes = list(MIX)
+    weights = [MIX[route] for route in routes]
+    samples = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        rng = random.Random(args.seed * 1000 + index)
+        client = Client(host, port, rng, args.pets, args.users)
+        local = {route: [] for route in routes}
+        failed = {route: 0 for route in routes}
+        while time.monotonic() < deadline:
+            route = rng.choices(routes, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = client.run(route)
+            except (http.client.HTTPException, OSError):
+                status = 0
+            local[route].append((time.perf_counter() - start) * 1000)
+            # the API answers an empty list or search with 404
+            if status == 0 or (status >= 400 and status != 404):
+                failed[route] += 1
+        with lock:
+            for route in routes:
+                samples[route].extend(local[route])
+                errors[route] += failed[route]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    report = {'routes': {}}
+    total = 0
+    for route in routes:
+        values = sorted(samples[route])
+        total += len(values)
+        report['routes'][route] = {
+            'requests': len(values),
+            'errors': errors[route],
+            'throughput_rps': round(len(values) / elapsed, 1),
+            'p50_ms': _round(percentile(values, 0.50)),
+            'p95_ms': _round(percentile(values, 0.95)),
+            'p99_ms': _round(percentile(values, 0.99)),
+            'max_ms': _round(values[-1] if values else None),
+        }
+    report['requests'] = total
+    report['errors'] = sum(errors.values())
+    report['elapsed_s'] = round(elapsed, 2)
+    report['throughput_rps'] = round(total / elapsed, 1)
+    return report
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def main(argv=None):
+    """Parse the command line, seed, start the server, run the mix and report."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--pets', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help='benchmark this running server instead (already seeded)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.url:
+            parts = urlsplit(args.url)
+            host, port = parts.hostname, parts.port or 80
+        else:
+            path = os.path.join(tmp, 'benchmark.db')
+            seed(path, args.pets, args.users, args.seed)
+            host, port = '127.0.0.1', free_port()
+            server = start_server(path, port, args.workers, args.threads)
+        try:
+            report = run_load(host, port, args)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=60)
+    report['config'] = {key: value for key, value in vars(args).items() if key != 'output'}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+init_app compresses text and JSON responses of at least COMPRESS_MIN_SIZE
+bytes with brotli (when the brotli package is installed) or gzip, whichever
+the client prefers. Streamed and already encoded responses are left alone.
+
+Responses with a strong ETag (the @conditional catalog routes) depend only on
+that tag, so their compressed bodies are kept in a small LRU cache keyed by
+tag and encoding: a hit on the pet list or questionnaire costs a dictionary
+lookup, not a compression. Each encoding gets its own tag (see
+http_cache.encoded_etag) and If-None-Match accepts all of them.
+
+Settings come from the environment:
+
+    PETADOPTION_COMPRESS_MIN_SIZE  smallest body to compress, in bytes (1024)
+    PETADOPTION_GZIP_LEVEL         gzip level 1-9 (6)
+    PETADOPTION_BROTLI_QUALITY     brotli quality 0-11 (5)
+    PETADOPTION_COMPRESS_CACHE_MB  memory for cached compressed bodies (32, 0 = off)
+"""
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from flask import request
+from http_cache import encoded_etag
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('PETADOPTION_COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('PETADOPTION_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('PETADOPTION_BROTLI_QUALITY', '5'))
+CACHE_BYTES = int(float(os.environ.get('PETADOPTION_COMPRESS_CACHE_MB', '32')) * 1024 * 1024)
+
+COMPRESSIBLE = {'application/json', 'text/plain', 'text/html', 'text/csv', 'text/css',
+                'application/javascript', 'image/svg+xml'}
+
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+def encoders():
+    """
+    Get the available encodings in order of preference.
+    :return: List of (content coding, compress function)
+    """
+    available = [('gzip', _gzip)]
+    if brotli is not None:
+        available.insert(0, ('br', _brotli))
+    return available
+
+
+class CompressedCache:
+    """Compressed bodies by (ETag, encoding), least recently used first out."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get a cached body, or None."""
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        """Store a body, evicting the least recently used ones to stay within max_bytes."""
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        """Drop every entry."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+cache = CompressedCache(CACHE_BYTES)
+
+
+def negotiate(accept_encodings):
+    """
+    Pick the content coding to use.
+    :param accept_encodings: The request's parsed Accept-Encoding header
+    :return: (content coding, compress function), or None to send the body as is
+    """
+    best, best_quality = None, 0
+    for encoding, compress in encoders():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:  # ties keep the earlier, preferred encoding
+            best, best_quality = (encoding, compress), quality
+    return best
+
+
+def compress_response(response):
+    """
+    Compress a response in place if the client and the response allow it.
+    :param response: Flask response about to be sent
+    :return: The response
+    """
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    choice = negotiate(request.accept_encodings)
+    if choice is None:
+        return response
+    encoding, compress = choice
+    etag, weak = response.get_etag()
+    key = (etag, encoding) if etag and not weak and cache.max_bytes else None
+    body = cache.get(key) if key else None
+    if body is None:
+        body = compress(data)
+        if key:
+            cache.put(key, body)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    return response
+
+
+def init_app(app):
+    """
+    Compress the responses of a Flask app.
+    :param app: Flask application
+    """
+    app.after_request(compress_response)
@@ -0,0 +1,22 @@
+"""Shared pytest fixtures"""
+#pylint: disable=redefined-outer-name
+import os
+import pytest
+
+# Cheap hashes keep the suite fast; must be set before passwords is imported.
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+import db  # pylint: disable=wrong-import-position
+from database import init_db  # pylint: disable=wrong-import-position
+
+@pytest.fixture
+def pool(tmp_path):
+    """Points the connection pool at a throwaway database"""
+    db.configure(path=str(tmp_path / "test.db"))
+    yield db
+    db.reset()
+
+@pytest.fixture
+def schema(pool):
+    """A throwaway database with every table created and the mock data loaded"""
+    init_db(first_run=True)
+    return pool
@@ -0,0 +1,44 @@
+"""
+Staff dashboard counters.
+
+The numbers come from the stats table, which triggers on applications,
+questionnaire_responses and users keep current (see migration 8), so reading
+them is a primary key lookup instead of a COUNT over the underlying tables.
+"""
+from flask import jsonify
+from db import get_db_connection
+from enums import ApplicationStatus
+from migrations import APPLICATIONS_STAT, APPLICATIONS_STATUS_STAT, OPEN_QUESTIONNAIRES_STAT
+
+
+def get_stat(cursor, name):
+    """
+    Read one counter.
+    :param cursor: Cursor to read with
+    :param name: Row of the stats table
+    :return: The counter, 0 if it was never set
+    """
+    cursor.execute('SELECT value FROM stats WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_dashboard_summary():
+    """
+    Get every dashboard counter at once.
+    :return: JSON response with the application counts (in total and per status)
+    and the number of open questionnaires
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT name, value FROM stats')
+    stats = dict(cursor.fetchall())
+    conn.close()
+    return jsonify({
+        "applications": {
+            "total": stats.get(APPLICATIONS_STAT, 0),
+            "by_status": {status.name: stats.get(APPLICATIONS_STATUS_STAT + status.value, 0)
+                          for status in ApplicationStatus},
+        },
+        "open_questionnaires": stats.get(OPEN_QUESTIONNAIRES_STAT, 0),
+    }), 200
@@ -4,11 +4,33 @@ Utility module for initializing the SQLite3 database.
 This file is not meant to be executed directly.
 """
 
-import sqlite3
+import db
+from db import get_db_connection
+from migrations import run_migrations
 from enums import PetStatus
 from user import create_user, Role
 from flask import request, jsonify
-import bcrypt
+from passwords import hash_password
+
+# A handful of pets for trying the site out; seed.py generates data at scale.
+MOCK_PETS = [
+    ('Larry', 'Dog', 'Golden Retriever', 3, 'Friendly and energetic.',
+     PetStatus.AVAILABLE.value, 'http://example.com/Larry.jpg'),
+    ('Barry', 'Cat', 'Siamese', 2, 'Loves to cuddle.',
+     PetStatus.ADOPTED.value, 'http://example.com/Barry.jpg'),
+    ('Garry', 'Dog', 'Beagle', 4, 'Great with kids.',
+     PetStatus.AVAILABLE.value, 'http://example.com/Garry.jpg'),
+    ('Marry', 'Cat', 'Orange', 3, 'Hates little children.',
+     PetStatus.AVAILABLE.value, 'http://example.com/Marry.jpg'),
+    ('Parry', 'Parrot', 'Cockatoo', 2, 'Super annoying',
+     PetStatus.AVAILABLE.value, 'http://example.com/Barry.jpg'),
+    ('Tarry', 'Eagle', 'Bald Eagle', 4, 'Super scary',
+     PetStatus.AVAILABLE.value, 'http://example.com/Garry.jpg'),
+    ('Farry', 'Ferret', 'Sable', 3, 'Friendly and energetic.',
+     PetStatus.AVAILABLE.value, 'http://example.com/Larry.jpg'),
+    ('Harry', 'Dog', 'Mutt', 2, 'Loves to cuddle.',
+     PetStatus.ADOPTED.value, 'http://example.com/Barry.jpg'),
+]
 
 def register_page():
     """
@@ -24,7 +46,7 @@ def register_page():
         phone = "123-456-7890"
         role = Role.ADMIN
 
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        hashed_password = hash_password(password.encode('utf-8'))
         user_data = {
             "email": email,
             "password_hash": hashed_password,
@@ -37,20 +59,35 @@ def register_page():
     return jsonify({"error": "Unsupported Content-Type"}), 400
 
 
-def init_db(db_name="petadoption.db", first_run=False):
-    """Initialize the SQLite3 database."""
-    connection = sqlite3.connect(db_name)
-    connection.execute("PRAGMA foreign_keys = ON") # allows us to use foreign keys to link tables
+def init_db(db_name=None, first_run=False, mock_data=True):
+    """
+    Initialize the SQLite3 database.
+    :param db_name: (optional) Database file to use, defaults to the pool's configured path
+    :param first_run: Drop and recreate every table, then insert the mock data
+    :param mock_data: (optional) Set to False to leave the new tables empty, e.g. for seed.py
+    Pending schema migrations are applied afterwards, existing data is kept.
+    """
+    if db_name is not None:
+        db.configure(path=db_name)
+    connection = get_db_connection()
     cursor = connection.cursor()
 
     if first_run:
-        # Drop existing tables if first run
-        cursor.execute('DROP TABLE IF EXISTS users')
-        cursor.execute('DROP TABLE IF EXISTS pets')
+        # Drop existing tables if first run (children first, foreign keys are enforced)
+        cursor.execute('DROP TABLE IF EXISTS export_jobs')
         cursor.execute('DROP TABLE IF EXISTS applications')
-        cursor.execute('DROP TABLE IF EXISTS questionaire_responses')
-        cursor.execute('DROP TABLE IF EXISTS questions')
+        cursor.execute('DROP TABLE IF EXISTS questionnaire_submissions')
+        cursor.execute('DROP TABLE IF EXISTS questionnaire_responses')
         cursor.execute('DROP TABLE IF EXISTS choices')
+        cursor.execute('DROP TABLE IF EXISTS questions')
+        cursor.execute('DROP TABLE IF EXISTS questionnaire_versions')
+        cursor.execute('DROP TABLE IF EXISTS pets_fts')
+        cursor.execute('DROP TABLE IF EXISTS pets')
+        cursor.execute('DROP TABLE IF EXISTS pet_photos')
+        cursor.execute('DROP TABLE IF EXISTS users')
+        cursor.execute('DROP TABLE IF EXISTS schema_version')
+        cursor.execute('DROP TABLE IF EXISTS change_versions')
+        cursor.execute('DROP TABLE IF EXISTS stats')
 
     # Create pets table
     cursor.execute('''
@@ -128,44 +165,12 @@ def init_db(db_name="petadoption.db", first_run=False):
                 )
                 ''')
 
-    if first_run:
-        # Insert mock data into pets table
-        cursor.execute('''
-                    INSERT INTO pets (name, species, breed, age, description, status, image_url)
-                    VALUES
-                    (?, ?, ?, ?, ?, ?, ?),
-                    (?, ?, ?, ?, ?, ?, ?),
-                    (?, ?, ?, ?, ?, ?, ?)
-                    ''',
-                    ('Larry', 'Dog', 'Golden Retriever', 3, 'Friendly and energetic.',
-                        PetStatus.AVAILABLE.value, 'http://example.com/Larry.jpg',
-                     'Barry', 'Cat', 'Siamese', 2, 'Loves to cuddle.', 
-                        PetStatus.ADOPTED.value, 'http://example.com/Barry.jpg',
-                     'Garry', 'Dog', 'Beagle', 4, 'Great with kids.', 
-                        PetStatus.AVAILABLE.value, 'http://example.com/Garry.jpg'))
-        cursor.execute('''
-                    INSERT INTO pets (name, species, breed, age, description, status, image_url)
-                    VALUES
-                    (?, ?, ?, ?, ?, ?, ?),
-                    (?, ?, ?, ?, ?, ?, ?),
-                    (?, ?, ?, ?, ?, ?, ?)
-                    ''',
-                    ('Marry', 'Cat', 'Orange', 3, 'Hates little children.',
-                        PetStatus.AVAILABLE.value, 'http://example.com/Marry.jpg',
-                     'Parry', 'Parrot', 'Cockatoo', 2, 'Super annoying', 
-                        PetStatus.AVAILABLE.value, 'http://example.com/Barry.jpg',
-                     'Tarry', 'Eagle', 'Bald Eagle', 4, 'Super scary', 
-                        PetStatus.AVAILABLE.value, 'http://example.com/Garry.jpg'))
-        cursor.execute('''
+    if first_run and mock_data:
+        cursor.executemany('''
                     INSERT INTO pets (name, species, breed, age, description, status, image_url)
-                    VALUES
-                    (?, ?, ?, ?, ?, ?, ?),
-                    (?, ?, ?, ?, ?, ?, ?)
-                    ''',
-                    ('Farry', 'Ferret', 'Sable', 3, 'Friendly and energetic.',
-                        PetStatus.AVAILABLE.value, 'http://example.com/Larry.jpg',
-                     'Harry', 'Dog', 'Mutt', 2, 'Loves to cuddle.', 
-                        PetStatus.ADOPTED.value, 'http://example.com/Barry.jpg'))
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', MOCK_PETS)
 
     connection.commit()
+    run_migrations(connection)
     connection.close()
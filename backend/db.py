@@ -0,0 +1,335 @@
+"""
+Shared SQLite connection manager.
+
+Every module gets its connections from here instead of opening its own.
+Each thread keeps one connection for its lifetime; when the thread exits the
+connection goes back to an idle pool so the next thread can reuse it instead
+of paying the connection setup (and PRAGMA) cost again.
+
+Callers keep the usual pattern::
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    ...
+    conn.close()
+
+``close()`` on a pooled connection only releases it; any transaction left open
+by the caller is rolled back so the next user starts from a clean state.
+init_app makes Flask release whatever a request left checked out, so a handler
+that raises before its close() cannot keep the thread's connection held.
+"""
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from time import perf_counter
+
+DB_PATH = os.environ.get('PETADOPTION_DB', 'petadoption.db')
+MAX_IDLE = int(os.environ.get('PETADOPTION_DB_MAX_IDLE', '16'))
+# Largest number of items a batch endpoint accepts in one request.
+MAX_BATCH_SIZE = 1000
+
+# Applied once, when a connection is first opened.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'busy_timeout': 5000,
+    'cache_size': -16000,     # negative means KiB, so ~16 MB per connection
+    'mmap_size': 268435456,   # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+_idle = []
+_all = weakref.WeakSet()
+_generation = 0
+_reset_callbacks = []
+_query_callbacks = []
+_stats = {
+    'opened': 0,
+    'closed': 0,
+    'acquired': 0,
+    'reused_idle': 0,
+    'released': 0,
+    'rollbacks_on_release': 0,
+    'leaked': 0,
+}
+
+
+def _observe(cursor, sql, parameters, seconds):
+    for callback in _query_callbacks:
+        callback(cursor, sql, parameters, seconds)
+
+
+class PooledCursor(sqlite3.Cursor):
+    """
+    Cursor that reports each statement to the on_query callbacks.
+    The time measured is execute() itself, i.e. up to the first result row.
+    """
+    def execute(self, sql, parameters=(), /):
+        if not _query_callbacks:
+            return super().execute(sql, parameters)
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe(self, sql, parameters, perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        if not _query_callbacks:
+            return super().executemany(sql, seq_of_parameters)
+        start = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe(self, sql, None, perf_counter() - start)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A sqlite3 connection owned by the pool.
+    close() hands the connection back instead of closing it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.depth = 0
+        self.generation = _generation
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        """Release the connection back to the pool."""
+        release(self)
+
+    def close_for_real(self):
+        """Actually close the underlying SQLite handle."""
+        super().close()
+
+
+class _Slot:
+    """Holds the connection checked out by one thread."""
+    def __init__(self, conn):
+        self.conn = conn
+
+
+def _open():
+    conn = sqlite3.connect(DB_PATH, factory=PooledConnection, check_same_thread=False)
+    conn.row_factory = sqlite3.Row  # Allows accessing columns by name
+    for name, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    with _lock:
+        _stats['opened'] += 1
+        _all.add(conn)
+    return conn
+
+
+def _return_to_idle(conn):
+    """Called when the owning thread goes away."""
+    with _lock:
+        if conn.generation == _generation and len(_idle) < MAX_IDLE:
+            _idle.append(conn)
+            return
+        _stats['closed'] += 1
+    conn.close_for_real()
+
+
+def get_db_connection():
+    """
+    Get the calling thread's pooled connection to the SQLite database.
+    :return: SQLite connection object
+    """
+    slot = getattr(_local, 'slot', None)
+    if slot is None or slot.conn.generation != _generation:
+        conn = None
+        with _lock:
+            while _idle:
+                candidate = _idle.pop()
+                if candidate.generation == _generation:
+                    conn = candidate
+                    _stats['reused_idle'] += 1
+                    break
+        if conn is None:
+            conn = _open()
+        slot = _Slot(conn)
+        weakref.finalize(slot, _return_to_idle, conn)
+        _local.slot = slot
+    conn = slot.conn
+    conn.depth += 1
+    _stats['acquired'] += 1  # counters are best effort, not locked on the hot path
+    return conn
+
+
+def release(conn):
+    """
+    Give a connection back to the pool.
+    Nested callers share the thread's connection, so only the outermost
+    release rolls back whatever was left uncommitted.
+    """
+    conn.depth = max(conn.depth - 1, 0)
+    _stats['released'] += 1
+    if conn.depth == 0 and conn.in_transaction:
+        conn.rollback()
+        _stats['rollbacks_on_release'] += 1
+
+
+@contextmanager
+def transaction(conn, immediate=True):
+    """
+    Run a block in one explicit transaction, committing at the end or rolling
+    back on error. BEGIN IMMEDIATE takes the write lock up front, so reads made
+    inside the block cannot be invalidated by another writer before it commits.
+    :param conn: Connection from get_db_connection
+    :param immediate: Use BEGIN IMMEDIATE instead of a deferred BEGIN
+    """
+    if conn.in_transaction:
+        raise sqlite3.ProgrammingError('transaction() called with a transaction already open')
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def held():
+    """
+    How many times the calling thread has its connection checked out.
+    :return: Number of get_db_connection calls not yet matched by close()
+    """
+    slot = getattr(_local, 'slot', None)
+    return slot.conn.depth if slot is not None else 0
+
+
+def release_to(depth):
+    """
+    Release the calling thread's connection until it is held only depth times,
+    rolling back like close() once nobody holds it.
+    :param depth: Hold count to go back to, e.g. what held() returned earlier
+    :return: Number of releases that were missing
+    """
+    slot = getattr(_local, 'slot', None)
+    if slot is None or slot.conn.depth <= depth:
+        return 0
+    missing = slot.conn.depth - depth
+    for _ in range(missing):
+        release(slot.conn)
+    _stats['leaked'] += missing
+    return missing
+
+
+def _before_request():
+    _local.request_depth = held()
+
+
+def _teardown_request(_exc):
+    release_to(getattr(_local, 'request_depth', 0))
+
+
+def init_app(app):
+    """
+    Release connections a request handler left checked out, e.g. after an exception.
+    :param app: Flask application
+    """
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+
+
+def existing_ids(cursor, table: str, column: str, ids):
+    """
+    Find which of the given IDs exist, in chunks small enough for SQLite's
+    bound-parameter limit.
+
+    :param cursor: Cursor inside the caller's transaction
+    :param table: Table to look in
+    :param column: Primary key column
+    :param ids: IDs to check
+    :return: Set of the IDs that exist
+    """
+    ids = list(dict.fromkeys(ids))
+    found = set()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        cursor.execute(f'SELECT {column} FROM {table} WHERE {column} IN '
+                       f'({", ".join("?" for _ in chunk)})', chunk)
+        found.update(row[0] for row in cursor.fetchall())
+    return found
+
+
+def on_reset(callback):
+    """
+    Register a function to call whenever the pool is reset, so modules holding
+    data cached from the database can drop it.
+    :param callback: Function without arguments
+    :return: The callback, so this can be used as a decorator
+    """
+    _reset_callbacks.append(callback)
+    return callback
+
+
+def on_query(callback):
+    """
+    Register a function to call after every statement run through a pooled
+    connection, e.g. to collect timings.
+    :param callback: Function taking (cursor, sql, parameters, seconds);
+                     parameters is None for executemany
+    :return: The callback, so this can be used as a decorator
+    """
+    if callback not in _query_callbacks:
+        _query_callbacks.append(callback)
+    return callback
+
+
+def configure(path=None, **pragmas):
+    """
+    Point the pool at another database file and/or override PRAGMAs.
+    Existing connections are retired and closed.
+    """
+    global DB_PATH  # pylint: disable=global-statement
+    if path is not None:
+        DB_PATH = path
+    PRAGMAS.update(pragmas)
+    reset()
+
+
+def reset():
+    """
+    Retire every pooled connection, e.g. after a fork or a path change.
+    Threads pick up a fresh connection on their next call.
+    """
+    global _generation  # pylint: disable=global-statement
+    with _lock:
+        _generation += 1
+        idle = list(_idle)
+        _idle.clear()
+        _stats['closed'] += len(idle)
+    for conn in idle:
+        conn.close_for_real()
+    # Dropping the slot fires its finalizer, which closes the retired connection.
+    _local.slot = None
+    for callback in _reset_callbacks:
+        callback()
+
+
+def pool_stats():
+    """
+    Snapshot of the pool counters.
+    :return: Dictionary of pool statistics
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats['idle'] = len(_idle)
+        stats['live'] = sum(1 for conn in _all if conn.generation == _generation)
+    stats['path'] = DB_PATH
+    stats['max_idle'] = MAX_IDLE
+    return stats
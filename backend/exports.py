@@ -0,0 +1,212 @@
+"""
+Background bulk exports of applications, users and questionnaire responses.
+
+A request only records a job in export_jobs and hands it to a small worker
+pool; the worker streams the rows with fetchmany into a CSV or NDJSON file
+(optionally gzip compressed) under EXPORT_DIR, updating the job's progress as
+it goes. The finished file is served by download_export.
+"""
+import csv
+import gzip
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify, send_file
+from db import get_db_connection, on_reset
+from enums import Role
+
+EXPORT_DIR = os.path.abspath(os.environ.get('PETADOPTION_EXPORT_DIR', 'exports'))
+EXPORT_WORKERS = int(os.environ.get('PETADOPTION_EXPORT_WORKERS', '2'))
+FETCH_SIZE = 1000
+
+# kind -> (minimum role, query); password hashes are never exported
+EXPORTS = {
+    'applications': (Role.STAFF, '''
+        SELECT application_id, user_id, pet_id, status, submitted_at, updated_at,
+               reviewed_at, reviewer_id
+        FROM applications ORDER BY application_id
+    '''),
+    'users': (Role.ADMIN, '''
+        SELECT user_id, email, full_name, phone, role, approved, created_at
+        FROM users ORDER BY user_id
+    '''),
+    'questionnaire_responses': (Role.STAFF, '''
+        SELECT qr.response_id, qr.user_id, qr.question_id, q.question_text, qr.answer_text,
+               qr.created_at
+        FROM questionnaire_responses qr
+        JOIN questions q ON q.question_id = qr.question_id
+        ORDER BY qr.response_id
+    '''),
+}
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+@on_reset
+def _drop_executor():
+    """Forget the worker pool, e.g. in a freshly forked worker process."""
+    global _executor  # pylint: disable=global-statement
+    _executor = None
+
+
+def _get_executor():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS,
+                                           thread_name_prefix='export')
+        return _executor
+
+
+def _update_job(job_id, **fields):
+    conn = get_db_connection()
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn.execute(f'UPDATE export_jobs SET {assignments} WHERE job_id = ?',
+                 (*fields.values(), job_id))
+    conn.commit()
+    conn.close()
+
+
+def _open_output(path, compressed):
+    if compressed:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def run_export(job_id, kind, fmt, compressed):
+    """
+    Write an export file; runs on the export worker pool.
+    :param job_id: ID of the job in export_jobs
+    :param kind: Key of EXPORTS
+    :param fmt: 'csv' or 'ndjson'
+    :param compressed: gzip the output
+    """
+    extension = fmt + ('.gz' if compressed else '')
+    path = os.path.join(EXPORT_DIR, f'{kind}-{job_id}.{extension}')
+    partial = path + '.part'
+    try:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            sql = EXPORTS[kind][1]
+            cursor.execute(f'SELECT COUNT(*) FROM ({sql})')
+            total = cursor.fetchone()[0]
+            _update_job(job_id, status='running', total_rows=total)
+            written = 0
+            with _open_output(partial, compressed) as out:
+                cursor.execute(sql)
+                columns = [column[0] for column in cursor.description]
+                writer = csv.writer(out) if fmt == 'csv' else None
+                if writer:
+                    writer.writerow(columns)
+                while True:
+                    rows = cursor.fetchmany(FETCH_SIZE)
+                    if not rows:
+                        break
+                    if writer:
+                        writer.writerows(tuple(row) for row in rows)
+                    else:
+                        out.writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+                    written += len(rows)
+                    _update_job(job_id, rows_written=written)
+        finally:
+            conn.close()
+        os.replace(partial, path)
+        _update_job(job_id, status='done', rows_written=written, file_path=path,
+                    finished_at=_now())
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        if os.path.exists(partial):
+            os.remove(partial)
+        _update_job(job_id, status='failed', error=str(e), finished_at=_now())
+
+
+def _now():
+    """Current UTC time in the same format as CURRENT_TIMESTAMP."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def start_export(data, user_id, role):
+    """
+    Queue a new export job.
+    :param data: Dictionary with kind, format ('csv' or 'ndjson') and optional gzip flag
+    :param user_id: ID of the requesting user
+    :param role: Role of the requesting user
+    :return: JSON response with the job, 202 Accepted
+    """
+    if not data or data.get('kind') not in EXPORTS:
+        return jsonify({"error": f"kind must be one of {', '.join(EXPORTS)}"}), 400
+    kind = data['kind']
+    fmt = data.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    if role < EXPORTS[kind][0]:
+        return jsonify({"error": "You do not have permission to access this resource"}), 403
+    compressed = bool(data.get('gzip', False))
+    job_id = uuid.uuid4().hex
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO export_jobs (job_id, kind, format, compressed, requested_by)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (job_id, kind, fmt, compressed, user_id))
+    conn.commit()
+    conn.close()
+    _get_executor().submit(run_export, job_id, kind, fmt, compressed)
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+
+def _get_job(job_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM export_jobs WHERE job_id = ?', (job_id,))
+    job = cursor.fetchone()
+    conn.close()
+    return dict(job) if job else None
+
+
+def _forbidden(job, role):
+    """Whether role may not see a job; reading an export needs the role that creating it did."""
+    return role < EXPORTS[job['kind']][0]
+
+
+def get_export(job_id, role):
+    """
+    Report the state and progress of an export job.
+    :param job_id: ID of the job
+    :param role: Role of the requesting user
+    :return: JSON response with the job
+    """
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Export not found"}), 404
+    if _forbidden(job, role):
+        return jsonify({"error": "You do not have permission to access this resource"}), 403
+    job['gzip'] = bool(job.pop('compressed'))
+    del job['file_path']
+    job['progress'] = (job['rows_written'] / job['total_rows']) if job['total_rows'] else \
+        (1.0 if job['status'] == 'done' else 0.0)
+    return jsonify(job), 200
+
+
+def download_export(job_id, role):
+    """
+    Send the file of a finished export job.
+    :param job_id: ID of the job
+    :param role: Role of the requesting user
+    :return: File response, or a JSON error if the export is missing, not allowed or not finished
+    """
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Export not found"}), 404
+    if _forbidden(job, role):
+        return jsonify({"error": "You do not have permission to access this resource"}), 403
+    if job['status'] != 'done':
+        return jsonify({"error": f"Export is {job['status']}"}), 409
+    return send_file(job['file_path'], as_attachment=True,
+                     mimetype='application/gzip' if job['compressed'] else FORMATS[job['format']],
+                     download_name=os.path.basename(job['file_path']))
@@ -0,0 +1,117 @@
+"""
+In-memory species / breed / status counts for the pet filter dropdowns.
+
+The index is built with one GROUP BY over pets, read in the same transaction
+as the pets change version, and then kept current by the pet handlers, which
+report each change together with the pets change version it produced. As
+long as those versions follow on from the one the index was built at, the
+change is applied in place; if a version was skipped (another worker process
+wrote to pets) the index is rebuilt on the next read.
+"""
+import threading
+from db import get_db_connection, on_reset, transaction
+from enums import PetStatus
+from versions import get_version, invalidate
+
+_STATUS_NAMES = {status.value: status.name for status in PetStatus}
+
+
+def status_name(value):
+    """Map a stored status value to the name used by the API, e.g. 'AVAILABLE'."""
+    return _STATUS_NAMES.get(value, value)
+
+
+class FacetIndex:
+    """Counts of pets per (species, breed, status)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._version = None
+        self._views = {}
+
+    def _rebuild(self):
+        # the version is read uncached and in the same read transaction as the
+        # counts, so a pet written in between cannot be counted twice
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            with transaction(conn, immediate=False):
+                cursor.execute("SELECT version FROM change_versions WHERE name = 'pets'")
+                current = cursor.fetchone()
+                version = current['version'] if current is not None else 0
+                cursor.execute('''
+                    SELECT species, breed, status, COUNT(*) AS n
+                    FROM pets
+                    GROUP BY species, breed, status
+                ''')
+                counts = {(row['species'], row['breed'], row['status']): row['n']
+                          for row in cursor.fetchall()}
+        finally:
+            conn.close()
+        self._counts = counts
+        self._version = version
+        self._views = {}
+        invalidate('pets')  # the cached version may be older than the one just read
+
+    def _add(self, key, delta):
+        count = self._counts.get(key, 0) + delta
+        if count > 0:
+            self._counts[key] = count
+        else:
+            self._counts.pop(key, None)
+
+    def apply(self, old, new, version):
+        """
+        Apply one pet change.
+        :param old: (species, breed, status) before the change, None for an insert
+        :param new: (species, breed, status) after the change, None for a delete
+        :param version: pets change version read in the same transaction as the write
+        """
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._version = None  # missed a change, rebuild on next read
+                return
+            if old is not None:
+                self._add(tuple(old), -1)
+            if new is not None:
+                self._add(tuple(new), 1)
+            self._version = version
+            self._views = {}
+
+    def mark_stale(self):
+        """Force a rebuild on the next read, e.g. after a bulk import."""
+        with self._lock:
+            self._version = None
+
+    def facets(self, status=None):
+        """
+        Nested counts, species -> breed -> count, split by status.
+        :param status: (optional) PetStatus to count only pets with that status
+        :return: Dictionary ready to be sent as JSON
+        """
+        with self._lock:
+            if self._version is None or self._version != get_version('pets')[0]:
+                self._rebuild()
+            view = self._views.get(status)
+            if view is None:
+                view = self._build_view(status)
+                self._views[status] = view
+            return view
+
+    def _build_view(self, status):
+        tree = {}
+        for (species, breed, pet_status), count in sorted(self._counts.items()):
+            if status is not None and pet_status != status.value:
+                continue
+            name = status_name(pet_status)
+            species_node = tree.setdefault(species, {'total': 0, 'by_status': {}, 'breeds': {}})
+            breed_node = species_node['breeds'].setdefault(breed, {'total': 0, 'by_status': {}})
+            for node in (species_node, breed_node):
+                node['total'] += count
+                node['by_status'][name] = node['by_status'].get(name, 0) + count
+        return tree
+
+
+facet_index = FacetIndex()
+on_reset(facet_index.mark_stale)
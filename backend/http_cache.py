@@ -0,0 +1,93 @@
+"""
+Conditional GET support (ETag / Last-Modified) for the catalog endpoints.
+
+The ETag is derived from the change versions of the tables a route reads and
+the request URL, so it can be checked before the handler runs: a client that
+already has the current representation gets a 304 without the query or the
+JSON encoding happening.
+"""
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from versions import get_version
+
+# Codings compression.py may apply
+CONTENT_CODINGS = ('br', 'gzip')
+
+
+def make_etag(names, versions, path):
+    """
+    Build a strong entity tag for a representation.
+    :param names: Version names the representation depends on
+    :param versions: Their current versions
+    :param path: Request path including the query string
+    :return: ETag value (without quotes)
+    """
+    key = '|'.join(f'{name}:{version}' for name, version in zip(names, versions))
+    return hashlib.sha1(f'{key}|{path}'.encode('utf-8')).hexdigest()[:24]
+
+
+def encoded_etag(etag, encoding):
+    """
+    Entity tag of a compressed representation; each content coding needs its own.
+    :param etag: ETag of the uncompressed representation
+    :param encoding: Content coding, e.g. 'gzip'
+    :return: ETag value (without quotes)
+    """
+    return f'{etag}-{encoding}'
+
+
+def matching_etag(if_none_match, etag):
+    """
+    Find which representation of a resource an If-None-Match header names.
+    :param if_none_match: The request's parsed If-None-Match header
+    :param etag: ETag of the uncompressed representation
+    :return: The matching tag (plain or with an encoding suffix), or None
+    """
+    if if_none_match.star_tag or etag in if_none_match:
+        return etag
+    for encoding in CONTENT_CODINGS:
+        tag = encoded_etag(etag, encoding)
+        if tag in if_none_match:
+            return tag
+    return None
+
+
+def conditional(*names):
+    """
+    Decorator for GET routes whose output only depends on the given tables.
+    Adds ETag/Last-Modified headers and answers matching If-None-Match or
+    If-Modified-Since requests with 304 Not Modified.
+    :param names: Version names, see versions.py
+    :return: Decorated function
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return func(*args, **kwargs)
+            current = [get_version(name) for name in names]
+            etag = make_etag(names, [version for version, _ in current], request.full_path)
+            stamps = [updated_at for _, updated_at in current if updated_at is not None]
+            last_modified = max(stamps) if stamps else None
+            if request.if_none_match:
+                matched = matching_etag(request.if_none_match, etag)
+                not_modified = matched is not None
+            else:
+                since = request.if_modified_since
+                not_modified = bool(since and last_modified and last_modified <= since)
+            if not_modified:
+                response = make_response('', 304)
+                if request.if_none_match:
+                    etag = matched  # the representation the client holds
+            else:
+                response = make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'no-cache'  # always revalidate, it is cheap
+            return response
+        return wrapper
+    return decorator
@@ -1,33 +1,39 @@
 """Main module of the application"""
 from sys import argv
-import sqlite3
-import bcrypt
 from flask_cors import CORS
-from flask import Flask, request, session, jsonify
+from flask import Flask, request, session, jsonify, Response
 from flasgger import Swagger
 from user import (get_user_by_id_internal, login, get_user_role, logout, create_user,
                  get_all_users, get_user_by_id)
+from exports import start_export, get_export, download_export
+from photos import upload_photo, get_photo, send_media, MAX_PHOTO_BYTES
 from pets import (get_all_pets, get_pet, create_pet as create_pet_handler,
                  update_pet, delete_pet, search_pets, update_pet_status,
-                 get_species, get_breeds)
+                 get_species, get_breeds, full_text_search, get_facets,
+                 bulk_create_pets)
 from apply import (create_application, get_application, update_application_status,
-                   get_applications_by_status, get_all_applications)
+                   get_applications_by_status, get_all_applications,
+                   update_application_statuses, get_application_count,
+                   get_application_count_by_status, get_review_packets)
 from questionnaire import (approve_questionnaire, get_answered_questionnaire,
                            get_open_questionnaires,set_questionnaire,
                            get_number_of_open_questionnaires,
-                           get_questionnaire, answer_questionnaire, has_answered_questionnaire)
+                           get_questionnaire, answer_questionnaire, has_answered_questionnaire,
+                           approve_questionnaires)
 from database import init_db
+from dashboard import get_dashboard_summary
+from seed import main as seed_main
+import db
+from db import pool_stats
+from passwords import hash_password, HashingBusy
+from pagination import parse_page_args, InvalidPageRequest
+from http_cache import conditional
+import compression
+import serialize
+import metrics
+import slowlog  # pylint: disable=unused-import  # registers the slow-query log
 from enums import Role, PetStatus
 
-def get_db_connection():
-    """
-    Create a database connection to the SQLite database.
-    :return: SQLite connection object
-    """
-    conn = sqlite3.connect('petadoption.db')
-    conn.row_factory = sqlite3.Row  # Allows accessing columns by name
-    return conn
-
 def login_required(min_permission):
     """
     Decorator to check if the user is logged in and has the required permissions.
@@ -47,6 +53,10 @@ def login_required(min_permission):
 
 
 app = Flask(__name__)
+serialize.init_app(app)
+db.init_app(app)
+metrics.init_app(app)
+compression.init_app(app)
 app.secret_key = "OFNDEWOWKDO<FO@" # random ahh key for now **change before production**
 
 app.config.update(
@@ -65,8 +75,10 @@ app.config.update(
 CORS(app,
      supports_credentials=True,
      origins=["http://localhost:5173"],
-     allow_headers=["Content-Type", "Accept"],
-     expose_headers=["Set-Cookie"],
+     allow_headers=["Content-Type", "Accept", "If-None-Match", "If-Modified-Since",
+                   "Idempotency-Key"],
+     expose_headers=["Set-Cookie", "Link", "X-Next-Cursor", "X-Prev-Cursor",
+                     "ETag", "Last-Modified"],
      methods=["GET", "POST", "OPTIONS"])
 
 swagger_config = {
@@ -86,6 +98,17 @@ swagger_config = {
 }
 swagger = Swagger(app, config=swagger_config)
 
+@app.errorhandler(InvalidPageRequest)
+def invalid_page_request(error):
+    """Bad ?limit= or ?cursor= on a list endpoint."""
+    return jsonify({"error": str(error)}), 400
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    """Too many logins or registrations are waiting for bcrypt."""
+    return jsonify({"error": "Server busy, try again shortly"}), 503, \
+        {"Retry-After": str(error.retry_after)}
+
 # User routes
 @app.route('/login', methods=['POST'])
 def login_page():
@@ -142,7 +165,7 @@ def register_page():
             data = request.json
             if not data:
                 return jsonify({"error": "Invalid data"}), 400
-            hashed_password = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt())
+            hashed_password = hash_password(data['password'].encode('utf-8'))
             user_data = {
                 "email": data.get('email'),
                 "password_hash": hashed_password,
@@ -166,7 +189,7 @@ def users_route():
         data = request.json
         # Special case for the test
         if data and 'username' in data and 'password' in data:
-            hashed_password = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt())
+            hashed_password = hash_password(data['password'].encode('utf-8'))
             user_data = {
                     "email": data.get('email'),
                     "password": hashed_password,
@@ -175,7 +198,7 @@ def users_route():
                     "role": data.get('role', Role.USER)
                 }
             return create_user(user_data)
-    return get_all_users()
+    return get_all_users(parse_page_args(request.args))
 
 @app.route('/api/users/<int:user_id>', methods=['GET'])
 @login_required(Role.STAFF)
@@ -188,10 +211,11 @@ def user_detail_route(user_id):
 
 # Pet routes
 @app.route('/api/pets', methods=['GET', 'POST'])
+@conditional('pets')
 def pets_route():
     """
     Pet management route.
-    GET: List all pets or search for pets
+    GET: List all pets, filter by species/breed/status, or search with ?q=
     POST: Create a new pet (requires STAFF role)
     """
     if request.method == 'POST':
@@ -199,14 +223,34 @@ def pets_route():
         def create_pet_wrapper():
             return create_pet_handler(request.json)
         return create_pet_wrapper()
+    page = parse_page_args(request.args)
+    status = request.args.get('status')
+    if status and status not in PetStatus.__members__:
+        return jsonify({"error": "Invalid status"}), 400
+    # Free text search, e.g. ?q=good with kids
+    if request.args.get('q'):
+        return full_text_search(request.args['q'], PetStatus[status] if status else None, page,
+                                request.args.get('species'), request.args.get('breed'))
     # Check if search parameters are provided
-    if request.args:
+    if any(key in request.args for key in ('species', 'breed', 'status')):
         return search_pets(request.args.get('species'),
                            request.args.get('breed'),
-                           PetStatus[request.args.get('status')])
-    return get_all_pets()
+                           PetStatus[status] if status else None,
+                           page)
+    return get_all_pets(page)
+
+@app.route('/api/pets/bulk', methods=['POST'])
+@login_required(Role.STAFF)
+def bulk_create_pets_route():
+    """
+    Bulk pet intake.
+    POST: Create pets from a streamed text/csv or application/x-ndjson body
+    (requires STAFF role)
+    """
+    return bulk_create_pets(request.stream, request.mimetype)
 
 @app.route('/api/pets/<int:pet_id>', methods=['GET', 'POST', 'DELETE'])
+@conditional('pets')
 def pet_detail_route(pet_id):
     """
     Pet detail route.
@@ -219,7 +263,10 @@ def pet_detail_route(pet_id):
     if request.method == 'POST':
         @login_required(Role.STAFF)
         def update_pet_wrapper():
-            return update_pet(pet_id)
+            data = request.json
+            if not data:
+                return jsonify({"error": "Invalid data"}), 400
+            return update_pet({**data, 'pet_id': pet_id})
         return update_pet_wrapper()
     if request.method == 'DELETE':
         @login_required(Role.STAFF)
@@ -240,33 +287,101 @@ def update_pet_status_route(pet_id):
         return jsonify({"error": "Invalid data"}), 400
     return update_pet_status(pet_id, data['status'])
 
+@app.route('/api/pets/<int:pet_id>/photo', methods=['GET', 'POST'])
+def pet_photo_route(pet_id):
+    """
+    Pet photo route.
+    GET: Get the photo of a pet and its thumbnails
+    POST: Upload a photo as the 'photo' field of a multipart form or as the raw request body
+    (requires STAFF role)
+    """
+    if request.method == 'GET':
+        return get_photo(pet_id)
+    @login_required(Role.STAFF)
+    def upload_photo_wrapper():
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('photo')
+            data = upload.read(MAX_PHOTO_BYTES + 1) if upload else b''
+        else:
+            data = request.stream.read(MAX_PHOTO_BYTES + 1)
+        return upload_photo(pet_id, data)
+    return upload_photo_wrapper()
+
+@app.route('/media/<filename>', methods=['GET'])
+def media_route(filename):
+    """
+    Stored pet photos and thumbnails.
+    GET: Get an image by its content addressed name, cacheable forever
+    """
+    return send_media(filename)
+
+def status_arg():
+    """
+    The optional ?status= filter of the catalog routes.
+    :return: PetStatus or None
+    :raises KeyError: if the status name is unknown
+    """
+    status = request.args.get('status')
+    return PetStatus[status] if status else None
+
 @app.route('/api/pets/species', methods=['GET'])
+@conditional('pets')
 def get_all_species():
     """
     Get a list of all species.
-    GET: Get a list of all species
+    GET: Get a list of all species, optionally only those with pets in ?status=
     """
-    return get_species()
+    try:
+        return get_species(status_arg())
+    except KeyError:
+        return jsonify({"error": "Invalid status"}), 400
+
 @app.route('/api/pets/breeds', methods=['GET'])
+@conditional('pets')
 def get_all_breeds():
     """
     Get a list of all breeds.
-    GET: Get a list of all breeds
+    GET: Get a list of all breeds, optionally only those with pets in ?status=
     """
-    return get_breeds()
+    try:
+        return get_breeds(status_arg())
+    except KeyError:
+        return jsonify({"error": "Invalid status"}), 400
+
+@app.route('/api/pets/facets', methods=['GET'])
+@conditional('pets')
+def get_pet_facets():
+    """
+    Get pet counts per species and breed, broken down by status.
+    GET: Get the facet counts, optionally only for pets in ?status=
+    """
+    try:
+        return get_facets(status_arg())
+    except KeyError:
+        return jsonify({"error": "Invalid status"}), 400
 
 @app.route('/api/applications/count', methods=["GET"])
 @login_required(Role.STAFF)
-def get_application_count():
+def application_count_route():
     """
     Get the count of applications, optionally filtered by status.
     GET: Get the count of applications (requires STAFF role)
     """
     status = request.args.get('status')
     if status:
-        return get_applications_by_status(status)
+        return get_application_count_by_status(status)
     return get_application_count()
 
+@app.route('/api/dashboard/summary', methods=['GET'])
+@login_required(Role.STAFF)
+def dashboard_summary_route():
+    """
+    Dashboard counters.
+    GET: Get the application counts per status and the number of open questionnaires
+    (requires STAFF role)
+    """
+    return get_dashboard_summary()
+
 # Application routes
 @app.route('/api/applications', methods=['GET', 'POST'])
 def applications_route():
@@ -288,14 +403,37 @@ def applications_route():
     if status:
         @login_required(Role.STAFF)
         def get_by_status_wrapper():
-            return get_applications_by_status(status)
+            return get_applications_by_status(status, parse_page_args(request.args))
         return get_by_status_wrapper()
 
     @login_required(Role.STAFF)
     def get_all_apps_wrapper():
-        return get_all_applications()
+        return get_all_applications(parse_page_args(request.args))
     return get_all_apps_wrapper()
 
+@app.route('/api/applications/review', methods=['GET'])
+@login_required(Role.STAFF)
+def review_applications_route():
+    """
+    Applications ready for review.
+    GET: Get a page of applications with the applicant, pet and questionnaire answers
+    embedded, optionally filtered by ?status= (requires STAFF role)
+    """
+    return get_review_packets(request.args.get('status') or None, parse_page_args(request.args))
+
+@app.route('/api/applications/batch', methods=['POST'])
+@login_required(Role.STAFF)
+def batch_review_applications():
+    """
+    Review many applications at once.
+    POST: Apply a list of {application_id, status} decisions in one transaction
+    (requires STAFF role)
+    """
+    data = request.json
+    if not data or 'decisions' not in data:
+        return jsonify({"error": "Invalid data"}), 400
+    return update_application_statuses(data['decisions'], session['user_id'])
+
 @app.route('/api/applications/<int:app_id>', methods=['GET', 'POST'])
 def application_detail_route(app_id):
     """
@@ -318,6 +456,7 @@ def application_detail_route(app_id):
     return jsonify({"error": "Method not allowed"}), 405
 
 @app.route('/api/questionnaires', methods=['GET'])
+@conditional('questionnaire')
 def get_questionnaires():
     """
     Get a list of all questions in the questionnaire.
@@ -372,7 +511,7 @@ def submit_questionnaire():
     data = request.json
     if not data or 'answers' not in data:
         return jsonify({"error": "Invalid data"}), 400
-    return answer_questionnaire(session['user_id'], data)
+    return answer_questionnaire(session['user_id'], data, request.headers.get('Idempotency-Key'))
 
 @app.route('/api/questionnaires/review', methods=['GET'])
 @login_required(Role.STAFF)
@@ -392,6 +531,19 @@ def approve_questionnaire_route(user_id):
     """
     return approve_questionnaire(user_id)
 
+@app.route('/api/users/approve/batch', methods=['POST'])
+@login_required(Role.STAFF)
+def batch_approve_questionnaires():
+    """
+    Approve many questionnaires at once.
+    POST: Approve the questionnaires of a list of user_ids in one transaction
+    (requires STAFF role)
+    """
+    data = request.json
+    if not data or 'user_ids' not in data:
+        return jsonify({"error": "Invalid data"}), 400
+    return approve_questionnaires(data['user_ids'])
+
 @app.route('/api/questionnaires/open', methods=['GET'])
 @login_required(Role.STAFF)
 def get_open_questionnaires_route():
@@ -401,6 +553,55 @@ def get_open_questionnaires_route():
     """
     return get_number_of_open_questionnaires()
 
+@app.route('/api/exports', methods=['POST'])
+@login_required(Role.STAFF)
+def start_export_route():
+    """
+    Start a background export.
+    POST: Queue an export of applications, questionnaire responses (requires STAFF role)
+    or users (requires ADMIN role)
+    """
+    return start_export(request.json, session['user_id'], get_user_role(session['user_id']))
+
+@app.route('/api/exports/<job_id>', methods=['GET'])
+@login_required(Role.STAFF)
+def get_export_route(job_id):
+    """
+    Export job status.
+    GET: Get the state and progress of an export (requires STAFF role, ADMIN for users)
+    """
+    return get_export(job_id, get_user_role(session['user_id']))
+
+@app.route('/api/exports/<job_id>/download', methods=['GET'])
+@login_required(Role.STAFF)
+def download_export_route(job_id):
+    """
+    Download a finished export.
+    GET: Get the export file (requires STAFF role, ADMIN for users)
+    """
+    return download_export(job_id, get_user_role(session['user_id']))
+
+@app.route('/api/db/stats', methods=['GET'])
+@login_required(Role.ADMIN)
+def db_stats_route():
+    """
+    Connection pool statistics.
+    GET: Get the pool counters (requires ADMIN role)
+    """
+    return jsonify(pool_stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Prometheus metrics.
+    GET: Request counts, latencies and in-flight requests per route, SQL timings per
+    statement and the connection pool counters, in the Prometheus text format
+    (requires PETADOPTION_METRICS_TOKEN as a bearer token, or a local request without it)
+    """
+    if not metrics.allowed():
+        return jsonify({"error": "You do not have permission to access this resource"}), 403
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/')
 def index():
     """
@@ -463,6 +664,8 @@ if __name__ == '__main__':
     if len(argv) > 1 and argv[1] == '--database-init':
         init_db(first_run=True)
         print("Database being (re)created.")
+    elif len(argv) > 1 and argv[1] == '--seed':
+        seed_main(argv[2:])  # e.g. --seed --pets 100000 --users 5000
     else:
         init_db()
     app.run(host='0.0.0.0', debug=True)
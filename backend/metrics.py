@@ -0,0 +1,211 @@
+"""
+Prometheus metrics for the API, served at /metrics in the text exposition format.
+
+init_app hooks into every request to count responses per route, method and
+status, to time them into latency histograms and to track how many are in
+flight. A db.on_query callback times every SQL statement, grouped by its
+normalised text (whitespace collapsed, IN lists folded to one placeholder).
+
+The exposition names routes, SQL statements and pool counters, so it is not
+public: with PETADOPTION_METRICS_TOKEN set a scrape must send it as a bearer
+token, otherwise only requests made directly from the local host (no
+X-Forwarded-For, so not relayed by a reverse proxy) are answered.
+
+The numbers are per process. Under serve.py each scrape is answered by
+whichever worker takes the connection, so use rates and quantiles over time
+rather than comparing single scrapes.
+"""
+import hmac
+import os
+import re
+import threading
+from time import perf_counter
+from flask import g, request
+import db
+
+# Bucket upper bounds in seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+MAX_STATEMENTS = 500  # distinct statement labels before the rest are lumped together
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_TOKEN = os.environ.get('PETADOPTION_METRICS_TOKEN', '')
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, key, amount=1):
+        """Add to the value of one label set, given as a tuple in label order."""
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """Yield (suffix, label pairs, value) for the exposition."""
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield '', list(zip(self.labels, key)), value
+
+
+class Gauge(Counter):
+    """A value per label set that can go up and down."""
+    kind = 'gauge'
+
+    def dec(self, key, amount=1):
+        """Subtract from the value of one label set."""
+        self.inc(key, -amount)
+
+
+class Histogram(Counter):
+    """Observations per label set, counted into cumulative buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, key, value):
+        """Record one observation for a label set."""
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(counts), total, count))
+                     for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in items:
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield '_bucket', labels + [('le', repr(float(bound)))], cumulative
+            yield '_bucket', labels + [('le', '+Inf')], count
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+
+REQUESTS = Counter('petadoption_http_requests_total', 'HTTP responses sent.',
+                   ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('petadoption_http_request_duration_seconds',
+                            'Time spent handling HTTP requests.', ('route', 'method'),
+                            REQUEST_BUCKETS)
+IN_FLIGHT = Gauge('petadoption_http_requests_in_flight', 'HTTP requests being handled.',
+                  ('route',))
+QUERY_SECONDS = Histogram('petadoption_db_query_duration_seconds',
+                          'Time spent executing SQL statements.', ('statement',),
+                          QUERY_BUCKETS)
+REGISTRY = [REQUESTS, REQUEST_SECONDS, IN_FLIGHT, QUERY_SECONDS]
+
+_statements = {}
+
+
+def normalize_sql(sql):
+    """
+    Turn a statement into a low-cardinality label.
+    :param sql: SQL text as executed
+    :return: Normalised text, or 'other' once MAX_STATEMENTS are known
+    """
+    label = _statements.get(sql)
+    if label is None:
+        if len(_statements) >= MAX_STATEMENTS:
+            return 'other'
+        label = _PLACEHOLDER_LIST.sub('?', _WHITESPACE.sub(' ', sql).strip())
+        _statements[sql] = label
+    return label
+
+
+@db.on_query
+def observe_query(cursor, sql, parameters, seconds):  # pylint: disable=unused-argument
+    """Record one statement's execution time."""
+    QUERY_SECONDS.observe((normalize_sql(sql),), seconds)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _before_request():
+    g.metrics_start = perf_counter()
+    g.metrics_route = _route()
+    IN_FLIGHT.inc((g.metrics_route,))
+
+
+def _after_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        route = g.metrics_route
+        REQUEST_SECONDS.observe((route, request.method), perf_counter() - start)
+        REQUESTS.inc((route, request.method, str(response.status_code)))
+    return response
+
+
+def _teardown_request(exc):  # pylint: disable=unused-argument
+    route = g.pop('metrics_route', None)
+    if route is not None:
+        IN_FLIGHT.dec((route,))
+
+
+def init_app(app):
+    """
+    Register the request hooks on a Flask app.
+    :param app: Flask application
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def allowed():
+    """
+    Whether the current request may read the metrics.
+    :return: True for the configured bearer token, or without one for a local,
+             unproxied request
+    """
+    if METRICS_TOKEN:
+        sent = request.headers.get('Authorization', '').encode()
+        return hmac.compare_digest(sent, f'Bearer {METRICS_TOKEN}'.encode())
+    return request.remote_addr in LOCAL_ADDRESSES and 'X-Forwarded-For' not in request.headers
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """
+    Render every metric plus the connection pool counters.
+    :return: Prometheus text exposition
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for suffix, labels, value in metric.samples():
+            label_text = ','.join(f'{name}="{_escape(label)}"' for name, label in labels)
+            lines.append(f'{metric.name}{suffix}{{{label_text}}} {value}')
+    lines.append('# HELP petadoption_db_pool Connection pool counters, see /api/db/stats.')
+    lines.append('# TYPE petadoption_db_pool gauge')
+    for name, value in db.pool_stats().items():
+        if isinstance(value, int):
+            lines.append(f'petadoption_db_pool{{stat="{name}"}} {value}')
+    return '\n'.join(lines) + '\n'
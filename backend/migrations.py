@@ -0,0 +1,375 @@
+"""
+Versioned schema migrations.
+
+init_db creates the baseline tables; everything after that is a numbered
+migration registered here with @migration. At startup run_migrations applies,
+in order, every migration whose version is not yet recorded in the
+schema_version table. Each one runs in its own BEGIN IMMEDIATE transaction, so
+two processes starting at once cannot apply the same step twice, and a failed
+step leaves the database at the previous version.
+
+Steps should still be written idempotently (IF NOT EXISTS and friends) so a
+database that was patched by hand does not block the upgrade.
+"""
+import json
+import sqlite3
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    Register a migration step.
+    :param version: Strictly increasing schema version number
+    :param description: Short human readable summary, stored in schema_version
+    :return: Decorator for a function taking a cursor
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def ensure_version_table(cursor):
+    """Create the schema_version bookkeeping table if needed."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def current_version(conn):
+    """
+    Get the schema version of a database.
+    :param conn: SQLite connection
+    :return: Highest applied migration version, 0 for a baseline database
+    """
+    cursor = conn.cursor()
+    ensure_version_table(cursor)
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def run_migrations(conn):
+    """
+    Apply every pending migration in order.
+    :param conn: SQLite connection to migrate
+    :return: List of versions applied by this call
+    """
+    if conn.in_transaction:
+        conn.commit()
+    cursor = conn.cursor()
+    ensure_version_table(cursor)
+    applied = []
+    for version, description, step in MIGRATIONS:
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+            if cursor.fetchone() is None:
+                step(cursor)
+                cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                               (version, description))
+                applied.append(version)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    if applied:
+        cursor.execute('PRAGMA optimize')
+    return applied
+
+
+@migration(1, 'index hot lookup columns')
+def _index_lookup_columns(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_status '
+                   'ON applications (status, submitted_at, application_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_user_id ON applications (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_pet_id ON applications (pet_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questionnaire_responses_user_id '
+                   'ON questionnaire_responses (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_approved ON users (approved)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pets_species_breed_status '
+                   'ON pets (species, breed, status)')
+
+
+@migration(2, 'index list ordering and status-only pet filters')
+def _index_list_ordering(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_submitted_at '
+                   'ON applications (submitted_at, application_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pets_status ON pets (status)')
+
+
+@migration(3, 'full-text search over pets')
+def _pets_full_text(cursor):
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS pets_fts USING fts5(
+            name, breed, species, description,
+            content='pets', content_rowid='pet_id',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pets_fts_insert AFTER INSERT ON pets BEGIN
+            INSERT INTO pets_fts (rowid, name, breed, species, description)
+            VALUES (new.pet_id, new.name, new.breed, new.species, new.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pets_fts_delete AFTER DELETE ON pets BEGIN
+            INSERT INTO pets_fts (pets_fts, rowid, name, breed, species, description)
+            VALUES ('delete', old.pet_id, old.name, old.breed, old.species, old.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pets_fts_update
+        AFTER UPDATE OF name, breed, species, description ON pets BEGIN
+            INSERT INTO pets_fts (pets_fts, rowid, name, breed, species, description)
+            VALUES ('delete', old.pet_id, old.name, old.breed, old.species, old.description);
+            INSERT INTO pets_fts (rowid, name, breed, species, description)
+            VALUES (new.pet_id, new.name, new.breed, new.species, new.description);
+        END
+    ''')
+    cursor.execute("INSERT INTO pets_fts (pets_fts) VALUES ('rebuild')")
+
+
+@migration(4, 'change versions for conditional GETs')
+def _change_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO change_versions (name) "
+                   "VALUES ('pets'), ('questionnaire')")
+    for name, table in (('pets', 'pets'), ('questionnaire', 'questions'),
+                        ('questionnaire', 'choices')):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    UPDATE change_versions
+                    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE name = '{name}';
+                END
+            ''')
+
+
+# QuestionType values and the names the version 5 payload stores them under
+_QUESTION_TYPE_NAMES = {'Text': 'TEXT', 'Multiple Choice': 'MULTIPLE_CHOICE'}
+
+
+@migration(5, 'versioned questionnaire snapshots')
+def _questionnaire_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS questionnaire_versions (
+            version_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('PRAGMA table_info(questions)')
+    if 'version_id' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE questions ADD COLUMN version_id INTEGER '
+                       'REFERENCES questionnaire_versions (version_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_version_id ON questions (version_id)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questionnaire_versions_version_insert
+        AFTER INSERT ON questionnaire_versions BEGIN
+            UPDATE change_versions
+            SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE name = 'questionnaire';
+        END
+    ''')
+    # The questions that exist today become the first version.
+    cursor.execute('''
+        SELECT q.question_id, q.question_text, q.question_type, c.choice_text
+        FROM questions q
+        LEFT JOIN choices c ON q.question_id = c.question_id
+        WHERE q.version_id IS NULL
+        ORDER BY q.question_id, c.choice_id
+    ''')
+    # Built here rather than with the app's code, so this step never changes.
+    questions = {}
+    for question_id, text, question_type, choice_text in cursor.fetchall():
+        question = questions.setdefault(question_id, {
+            'id': question_id,
+            'text': text,
+            'type': _QUESTION_TYPE_NAMES.get(question_type, question_type),
+            'options': []
+        })
+        if choice_text:
+            question['options'].append(choice_text)
+    if questions:
+        cursor.execute('INSERT INTO questionnaire_versions (payload) VALUES (?)',
+                       (json.dumps(list(questions.values())),))
+        cursor.execute('UPDATE questions SET version_id = ? WHERE version_id IS NULL',
+                       (cursor.lastrowid,))
+
+
+@migration(6, 'background export jobs')
+def _export_jobs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            format TEXT NOT NULL,
+            compressed INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            rows_written INTEGER NOT NULL DEFAULT 0,
+            total_rows INTEGER,
+            file_path TEXT,
+            error TEXT,
+            requested_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (requested_by) REFERENCES users(user_id)
+        )
+    ''')
+
+
+@migration(7, 'one answer per question and idempotent questionnaire submits')
+def _unique_responses(cursor):
+    # Concurrent submits could save the same answers twice; keep the first copy.
+    cursor.execute('''
+        DELETE FROM questionnaire_responses
+        WHERE response_id NOT IN (
+            SELECT MIN(response_id) FROM questionnaire_responses GROUP BY user_id, question_id
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_questionnaire_responses_user_question '
+                   'ON questionnaire_responses (user_id, question_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS questionnaire_submissions (
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, idempotency_key),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+
+# Rows of the stats table kept up to date by triggers
+OPEN_QUESTIONNAIRES_STAT = 'open_questionnaires'
+APPLICATIONS_STAT = 'applications'
+APPLICATIONS_STATUS_STAT = 'applications:'  # followed by the status value
+
+# stats[name] += delta, creating the row on first use
+_BUMP = '''
+    INSERT INTO stats (name, value) VALUES ({name}, {delta})
+    ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+'''
+# A user's questionnaire is open while they are unapproved and have answered.
+_HAS_ANSWERS = 'EXISTS (SELECT 1 FROM questionnaire_responses WHERE user_id = {user})'
+
+
+def backfill_stats(cursor):
+    """
+    Recount every row of the stats table from the underlying tables.
+    :param cursor: Cursor inside the transaction to use
+    """
+    cursor.execute('DELETE FROM stats')
+    cursor.execute('INSERT INTO stats (name, value) SELECT ?, COUNT(*) FROM applications',
+                   (APPLICATIONS_STAT,))
+    cursor.execute('INSERT INTO stats (name, value) '
+                   'SELECT ? || status, COUNT(*) FROM applications GROUP BY status',
+                   (APPLICATIONS_STATUS_STAT,))
+    cursor.execute('INSERT INTO stats (name, value) '
+                   'SELECT ?, COUNT(*) FROM users u WHERE u.approved = 0 AND '
+                   + _HAS_ANSWERS.format(user='u.user_id'), (OPEN_QUESTIONNAIRES_STAT,))
+
+
+@migration(8, 'dashboard counters maintained by triggers')
+def _stats(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    total = f"'{APPLICATIONS_STAT}'"
+    status = f"'{APPLICATIONS_STATUS_STAT}' || {{row}}.status"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS applications_stats_insert
+        AFTER INSERT ON applications BEGIN
+            {_BUMP.format(name=total, delta=1)}
+            {_BUMP.format(name=status.format(row='new'), delta=1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS applications_stats_delete
+        AFTER DELETE ON applications BEGIN
+            {_BUMP.format(name=total, delta=-1)}
+            {_BUMP.format(name=status.format(row='old'), delta=-1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS applications_stats_update
+        AFTER UPDATE OF status ON applications WHEN old.status IS NOT new.status BEGIN
+            {_BUMP.format(name=status.format(row='old'), delta=-1)}
+            {_BUMP.format(name=status.format(row='new'), delta=1)}
+        END
+    ''')
+    # Only a user's first answer opens their questionnaire and only removing the
+    # last one closes it; the unique (user_id, question_id) index makes both checks
+    # a single index probe.
+    other_answers = ('EXISTS (SELECT 1 FROM questionnaire_responses '
+                     'WHERE user_id = {row}.user_id AND response_id <> {row}.response_id)')
+    unapproved = '(SELECT approved FROM users WHERE user_id = {row}.user_id) = 0'
+    open_stat = f"'{OPEN_QUESTIONNAIRES_STAT}'"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS questionnaire_responses_stats_insert
+        AFTER INSERT ON questionnaire_responses
+        WHEN {unapproved.format(row='new')} AND NOT {other_answers.format(row='new')} BEGIN
+            {_BUMP.format(name=open_stat, delta=1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS questionnaire_responses_stats_delete
+        AFTER DELETE ON questionnaire_responses
+        WHEN {unapproved.format(row='old')} AND NOT {other_answers.format(row='old')} BEGIN
+            {_BUMP.format(name=open_stat, delta=-1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_stats_approve
+        AFTER UPDATE OF approved ON users
+        WHEN (old.approved = 0) IS NOT (new.approved = 0)
+            AND {_HAS_ANSWERS.format(user='new.user_id')} BEGIN
+            {_BUMP.format(name=open_stat, delta="CASE WHEN new.approved = 0 THEN 1 ELSE -1 END")}
+        END
+    ''')
+    backfill_stats(cursor)
+
+
+@migration(9, 'pet photos with thumbnails')
+def _pet_photos(cursor):
+    # One row per distinct image, keyed by the SHA-256 of its bytes; pets share rows.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pet_photos (
+            content_hash TEXT PRIMARY KEY,
+            content_type TEXT NOT NULL,
+            extension TEXT NOT NULL,
+            byte_size INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            variants TEXT NOT NULL DEFAULT '[]',
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('PRAGMA table_info(pets)')
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'photo_hash' not in columns:
+        cursor.execute('ALTER TABLE pets ADD COLUMN photo_hash TEXT '
+                       'REFERENCES pet_photos (content_hash)')
+    if 'thumbnail_url' not in columns:
+        cursor.execute('ALTER TABLE pets ADD COLUMN thumbnail_url TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pets_photo_hash ON pets (photo_hash)')
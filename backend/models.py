@@ -0,0 +1,167 @@
+"""
+Domain models for rows the API reads and caches.
+
+Each model is a slotted dataclass, so an instance stores its fields in fixed
+slots instead of a per-row dictionary of names. COLUMNS lists the table
+columns in constructor order: select them with select_columns() and
+from_row() is a single positional call. public() is the projection sent to
+clients, and PUBLIC/PUBLIC_ENUMS describe the same projection for list
+endpoints that encode rows directly with a RowSerializer. Fields such as
+password_hash are never part of it.
+"""
+from dataclasses import dataclass, field
+from typing import ClassVar, Optional
+from enums import ApplicationStatus, PetStatus, QuestionType, Role
+from serialize import RowSerializer, enum_names
+
+
+def _lenient(enum):
+    """Converter to an enum member that keeps values the enum does not know."""
+    members = {member.value: member for member in enum}
+    return lambda value: members.get(value, value)
+
+
+class Model:
+    """Shared column and projection helpers; subclasses are slotted dataclasses."""
+    __slots__ = ()
+    COLUMNS: ClassVar[tuple] = ()
+    PUBLIC: ClassVar[tuple] = ()
+    # column -> callable turning the stored value into the field value
+    CONVERTERS: ClassVar[dict] = {}
+    # column -> stored value -> value clients see, for PUBLIC rows
+    PUBLIC_ENUMS: ClassVar[dict] = {}
+    _CONVERT: ClassVar[tuple] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._CONVERT = tuple((i, cls.CONVERTERS[column]) for i, column in enumerate(cls.COLUMNS)
+                             if column in cls.CONVERTERS)
+
+    @classmethod
+    def select_columns(cls, alias=None, public=False):
+        """
+        Column list for a SELECT that from_row (or serializer) can consume.
+        :param alias: (optional) Table alias to qualify the columns with
+        :param public: Only the PUBLIC columns
+        :return: Comma separated column names
+        """
+        prefix = f'{alias}.' if alias else ''
+        return ', '.join(prefix + column for column in (cls.PUBLIC if public else cls.COLUMNS))
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Build an instance from a row selected with select_columns().
+        :param row: Tuple or sqlite3.Row in COLUMNS order
+        :return: Model instance
+        """
+        if not cls._CONVERT:
+            return cls(*row)
+        values = list(row)
+        for i, convert in cls._CONVERT:
+            if values[i] is not None:
+                values[i] = convert(values[i])
+        return cls(*values)
+
+    @classmethod
+    def serializer(cls):
+        """
+        Encoder for rows selected with select_columns(public=True).
+        :return: RowSerializer producing the same objects as public()
+        """
+        return RowSerializer(cls.PUBLIC, cls.PUBLIC_ENUMS)
+
+    def public(self):
+        """
+        The fields clients may see.
+        :return: Dictionary ready for jsonify
+        """
+        return {column: getattr(self, column) for column in self.PUBLIC}
+
+
+@dataclass(slots=True)
+class Pet(Model):
+    """A pet listed for adoption."""
+    pet_id: int
+    name: str
+    species: str
+    breed: str
+    age: int
+    description: Optional[str]
+    status: PetStatus
+    image_url: Optional[str]
+    created_at: Optional[str]
+    thumbnail_url: Optional[str] = None
+
+    COLUMNS: ClassVar[tuple] = ('pet_id', 'name', 'species', 'breed', 'age', 'description',
+                                'status', 'image_url', 'created_at', 'thumbnail_url')
+    PUBLIC: ClassVar[tuple] = COLUMNS
+    CONVERTERS: ClassVar[dict] = {'status': _lenient(PetStatus)}
+
+
+@dataclass(slots=True)
+class User(Model):
+    """An account; password_hash stays on the server."""
+    user_id: int
+    email: str
+    full_name: str
+    phone: Optional[str]
+    role: Role
+    approved: bool
+    created_at: Optional[str]
+    password_hash: Optional[bytes] = field(default=None, repr=False)
+
+    COLUMNS: ClassVar[tuple] = ('user_id', 'email', 'full_name', 'phone', 'role', 'approved',
+                                'created_at', 'password_hash')
+    PUBLIC: ClassVar[tuple] = COLUMNS[:-1]
+    CONVERTERS: ClassVar[dict] = {'role': _lenient(Role), 'approved': bool}
+    PUBLIC_ENUMS: ClassVar[dict] = {'approved': {0: False, 1: True}}
+
+
+@dataclass(slots=True)
+class Application(Model):
+    """An adoption application; clients see the status by name, e.g. PENDING."""
+    application_id: int
+    user_id: int
+    pet_id: int
+    status: ApplicationStatus
+    submitted_at: Optional[str]
+    updated_at: Optional[str]
+    reviewed_at: Optional[str]
+    reviewer_id: Optional[int]
+
+    COLUMNS: ClassVar[tuple] = ('application_id', 'user_id', 'pet_id', 'status',
+                                'submitted_at', 'updated_at', 'reviewed_at', 'reviewer_id')
+    PUBLIC: ClassVar[tuple] = COLUMNS
+    CONVERTERS: ClassVar[dict] = {'status': _lenient(ApplicationStatus)}
+    PUBLIC_ENUMS: ClassVar[dict] = {'status': enum_names(ApplicationStatus)}
+
+    def public(self):
+        data = Model.public(self)
+        data['status'] = getattr(self.status, 'name', self.status)
+        return data
+
+
+@dataclass(slots=True)
+class Question(Model):
+    """A questionnaire question with its choices, in order."""
+    question_id: int
+    question_text: str
+    question_type: QuestionType
+    options: tuple = ()
+
+    COLUMNS: ClassVar[tuple] = ('question_id', 'question_text', 'question_type')
+    CONVERTERS: ClassVar[dict] = {'question_type': QuestionType}
+
+    @classmethod
+    def from_public(cls, data):
+        """
+        Rebuild a question from its public() form, e.g. a stored questionnaire version.
+        :param data: Dictionary with id, text, type (by name) and options
+        :return: Question
+        """
+        return cls(data['id'], data['text'], QuestionType[data['type']], tuple(data['options']))
+
+    def public(self):
+        return {'id': self.question_id, 'text': self.question_text,
+                'type': self.question_type.name, 'options': list(self.options)}
@@ -0,0 +1,174 @@
+"""
+Keyset (cursor) pagination helpers shared by the list endpoints.
+
+A page is requested with ``?limit=&cursor=``. Cursors are opaque tokens that
+encode the sort key of the row at the edge of the previous page, so fetching
+page N costs the same as fetching page 1 (an index seek, never an OFFSET scan).
+
+List endpoints keep returning a plain JSON array; the cursors for the
+neighbouring pages are sent in the ``X-Next-Cursor`` / ``X-Prev-Cursor`` and
+``Link`` headers. Without ``limit`` or ``cursor`` the full list is returned as
+before.
+"""
+import base64
+import json
+from urllib.parse import urlencode
+from flask import request
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidPageRequest(ValueError):
+    """Raised when limit or cursor query parameters cannot be used."""
+
+
+class Page:
+    """A requested page: size, direction and the key to continue from."""
+    __slots__ = ('limit', 'direction', 'after')
+
+    def __init__(self, limit=DEFAULT_LIMIT, direction=FORWARD, after=None):
+        self.limit = limit
+        self.direction = direction
+        self.after = after
+
+
+def encode_cursor(direction, values):
+    """
+    Build an opaque cursor token.
+    :param direction: FORWARD or BACKWARD
+    :param values: Sort key values of the edge row
+    :return: URL-safe cursor string
+    """
+    raw = json.dumps([direction, list(values)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Parse a cursor token produced by encode_cursor.
+    :param token: Cursor string from the client
+    :return: Tuple (direction, values)
+    :raises InvalidPageRequest: if the token is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidPageRequest("Invalid cursor") from e
+    if direction not in (FORWARD, BACKWARD) or not isinstance(values, list):
+        raise InvalidPageRequest("Invalid cursor")
+    return direction, values
+
+
+def parse_page_args(args):
+    """
+    Read limit and cursor from the query string.
+    :param args: request.args
+    :return: Page, or None if the client did not ask for pagination
+    :raises InvalidPageRequest: on a bad limit or cursor
+    """
+    limit = args.get('limit')
+    cursor = args.get('cursor')
+    if limit is None and cursor is None:
+        return None
+    if limit is None:
+        limit = DEFAULT_LIMIT
+    else:
+        try:
+            limit = int(limit)
+        except ValueError as e:
+            raise InvalidPageRequest("limit must be an integer") from e
+        if limit < 1:
+            raise InvalidPageRequest("limit must be positive")
+        limit = min(limit, MAX_LIMIT)
+    if cursor:
+        direction, after = decode_cursor(cursor)
+        return Page(limit, direction, after)
+    return Page(limit)
+
+
+def keyset_query(select_sql, where, params, keys, page):
+    """
+    Add the keyset condition, ordering and limit to a query.
+    :param select_sql: SELECT ... FROM ... without WHERE/ORDER BY
+    :param where: List of WHERE clauses already required by the caller
+    :param params: Parameters for those clauses
+    :param keys: Sort key as a list of (sql_expression, result_column) pairs,
+                 ending with a unique column
+    :param page: Page or None for the whole list
+    :return: Tuple (sql, params)
+    """
+    where = list(where)
+    params = list(params)
+    columns = ', '.join(expr for expr, _ in keys)
+    descending = page is not None and page.direction == BACKWARD
+    if page is not None and page.after is not None:
+        if len(page.after) != len(keys):
+            raise InvalidPageRequest("Invalid cursor")
+        placeholders = ', '.join('?' for _ in keys)
+        where.append(f"({columns}) {'<' if descending else '>'} ({placeholders})")
+        params.extend(page.after)
+    sql = select_sql
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    order = ' DESC' if descending else ''
+    sql += ' ORDER BY ' + ', '.join(expr + order for expr, _ in keys)
+    if page is not None:
+        sql += ' LIMIT ?'
+        params.append(page.limit + 1)  # one extra row tells us whether there is more
+    return sql, params
+
+
+def page_rows(rows, keys, page):
+    """
+    Trim the extra row and work out the neighbouring cursors.
+    :param rows: Rows returned by a keyset_query
+    :param keys: The same keys passed to keyset_query
+    :param page: The same Page passed to keyset_query
+    :return: Tuple (rows, next_cursor, prev_cursor)
+    """
+    if page is None:
+        return rows, None, None
+    has_more = len(rows) > page.limit
+    rows = rows[:page.limit]
+    if page.direction == BACKWARD:
+        rows = rows[::-1]
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, page.after is not None
+    if not rows:
+        return rows, None, None
+    next_cursor = prev_cursor = None
+    if has_next:
+        next_cursor = encode_cursor(FORWARD, [rows[-1][col] for _, col in keys])
+    if has_prev:
+        prev_cursor = encode_cursor(BACKWARD, [rows[0][col] for _, col in keys])
+    return rows, next_cursor, prev_cursor
+
+
+def page_headers(page, next_cursor, prev_cursor):
+    """
+    Response headers advertising the neighbouring pages.
+    Other query parameters of the current request are carried over into the links.
+    :param page: Page that was served (None means no headers)
+    :return: Dictionary of headers
+    """
+    if page is None:
+        return {}
+    headers = {}
+    links = []
+    query = {k: v for k, v in request.args.items() if k != 'cursor'}
+    query['limit'] = page.limit
+    for rel, cursor, header in (('next', next_cursor, 'X-Next-Cursor'),
+                                ('prev', prev_cursor, 'X-Prev-Cursor')):
+        if cursor:
+            headers[header] = cursor
+            url = f'{request.base_url}?{urlencode({**query, "cursor": cursor})}'
+            links.append(f'<{url}>; rel="{rel}"')
+    if links:
+        headers['Link'] = ', '.join(links)
+    return headers
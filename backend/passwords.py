@@ -0,0 +1,110 @@
+"""
+Password hashing off the request threads.
+
+bcrypt is deliberately slow, so hashing and checking run on a small bounded
+thread pool (bcrypt releases the GIL while it works). At most HASH_QUEUE_LIMIT
+jobs may be waiting or running; past that, callers get HashingBusy right away
+instead of piling up behind each other, and the API answers 503 with a
+Retry-After header.
+
+The cost factor comes from BCRYPT_ROUNDS. Raising it only affects new hashes;
+existing ones are upgraded the next time their owner logs in.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from db import on_reset
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+HASH_WORKERS = int(os.environ.get('PETADOPTION_HASH_WORKERS', str(os.cpu_count() or 2)))
+HASH_QUEUE_LIMIT = int(os.environ.get('PETADOPTION_HASH_QUEUE', str(HASH_WORKERS * 8)))
+RETRY_AFTER = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+_dummy_hash = None
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+    retry_after = RETRY_AFTER
+
+
+@on_reset
+def _drop_executor():
+    """Forget the worker pool, e.g. in a freshly forked worker process."""
+    global _executor  # pylint: disable=global-statement
+    _executor = None
+
+
+def _get_executor():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS,
+                                           thread_name_prefix='bcrypt')
+        return _executor
+
+
+def _run(func, *args):
+    """Run func on the hashing pool and wait for its result."""
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return _get_executor().submit(func, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password: bytes, rounds: int = None):
+    """
+    Hash a password with bcrypt.
+    :param password: Password as bytes
+    :param rounds: (optional) Cost factor, defaults to BCRYPT_ROUNDS
+    :return: bcrypt hash as bytes
+    :raises HashingBusy: if the hashing queue is full
+    """
+    return _run(lambda: bcrypt.hashpw(password, bcrypt.gensalt(rounds or BCRYPT_ROUNDS)))
+
+
+def check_password(password: bytes, hashed):
+    """
+    Check a password against a stored hash.
+    :param password: Password as bytes
+    :param hashed: Stored bcrypt hash (bytes or str), or None for an unknown user
+    :return: True if the password matches
+    :raises HashingBusy: if the hashing queue is full
+    """
+    if hashed is None:
+        # Spend the same time as for a real user so unknown emails are not revealed.
+        _run(bcrypt.checkpw, password, _get_dummy_hash())
+        return False
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    try:
+        return _run(bcrypt.checkpw, password, hashed)
+    except ValueError:  # not a bcrypt hash
+        return False
+
+
+def needs_rehash(hashed):
+    """
+    Tell whether a stored hash uses a lower cost than BCRYPT_ROUNDS.
+    :param hashed: Stored bcrypt hash, e.g. b'$2b$12$...'
+    :return: True if the hash should be upgraded
+    """
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    try:
+        return int(hashed.split(b'$')[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def _get_dummy_hash():
+    global _dummy_hash  # pylint: disable=global-statement
+    if _dummy_hash is None:
+        _dummy_hash = bcrypt.hashpw(b'not a password', bcrypt.gensalt(BCRYPT_ROUNDS))
+    return _dummy_hash
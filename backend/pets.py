@@ -1,16 +1,51 @@
 """The module for managing pet-related operations."""
+import csv
+import html
+import io
+import json
+import re
 import sqlite3
 from flask import jsonify
 from enums import PetStatus
+from db import get_db_connection, transaction
+from pagination import keyset_query, page_rows, page_headers
+from versions import invalidate
+from facets import facet_index
+from serialize import RowSerializer, json_response, dumps
+from models import Pet
 
-def get_db_connection():
-    """
-    Create a database connection to the SQLite database.
-    :return: SQLite connection object
-    """
-    conn = sqlite3.connect('petadoption.db')
-    conn.row_factory = sqlite3.Row  # Allows accessing columns by name
-    return conn
+PET_KEYS = [('pet_id', 'pet_id')]
+# Best match first (bm25 scores are negative, lower is better), ties by ID.
+SEARCH_KEYS = [('score', 'score'), ('pet_id', 'pet_id')]
+# bm25 column weights for name, breed, species, description
+SEARCH_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+SEARCH_SERIALIZER = RowSerializer(Pet.PUBLIC + ('score', 'snippet'))
+# snippet() brackets matches with these control characters; highlight() turns them
+# into <mark> tags once the description text around them is HTML escaped.
+MARK_START, MARK_END = '\x02', '\x03'
+
+# Bulk intake commits every BULK_CHUNK_SIZE rows and reports at most
+# BULK_MAX_ERRORS row errors, so memory stays flat however large the upload is.
+BULK_CHUNK_SIZE = 500
+BULK_MAX_ERRORS = 1000
+BULK_FIELDS = ('name', 'species', 'breed', 'age', 'description', 'status', 'image_url')
+_STATUS_BY_NAME = {**{s.name: s.value for s in PetStatus}, **{s.value: s.value for s in PetStatus}}
+
+def _facet_key(cursor, pet_id):
+    """(species, breed, status) of a pet as stored, or None if it does not exist."""
+    cursor.execute('SELECT species, breed, status FROM pets WHERE pet_id = ?', (pet_id,))
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+def _pets_version(cursor):
+    """The pets change version, read inside the writing transaction."""
+    cursor.execute("SELECT version FROM change_versions WHERE name = 'pets'")
+    return cursor.fetchone()[0]
+
+def _pet_changed(old, new, version):
+    """Tell the caches about a committed pet change."""
+    invalidate('pets')
+    facet_index.apply(old, new, version)
 
 def create_pet(pet_data):
     """
@@ -27,19 +62,135 @@ def create_pet(pet_data):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO pets (name, species, breed, age, description, status, image_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (pet_data['name'], pet_data['species'], pet_data['breed'], pet_data['age'],
-            pet_data['description'],
-            pet_data.get('status', PetStatus.AVAILABLE), pet_data.get('image_url', '')))
-    conn.commit()
-    pet_id = cursor.lastrowid
-    conn.close()
+    try:
+        with transaction(conn):
+            cursor.execute('''
+                INSERT INTO pets (name, species, breed, age, description, status, image_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (pet_data['name'], pet_data['species'], pet_data['breed'], pet_data['age'],
+                    pet_data['description'],
+                    pet_data.get('status', PetStatus.AVAILABLE), pet_data.get('image_url', '')))
+            pet_id = cursor.lastrowid
+            new = _facet_key(cursor, pet_id)
+            version = _pets_version(cursor)
+    finally:
+        conn.close()
+    _pet_changed(None, new, version)
     new_pet = {'pet_id': pet_id}
 
     return jsonify(new_pet), 201
 
+def validate_pet_row(row):
+    """
+    Check and normalise one pet record from a bulk upload.
+
+    :param row: Dictionary with the same keys as create_pet
+    :return: Tuple (values in BULK_FIELDS order, None) or (None, error message)
+    """
+    if not isinstance(row, dict):
+        return None, "Row must be an object"
+    values = []
+    for field in ('name', 'species', 'breed'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, f"{field} is required"
+        values.append(value.strip())
+    age = row.get('age')
+    if isinstance(age, str) and age.strip().isdecimal():
+        age = int(age)
+    elif not isinstance(age, int) or isinstance(age, bool):
+        return None, "age must be a whole number"
+    if age < 0:
+        return None, "age must not be negative"
+    values.append(age)
+    for field in ('description', 'status', 'image_url'):
+        if not isinstance(row.get(field), (str, type(None))):
+            return None, f"{field} must be a string"
+    values.append(row.get('description') or '')
+    status = row.get('status') or PetStatus.AVAILABLE.value
+    if status not in _STATUS_BY_NAME:
+        return None, f"Unknown status {status!r}"
+    values.append(_STATUS_BY_NAME[status])
+    values.append(row.get('image_url') or '')
+    return tuple(values), None
+
+def _read_bulk_rows(stream, content_type):
+    """Yield (line number, record or None, parse error or None) from an upload."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if content_type == 'text/csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except ValueError:
+            yield line_number, None, "Invalid JSON"
+
+def bulk_create_pets(stream, content_type):
+    """
+    Create many pets from a streamed CSV or NDJSON upload.
+    Rows are validated as they are read and inserted with executemany, one
+    transaction per BULK_CHUNK_SIZE rows; invalid rows are skipped and reported.
+
+    :param stream: Binary file-like object with the request body
+    :param content_type: 'text/csv' or 'application/x-ndjson'
+    :return: JSON response with the number of inserted rows and per-row errors
+    """
+    if content_type not in ('text/csv', 'application/x-ndjson', 'application/jsonl'):
+        return jsonify({"error": "Upload text/csv or application/x-ndjson"}), 415
+    inserted = 0
+    failed = 0
+    errors = []
+    chunk = []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    def flush():
+        with transaction(conn):
+            cursor.executemany(f'''
+                INSERT INTO pets ({', '.join(BULK_FIELDS)})
+                VALUES ({', '.join('?' for _ in BULK_FIELDS)})
+            ''', chunk)
+        chunk.clear()
+
+    try:
+        try:
+            for line_number, record, error in _read_bulk_rows(stream, content_type):
+                values = None
+                if error is None:
+                    values, error = validate_pet_row(record)
+                if error is not None:
+                    failed += 1
+                    if len(errors) < BULK_MAX_ERRORS:
+                        errors.append({"row": line_number, "error": error})
+                    continue
+                chunk.append(values)
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    flush()
+                    inserted += BULK_CHUNK_SIZE
+        except (UnicodeDecodeError, csv.Error) as e:
+            errors.append({"row": None, "error": f"Could not read upload: {e}"})
+        # rows validated before an unreadable part of the upload are still saved
+        if chunk:
+            count = len(chunk)
+            flush()
+            inserted += count
+    finally:
+        conn.close()
+        if inserted:
+            invalidate('pets')
+            facet_index.mark_stale()
+    result = {"inserted": inserted, "failed": failed, "errors": errors}
+    if not inserted:
+        if not failed and not errors:
+            errors.append({"row": None, "error": "The upload has no rows"})
+        return jsonify(result), 400
+    return jsonify(result), 201
+
 def delete_pet(pet_id):
     """
     Delete a pet with the given ID.
@@ -49,11 +200,18 @@ def delete_pet(pet_id):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM pets WHERE pet_id = ?', (pet_id,))
-    conn.commit()
-    conn.close()
-    if cursor.rowcount == 0:
+    try:
+        with transaction(conn):
+            old = _facet_key(cursor, pet_id)
+            cursor.execute('DELETE FROM pets WHERE pet_id = ?', (pet_id,))
+            version = _pets_version(cursor)
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Pet has adoption applications and cannot be deleted"}), 409
+    finally:
+        conn.close()
+    if old is None:
         return jsonify({"error": "Pet not found"}), 404
+    _pet_changed(old, None, version)
     return jsonify({"message": "Pet deleted successfully"}), 200
 
 def get_pet(pet_id):
@@ -65,30 +223,31 @@ def get_pet(pet_id):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM pets WHERE pet_id = ?', (pet_id,))
-    pet = cursor.fetchone()
+    cursor.execute(f'SELECT {Pet.select_columns()} FROM pets WHERE pet_id = ?', (pet_id,))
+    row = cursor.fetchone()
     conn.close()
-    if pet is None:
+    if row is None:
         return jsonify({"error": "Pet not found"}), 404
-    pet = dict(pet)
-    return jsonify(pet), 200
+    return jsonify(Pet.from_row(row).public()), 200
 
-def get_all_pets():
+def get_all_pets(page=None):
     """
     Retrieve all pets.
     
+    :param page: (optional) Page to return, see pagination.parse_page_args
     :return: JSON response with a list of pets
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM pets')
+    cursor.execute(*keyset_query(f'SELECT {Pet.select_columns(public=True)} FROM pets', [], [],
+                                 PET_KEYS, page))
     pets = cursor.fetchall()
     conn.close()
+    pets, next_cursor, prev_cursor = page_rows(pets, PET_KEYS, page)
     if not pets:
         return jsonify({"error": "No pets found"}), 404
-    # Convert pets to a list of dictionaries
-    pets = [dict(pet) for pet in pets]
-    return jsonify(pets), 200
+    return json_response(Pet.serializer().dumps(pets), 200,
+                         page_headers(page, next_cursor, prev_cursor))
 
 def update_pet_status(pet_id, status):
     """
@@ -100,99 +259,188 @@ def update_pet_status(pet_id, status):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('UPDATE pets SET status = ? WHERE pet_id = ?', (status, pet_id))
-    conn.commit()
-    cursor.execute('SELECT * FROM pets WHERE pet_id = ?', (pet_id,))
-    updated_pet = cursor.fetchone()
-    conn.close()
+    try:
+        with transaction(conn):
+            old = _facet_key(cursor, pet_id)
+            cursor.execute('UPDATE pets SET status = ? WHERE pet_id = ?', (status, pet_id))
+            cursor.execute(f'SELECT {Pet.select_columns()} FROM pets WHERE pet_id = ?', (pet_id,))
+            updated_pet = cursor.fetchone()
+            version = _pets_version(cursor)
+    finally:
+        conn.close()
+    if updated_pet is not None:
+        _pet_changed(old, (updated_pet['species'], updated_pet['breed'], updated_pet['status']),
+                     version)
     if updated_pet is None:
         return jsonify({"error": "Pet not found"}), 404
-    updated_pet = dict(updated_pet)
-    return jsonify(updated_pet), 200
+    return jsonify(Pet.from_row(updated_pet).public()), 200
 
 def update_pet(pet_data):
     """
     Update a pet with the given details from the request.
 
-    :param pet_id: ID of the pet to update
+    :param pet_data: Dictionary with the pet_id and the same keys as create_pet
     :return: JSON response with the updated pet details
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE pets SET (name, species, breed, age, description, status)
-        VALUES (?, ?, ?, ?, ?, ?) WHERE pet_id = ?
-    ''', (pet_data['name'], pet_data['species'], pet_data['breed'], pet_data['age'],
-            pet_data['description'], pet_data.get('status', PetStatus.AVAILABLE),
-            pet_data['pet_id']))
-    conn.commit()
-    cursor.execute('SELECT * FROM pets WHERE pet_id = ?', (pet_data['pet_id'],))
-    updated_pet = cursor.fetchone()
-    conn.close()
+    try:
+        with transaction(conn):
+            old = _facet_key(cursor, pet_data['pet_id'])
+            cursor.execute('''
+                UPDATE pets
+                SET name = ?, species = ?, breed = ?, age = ?, description = ?, status = ?
+                WHERE pet_id = ?
+            ''', (pet_data['name'], pet_data['species'], pet_data['breed'], pet_data['age'],
+                    pet_data['description'], pet_data.get('status', PetStatus.AVAILABLE),
+                    pet_data['pet_id']))
+            cursor.execute(f'SELECT {Pet.select_columns()} FROM pets WHERE pet_id = ?',
+                           (pet_data['pet_id'],))
+            updated_pet = cursor.fetchone()
+            version = _pets_version(cursor)
+    finally:
+        conn.close()
+    if updated_pet is not None:
+        _pet_changed(old, (updated_pet['species'], updated_pet['breed'], updated_pet['status']),
+                     version)
     if updated_pet is None:
         return jsonify({"error": "Pet not found"}), 404
-    updated_pet = dict(updated_pet)
-    return jsonify(updated_pet), 200
+    return jsonify(Pet.from_row(updated_pet).public()), 200
 
-def search_pets(species: str = "", breed: str = "", status: PetStatus = PetStatus.AVAILABLE):
+def search_pets(species: str = "", breed: str = "", status: PetStatus = PetStatus.AVAILABLE,
+                page=None):
     """
     Search for pets based on query parameters.
     
+    :param page: (optional) Page to return, see pagination.parse_page_args
     :return: JSON response with matching pets
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    query = "SELECT * FROM pets WHERE 1=1"
+    where = []
     params = []
     if species:
-        query += " AND species = ?"
+        where.append("species = ?")
         params.append(species)
     if breed:
-        query += " AND breed = ?"
+        where.append("breed = ?")
         params.append(breed)
     if status:
-        query += " AND status = ?"
+        where.append("status = ?")
         params.append(status.value)
-    cursor.execute(query, params)
+    cursor.execute(*keyset_query(f"SELECT {Pet.select_columns(public=True)} FROM pets", where,
+                                 params, PET_KEYS, page))
     pets = cursor.fetchall()
     conn.close()
+    pets, next_cursor, prev_cursor = page_rows(pets, PET_KEYS, page)
     if not pets:
         return jsonify({"error": "No pets found meeting that criteria!"}), 404
-    # Convert pets to a list of dictionaries
-    pets = [dict(pet) for pet in pets]
+    return json_response(Pet.serializer().dumps(pets), 200,
+                         page_headers(page, next_cursor, prev_cursor))
+
+def to_match_query(text: str):
+    """
+    Turn free text typed by an adopter into an FTS5 MATCH expression.
+    Every word must match; the last word also matches as a prefix so results
+    show up while the user is still typing.
 
-    return jsonify(pets), 200
+    :param text: Raw search text
+    :return: MATCH expression, or None if the text has no searchable words
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
 
-def get_breeds():
+def highlight(snippet):
     """
-    Retrieve all unique breeds from the database.
-    
-    :return: JSON response with a list of unique breeds
+    HTML escape a description snippet, then mark its matches.
+
+    :param snippet: Text from snippet() with matches between MARK_START and MARK_END
+    :return: Safe HTML in which only the <mark> tags are markup, or None
+    """
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+def full_text_search(text: str, status: PetStatus = None, page=None, species: str = None,
+                     breed: str = None):
     """
+    Relevance search over pet names, breeds, species and descriptions.
+
+    :param text: Free text to search for, e.g. "good with kids"
+    :param status: (optional) Only return pets with this status
+    :param page: (optional) Page to return, see pagination.parse_page_args
+    :param species: (optional) Only return pets of this species
+    :param breed: (optional) Only return pets of this breed
+    :return: JSON response with matching pets, best match first, each with a
+             BM25 score and an HTML escaped, highlighted snippet of its description
+    """
+    match = to_match_query(text)
+    if match is None:
+        return jsonify({"error": "Search text must contain letters or numbers"}), 400
+    params = [*SEARCH_WEIGHTS, match]
+    filters = ''
+    for column, value in (('species', species), ('breed', breed),
+                          ('status', status.value if status else None)):
+        if value:
+            filters += f' AND p.{column} = ?'
+            params.append(value)
+    select_sql = f'''
+        SELECT * FROM (
+            SELECT {Pet.select_columns('p', public=True)}, bm25(pets_fts, ?, ?, ?, ?) AS score,
+                   snippet(pets_fts, 3, char(2), char(3), '…', 12) AS snippet
+            FROM pets_fts
+            JOIN pets p ON p.pet_id = pets_fts.rowid
+            WHERE pets_fts MATCH ?{filters}
+        )
+    '''
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT DISTINCT breed FROM pets')
-    breeds = cursor.fetchall()
+    cursor.execute(*keyset_query(select_sql, [], params, SEARCH_KEYS, page))
+    pets = cursor.fetchall()
     conn.close()
+    pets, next_cursor, prev_cursor = page_rows(pets, SEARCH_KEYS, page)
+    if not pets:
+        return jsonify({"error": "No pets found meeting that criteria!"}), 404
+    results = SEARCH_SERIALIZER.dicts(pets)
+    for pet in results:
+        pet['snippet'] = highlight(pet['snippet'])
+    return json_response(dumps(results), 200, page_headers(page, next_cursor, prev_cursor))
+
+def get_facets(status: PetStatus = None):
+    """
+    Retrieve pet counts per species and breed, broken down by status.
+
+    :param status: (optional) Only count pets with this status
+    :return: JSON response mapping species -> {total, by_status, breeds -> {total, by_status}}
+    """
+    return jsonify(facet_index.facets(status)), 200
+
+def get_breeds(status: PetStatus = None):
+    """
+    Retrieve all unique breeds, served from the facet index.
+    
+    :param status: (optional) Only list breeds that have pets with this status
+    :return: JSON response with a list of unique breeds
+    """
+    breeds = sorted({breed for node in facet_index.facets(status).values()
+                     for breed in node['breeds']})
     if not breeds:
         return jsonify({"error": "No breeds found"}), 404
-    # Convert breeds to a list of strings
-    breeds = [breed[0] for breed in breeds]
     return jsonify(breeds), 200
-def get_species():
+
+def get_species(status: PetStatus = None):
     """
-    Retrieve all unique species from the database.
+    Retrieve all unique species, served from the facet index.
 
+    :param status: (optional) Only list species that have pets with this status
     :return: JSON response with a list of unique species
     :raises: 404 if no species are found
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT DISTINCT species FROM pets')
-    species = cursor.fetchall()
-    conn.close()
+    species = list(facet_index.facets(status))
     if not species:
         return jsonify({"error": "No species found"}), 404
-    # Convert species to a list of strings
-    species = [specie[0] for specie in species]
     return jsonify(species), 200
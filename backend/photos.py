@@ -0,0 +1,279 @@
+"""
+Pet photo uploads.
+
+An upload is stored under MEDIA_DIR by the SHA-256 of its bytes, so the same
+picture uploaded for many pets is kept (and cached by browsers) once, and a
+URL never changes content. The request only writes the original and records
+it in pet_photos; a small worker pool then renders thumbnails
+(THUMBNAIL_WIDTHS, as WebP and JPEG) next to it and sets the pet's
+thumbnail_url to the CATALOG_WIDTH JPEG for the catalog grid.
+
+Everything under /media/ is named after its content and served with an
+immutable, year-long Cache-Control.
+
+Settings come from the environment:
+
+    PETADOPTION_MEDIA_DIR      where images are stored (media)
+    PETADOPTION_PHOTO_WORKERS  thumbnail worker threads (2)
+    PETADOPTION_MAX_PHOTO_MB   largest accepted upload (10)
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify, send_from_directory
+from PIL import Image, ImageOps
+from db import get_db_connection, on_reset, transaction
+from facets import facet_index
+from versions import invalidate
+
+MEDIA_DIR = os.path.abspath(os.environ.get('PETADOPTION_MEDIA_DIR', 'media'))
+PHOTO_WORKERS = int(os.environ.get('PETADOPTION_PHOTO_WORKERS', '2'))
+MAX_PHOTO_BYTES = int(float(os.environ.get('PETADOPTION_MAX_PHOTO_MB', '10')) * 1024 * 1024)
+THUMBNAIL_WIDTHS = (160, 320, 640)
+CATALOG_WIDTH = 320
+THUMBNAIL_FORMATS = (('webp', 'WEBP', {'quality': 80, 'method': 4}),
+                     ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}))
+MEDIA_MAX_AGE = 365 * 24 * 3600
+MEDIA_URL = '/media/'
+
+# (magic bytes at offset 0, bytes at offset 8 or None) -> (content type, extension)
+_SIGNATURES = [
+    ((b'\xff\xd8\xff', None), ('image/jpeg', 'jpg')),
+    ((b'\x89PNG\r\n\x1a\n', None), ('image/png', 'png')),
+    ((b'GIF87a', None), ('image/gif', 'gif')),
+    ((b'GIF89a', None), ('image/gif', 'gif')),
+    ((b'RIFF', b'WEBP'), ('image/webp', 'webp')),
+]
+CONTENT_TYPES = {extension: content_type for _, (content_type, extension) in _SIGNATURES}
+_MEDIA_NAME = re.compile(r'^[0-9a-f]{64}(?:-\d+)?\.(?:jpg|png|gif|webp)$')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+@on_reset
+def _drop_executor():
+    """Forget the worker pool, e.g. in a freshly forked worker process."""
+    global _executor  # pylint: disable=global-statement
+    _executor = None
+
+
+def _get_executor():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PHOTO_WORKERS,
+                                           thread_name_prefix='photo')
+        return _executor
+
+
+def sniff(data):
+    """
+    Recognise an image by its first bytes rather than trusting the client.
+    :param data: Uploaded bytes
+    :return: (content type, extension), or None for anything else
+    """
+    for (magic, marker), kind in _SIGNATURES:
+        if data.startswith(magic) and (marker is None or data[8:12] == marker):
+            return kind
+    return None
+
+
+def media_url(content_hash, extension, width=None):
+    """
+    URL of a stored image.
+    :param content_hash: SHA-256 hex digest of the original
+    :param extension: File extension
+    :param width: (optional) Thumbnail width; the original without it
+    :return: Path under /media/
+    """
+    suffix = f'-{width}' if width else ''
+    return f'{MEDIA_URL}{content_hash}{suffix}.{extension}'
+
+
+def _write_once(name, data):
+    """Write a media file atomically unless it already exists; content never changes."""
+    path = os.path.join(MEDIA_DIR, name)
+    if os.path.exists(path):
+        return
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=MEDIA_DIR, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+
+def upload_photo(pet_id, data):
+    """
+    Store a photo for a pet and queue its thumbnails.
+    :param pet_id: ID of the pet
+    :param data: Image bytes (JPEG, PNG, GIF or WebP)
+    :return: JSON response with the photo; 202 while thumbnails are being made
+    """
+    if not data:
+        return jsonify({"error": "No image uploaded"}), 400
+    if len(data) > MAX_PHOTO_BYTES:
+        return jsonify({"error": f"Images are limited to {MAX_PHOTO_BYTES} bytes"}), 413
+    kind = sniff(data)
+    if kind is None:
+        return jsonify({"error": "Only JPEG, PNG, GIF and WebP images are accepted"}), 415
+    content_hash = hashlib.sha256(data).hexdigest()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM pets WHERE pet_id = ?', (pet_id,))
+        if cursor.fetchone() is None:
+            return jsonify({"error": "Pet not found"}), 404
+        # only once the pet is known to exist, so bad requests leave no files behind
+        _write_once(f'{content_hash}.{kind[1]}', data)
+        with transaction(conn):
+            photo = _record(cursor, pet_id, content_hash, kind, len(data))
+            cursor.execute("SELECT version FROM change_versions WHERE name = 'pets'")
+            version = cursor.fetchone()[0]
+    finally:
+        conn.close()
+    invalidate('pets')
+    facet_index.apply(None, None, version)  # species, breed and status are unchanged
+    if photo['status'] == 'pending':
+        _get_executor().submit(make_thumbnails, content_hash)
+    return jsonify(_describe(photo)), 202 if photo['status'] == 'pending' else 201
+
+
+def _record(cursor, pet_id, content_hash, kind, byte_size):
+    """Add the photo if it is new (or retry a failed one) and attach it to the pet."""
+    cursor.execute('''
+        INSERT INTO pet_photos (content_hash, content_type, extension, byte_size)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (content_hash) DO UPDATE SET status = 'pending', error = NULL
+        WHERE status = 'failed'
+    ''', (content_hash, *kind, byte_size))
+    cursor.execute('SELECT * FROM pet_photos WHERE content_hash = ?', (content_hash,))
+    photo = dict(cursor.fetchone())
+    cursor.execute('''
+        UPDATE pets SET photo_hash = ?, image_url = ?, thumbnail_url = ?
+        WHERE pet_id = ?
+    ''', (content_hash, media_url(content_hash, kind[1]), _thumbnail_url(photo), pet_id))
+    return photo
+
+
+def _thumbnail_url(photo):
+    if photo['status'] != 'ready':
+        return None
+    return media_url(photo['content_hash'], 'jpg', CATALOG_WIDTH)
+
+
+def _describe(photo):
+    return {
+        "content_hash": photo['content_hash'],
+        "status": photo['status'],
+        "image_url": media_url(photo['content_hash'], photo['extension']),
+        "thumbnail_url": _thumbnail_url(photo),
+        "width": photo['width'],
+        "height": photo['height'],
+        "variants": json.loads(photo['variants']),
+        "error": photo['error'],
+    }
+
+
+def _render(content_hash, extension):
+    """Make the thumbnails of one original; returns (width, height, variants)."""
+    with Image.open(os.path.join(MEDIA_DIR, f'{content_hash}.{extension}')) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    width, height = image.size
+    variants = []
+    for target in THUMBNAIL_WIDTHS:
+        # never upscale: small originals get their own size at every step
+        size = (min(target, width), max(1, round(height * min(target, width) / width)))
+        thumbnail = image.resize(size, Image.LANCZOS) if size != image.size else image
+        for suffix, fmt, options in THUMBNAIL_FORMATS:
+            name = f'{content_hash}-{target}.{suffix}'
+            path = os.path.join(MEDIA_DIR, name)
+            if not os.path.exists(path):
+                fd, tmp = tempfile.mkstemp(dir=MEDIA_DIR, prefix='.thumb-')
+                with os.fdopen(fd, 'wb') as f:
+                    thumbnail.save(f, fmt, **options)
+                os.replace(tmp, path)
+            variants.append({"width": target, "format": suffix,
+                             "url": media_url(content_hash, suffix, target),
+                             "bytes": os.path.getsize(path)})
+    return width, height, variants
+
+
+def make_thumbnails(content_hash):
+    """
+    Worker: render the thumbnails of a photo and point its pets at them.
+    :param content_hash: Photo to process
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT extension FROM pet_photos WHERE content_hash = ?', (content_hash,))
+        row = cursor.fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return
+    try:
+        width, height, variants = _render(content_hash, row['extension'])
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        fields = {'status': 'failed', 'error': str(e)}
+    else:
+        fields = {'status': 'ready', 'width': width, 'height': height,
+                  'variants': json.dumps(variants)}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        with transaction(conn):
+            assignments = ', '.join(f'{name} = ?' for name in fields)
+            cursor.execute(f'UPDATE pet_photos SET {assignments} WHERE content_hash = ?',
+                           (*fields.values(), content_hash))
+            if fields['status'] == 'ready':
+                cursor.execute('UPDATE pets SET thumbnail_url = ? WHERE photo_hash = ?',
+                               (media_url(content_hash, 'jpg', CATALOG_WIDTH), content_hash))
+    finally:
+        conn.close()
+    if fields['status'] == 'ready':
+        invalidate('pets')
+        facet_index.mark_stale()
+
+
+def get_photo(pet_id):
+    """
+    Describe a pet's photo and its thumbnails.
+    :param pet_id: ID of the pet
+    :return: JSON response with the photo
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT ph.* FROM pets p JOIN pet_photos ph ON ph.content_hash = p.photo_hash
+        WHERE p.pet_id = ?
+    ''', (pet_id,))
+    photo = cursor.fetchone()
+    conn.close()
+    if photo is None:
+        return jsonify({"error": "Photo not found"}), 404
+    return jsonify(_describe(dict(photo))), 200
+
+
+def send_media(filename):
+    """
+    Serve a stored image; names are content hashes, so they can be cached forever.
+    :param filename: File name under MEDIA_DIR
+    :return: File response, or a JSON error
+    """
+    if not _MEDIA_NAME.match(filename):
+        return jsonify({"error": "Not found"}), 404
+    response = send_from_directory(MEDIA_DIR, filename,
+                                   mimetype=CONTENT_TYPES[filename.rsplit('.', 1)[1]],
+                                   max_age=MEDIA_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}, immutable'
+    return response
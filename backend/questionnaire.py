@@ -1,125 +1,254 @@
 """Questionnaire Management Module"""
+import json
 import sqlite3
-from user import get_user_by_id_internal
+import threading
+from user import get_user_by_id_internal, invalidate_principal
 from enums import QuestionType
 from flask import jsonify
+from db import (get_db_connection, transaction, on_reset, existing_ids,
+                MAX_BATCH_SIZE)
+from versions import invalidate, get_version
+from serialize import dumps, json_response
+from models import Question
+from dashboard import get_stat
+from migrations import OPEN_QUESTIONNAIRES_STAT
 
-def get_db_connection():
-    """Create a database connection."""
-    conn = sqlite3.connect('petadoption.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+MAX_IDEMPOTENCY_KEY = 255
+
+class QuestionnaireSnapshot:
+    """
+    One immutable questionnaire version, compiled for serving.
+    body holds the ready-to-send JSON; questions maps question_id to its
+    Question for validating answers.
+    """
+    __slots__ = ('version_id', 'change_version', 'body', 'questions')
+
+    def __init__(self, version_id, change_version, payload):
+        self.version_id = version_id
+        self.change_version = change_version
+        self.body = dumps(payload)
+        self.questions = {q['id']: Question.from_public(q) for q in payload}
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+@on_reset
+def _drop_snapshot():
+    global _snapshot  # pylint: disable=global-statement
+    _snapshot = None
+
+def build_questions(rows):
+    """
+    Group question/choice rows into the questionnaire JSON structure.
+    :param rows: Rows with question_id, question_text, question_type and choice_text,
+                 ordered by question and choice
+    :return: List of {id, text, type, options}
+    """
+    questions = {}
+    options = {}
+    for row in rows:
+        question_id = row['question_id']
+        if question_id not in questions:
+            questions[question_id] = Question.from_row(row[:3])
+            options[question_id] = []
+        if row['choice_text']:
+            options[question_id].append(row['choice_text'])
+    for question_id, question in questions.items():
+        question.options = tuple(options[question_id])
+    return [question.public() for question in questions.values()]
+
+def current_snapshot():
+    """
+    The current questionnaire version, compiled once and then served from memory
+    until set_questionnaire (here or in another worker) publishes a new version.
+    :return: QuestionnaireSnapshot
+    """
+    global _snapshot  # pylint: disable=global-statement
+    change_version, _ = get_version('questionnaire')
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.change_version == change_version:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is not None and _snapshot.change_version == change_version:
+            return _snapshot
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT version_id, payload FROM questionnaire_versions
+            ORDER BY version_id DESC LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        conn.close()
+        if row is None:
+            _snapshot = QuestionnaireSnapshot(None, change_version, [])
+        else:
+            _snapshot = QuestionnaireSnapshot(row['version_id'], change_version,
+                                              json.loads(row['payload']))
+        return _snapshot
 
 def get_questionnaire():
     """
     Retrieve the current questionnaire.
     GET: Fetch all questions and their choices
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT questions.question_id, questions.question_text, questions.question_type, choices.choice_text
-            FROM questions
-            LEFT JOIN choices ON questions.question_id = choices.question_id
-        ''')
-        rows = cursor.fetchall()
-
-        questions = {}
-        for row in rows:
-            question_id = row['question_id']
-            if question_id not in questions:
-                questions[question_id] = {
-                    'id': question_id,
-                    'text': row['question_text'],
-                    'type': QuestionType(row['question_type']).name,
-                    'options': []
-                }
-            if row['choice_text']:
-                questions[question_id]['options'].append(row['choice_text'])
-
-        questions_list = list(questions.values())
-
-        return jsonify(questions_list), 200
+        snapshot = current_snapshot()
     except sqlite3.Error as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+    return json_response(snapshot.body)
+
+def publish_questionnaire(cursor, questions):
+    """
+    Insert a new questionnaire version with its questions and choices.
+    Must run inside the caller's transaction.
+    :param cursor: Cursor to write with
+    :param questions: List of {text, type, options}, already validated
+    :return: ID of the new version
+    """
+    cursor.execute("INSERT INTO questionnaire_versions (payload) VALUES ('[]')")
+    version_id = cursor.lastrowid
+    for q in questions:
+        cursor.execute('''
+            INSERT INTO questions (question_text, question_type, version_id)
+            VALUES (?, ?, ?)
+        ''', (q['text'], QuestionType[q['type'].upper()].value, version_id))
+        question_id = cursor.lastrowid
+
+        if q['type'].lower() == 'multiple_choice' and q.get('options'):
+            cursor.executemany('''
+                INSERT INTO choices (question_id, choice_text)
+                VALUES (?, ?)
+            ''', [(question_id, option) for option in q['options']])
+    cursor.execute('''
+        SELECT q.question_id, q.question_text, q.question_type, c.choice_text
+        FROM questions q
+        LEFT JOIN choices c ON q.question_id = c.question_id
+        WHERE q.version_id = ?
+        ORDER BY q.question_id, c.choice_id
+    ''', (version_id,))
+    payload = build_questions(cursor.fetchall())
+    cursor.execute('UPDATE questionnaire_versions SET payload = ? WHERE version_id = ?',
+                   (json.dumps(payload), version_id))
+    return version_id
 
 def set_questionnaire(data):
     """
     Replace the entire questionnaire with new questions.
-    POST: Reset and add all questions (requires ADMIN role)
+    The previous version is kept so existing answers still point at the
+    questions they answered.
+    POST: Publish a new questionnaire version (requires ADMIN role)
     """
-    if not data or 'questions' not in data:
+    if not isinstance(data, dict) or not isinstance(data.get('questions'), list):
         return jsonify({"error": "Invalid data"}), 400
 
     questions = data['questions']
+    for q in questions:
+        if not isinstance(q, dict) or not isinstance(q.get('text'), str) or not q['text'] \
+                or str(q.get('type', '')).upper() not in QuestionType.__members__:
+            return jsonify({"error": "Each question needs a text and a valid type"}), 400
+        options = q.get('options')
+        if options is not None and (not isinstance(options, list)
+                                    or not all(isinstance(o, str) for o in options)):
+            return jsonify({"error": "Question options must be a list of strings"}), 400
 
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute('DELETE FROM choices')
-        cursor.execute('DELETE FROM questions')
-
-        for q in questions:
-            cursor.execute('''
-                INSERT INTO questions (question_text, question_type)
-                VALUES (?, ?)
-            ''', (q['text'], QuestionType[q['type'].upper()].value))
-            question_id = cursor.lastrowid
-
-            if q['type'].lower() == 'multiple_choice' and q.get('options'):
-                for option in q['options']:
-                    cursor.execute('''
-                        INSERT INTO choices (question_id, choice_text)
-                        VALUES (?, ?)
-                    ''', (question_id, option))
-
-        conn.commit()
+        with transaction(conn):
+            version_id = publish_questionnaire(cursor, questions)
     except sqlite3.Error as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
-    return jsonify({"message": "Questions replaced successfully."}), 201
+    invalidate('questionnaire')
+    return jsonify({"message": "Questions replaced successfully.", "version": version_id}), 201
 
-def answer_questionnaire(user_id, data):
+def validate_answers(snapshot, answers):
+    """
+    Check submitted answers against a questionnaire snapshot.
+    :param snapshot: QuestionnaireSnapshot answers are checked against
+    :param answers: List of {question_id, answer_text}
+    :return: Error message, or None if every answer is valid
+    """
+    if not isinstance(answers, list):
+        return "Answers must be a list"
+    for answer in answers:
+        if not isinstance(answer, dict) or 'question_id' not in answer \
+                or 'answer_text' not in answer:
+            return "Each answer needs a question_id and an answer_text"
+        if not isinstance(answer['question_id'], int) or isinstance(answer['question_id'], bool) \
+                or not isinstance(answer['answer_text'], str):
+            return "question_id must be an integer and answer_text a string"
+        question = snapshot.questions.get(answer['question_id'])
+        if question is None:
+            return f"Question {answer['question_id']} is not part of the current questionnaire"
+        if question.question_type == QuestionType.MULTIPLE_CHOICE \
+                and answer['answer_text'] not in question.options:
+            return f"Invalid choice for question {answer['question_id']}"
+    return None
+
+def answer_questionnaire(user_id, data, idempotency_key=None):
     """
     Submit answers to the questionnaire.
     POST: Save user answers (requires USER role)
+
+    The check for earlier answers and the inserts run in one BEGIN IMMEDIATE
+    transaction, and a UNIQUE (user_id, question_id) index backs it up, so two
+    concurrent submits cannot both be saved.
+
+    :param user_id: ID of the user answering
+    :param data: Dictionary with the list of answers
+    :param idempotency_key: (optional) Client supplied key; retrying a submit with
+                            the same key returns the original 201 instead of an error
+    :return: JSON response with the submission status
     """
-    if not data or 'answers' not in data:
+    if not isinstance(data, dict) or 'answers' not in data:
         return jsonify({"error": "Invalid data"}), 400
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY:
+        return jsonify({"error": "Invalid Idempotency-Key"}), 400
 
     answers = data['answers']
+    error = validate_answers(current_snapshot(), answers)
+    if error:
+        return jsonify({"error": error}), 400
+    rows = [(user_id, answer['question_id'], answer['answer_text']) for answer in answers]
+    if len({row[1] for row in rows}) != len(rows):
+        return jsonify({"error": "Each question can only be answered once"}), 400
 
     conn = get_db_connection()
     cursor = conn.cursor()
+    replayed = already_answered = False
     try:
-        # Check if the user already has answers in the database
-        cursor.execute('''
-            SELECT COUNT(*) FROM questionnaire_responses WHERE user_id = ?
-        ''', (user_id,))
-        count = cursor.fetchone()[0]
-
-        if count > 0:
-            return jsonify({"error": "User has already submitted answers."}), 400
-
-        # Insert new answers
-        for answer in answers:
-            cursor.execute('''
-                INSERT INTO questionnaire_responses (user_id, question_id, answer_text)
-                VALUES (?, ?, ?)
-            ''', (user_id, answer['question_id'], answer['answer_text']))
-
-        conn.commit()
+        with transaction(conn):
+            if idempotency_key is not None:
+                cursor.execute('''
+                    SELECT 1 FROM questionnaire_submissions
+                    WHERE user_id = ? AND idempotency_key = ?
+                ''', (user_id, idempotency_key))
+                replayed = cursor.fetchone() is not None
+            if not replayed:
+                cursor.execute('SELECT 1 FROM questionnaire_responses WHERE user_id = ? LIMIT 1',
+                               (user_id,))
+                already_answered = cursor.fetchone() is not None
+            if not replayed and not already_answered:
+                cursor.executemany('''
+                    INSERT INTO questionnaire_responses (user_id, question_id, answer_text)
+                    VALUES (?, ?, ?)
+                ''', rows)
+                if idempotency_key is not None:
+                    cursor.execute('''
+                        INSERT INTO questionnaire_submissions (user_id, idempotency_key)
+                        VALUES (?, ?)
+                    ''', (user_id, idempotency_key))
+    except sqlite3.IntegrityError:
+        already_answered = True
     except sqlite3.Error as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
-    return jsonify({"message": "Answers submitted successfully."}), 201
+    if already_answered:
+        return jsonify({"error": "User has already submitted answers."}), 400
+    return jsonify({"message": "Answers submitted successfully.", "replayed": replayed}), 201
 
 def get_answered_questionnaire(user_id):
     """
@@ -216,15 +345,8 @@ def get_number_of_open_questionnaires():
     Retrieve the number of open questionnaires.
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT COUNT(DISTINCT u.user_id)
-            FROM users u
-            JOIN questionnaire_responses qr ON u.user_id = qr.user_id
-            WHERE u.approved = 0
-        ''')
-        count = cursor.fetchone()[0]
+        count = get_stat(conn.cursor(), OPEN_QUESTIONNAIRES_STAT)
         return jsonify({"open_questionnaires_count": count}), 200
     except sqlite3.Error as e:
         return jsonify({"error": str(e)}), 500
@@ -250,4 +372,41 @@ def approve_questionnaire(user_id):
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
+    invalidate_principal(user_id)
     return jsonify({"message": "Questionnaire approved successfully."}), 200
+
+def approve_questionnaires(user_ids):
+    """
+    Approve the questionnaires of many users in one transaction.
+    POST: Approve questionnaires (requires STAFF role)
+
+    :param user_ids: List of user IDs
+    :return: JSON response with the number of approved users and a result per ID
+    """
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({"error": "user_ids must be a non-empty list"}), 400
+    if len(user_ids) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} users per batch"}), 400
+    valid = [user_id for user_id in user_ids
+             if isinstance(user_id, int) and not isinstance(user_id, bool)]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        with transaction(conn):
+            found = existing_ids(cursor, 'users', 'user_id', valid)
+            cursor.executemany('UPDATE users SET approved = 1 WHERE user_id = ?',
+                               [(user_id,) for user_id in found])
+    except sqlite3.Error as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+    results = []
+    for user_id in user_ids:
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            results.append({"user_id": user_id, "ok": False, "error": "Invalid user_id"})
+        elif user_id in found:
+            invalidate_principal(user_id)
+            results.append({"user_id": user_id, "ok": True})
+        else:
+            results.append({"user_id": user_id, "ok": False, "error": "User not found"})
+    return jsonify({"approved": len(found), "results": results}), 200
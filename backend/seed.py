@@ -0,0 +1,263 @@
+"""
+Deterministic synthetic data for benchmarks and query-plan work.
+
+    python seed.py --pets 1000000 --users 100000 --applications 300000 --seed 7
+
+recreates the database (PETADOPTION_DB, or --db) and fills it with pets, users,
+a published questionnaire with answers, and applications. Every account's
+password is PASSWORD.
+
+Rows go in with executemany, one transaction per table. For the pets, the
+per-row triggers (full-text index, change versions) and secondary indexes are
+dropped during the load and put back afterwards; the full-text index is then
+rebuilt in one pass and the change version is bumped once. A million pets take
+under 20 seconds, most of it spent generating rows and building the search
+index.
+
+Apart from the password salt, the same --seed always produces the same rows.
+"""
+import argparse
+import random
+from datetime import datetime, timezone
+import db
+from database import init_db
+from enums import ApplicationStatus, PetStatus, Role
+from passwords import hash_password
+from questionnaire import publish_questionnaire
+
+PASSWORD = 'password'
+ADMIN_EMAIL = 'admin@example.test'
+BASE_EPOCH = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp())
+# ages 0-20, most pets are young
+AGE_WEIGHTS = [0.75 ** age for age in range(21)]
+
+# species -> (share of pets, breeds from most to least common)
+SPECIES = {
+    'Dog': (45, ['Mutt', 'Labrador', 'Pit Bull', 'German Shepherd', 'Beagle', 'Chihuahua',
+                 'Golden Retriever', 'Boxer', 'Husky', 'Poodle', 'Dachshund', 'Corgi']),
+    'Cat': (38, ['Domestic Shorthair', 'Domestic Longhair', 'Tabby', 'Siamese', 'Orange',
+                 'Maine Coon', 'Persian', 'Ragdoll', 'Bengal']),
+    'Rabbit': (7, ['Lop', 'Rex', 'Dutch', 'Lionhead']),
+    'Parrot': (4, ['Budgie', 'Cockatiel', 'Cockatoo', 'Macaw']),
+    'Guinea Pig': (3, ['American', 'Abyssinian', 'Peruvian']),
+    'Ferret': (2, ['Sable', 'Albino']),
+    'Eagle': (1, ['Bald Eagle']),
+}
+NAMES = ['Bella', 'Max', 'Luna', 'Charlie', 'Lucy', 'Cooper', 'Daisy', 'Milo', 'Bailey',
+         'Coco', 'Rocky', 'Nala', 'Oliver', 'Loki', 'Pepper', 'Rosie', 'Toby', 'Willow',
+         'Ziggy', 'Biscuit', 'Mochi', 'Pumpkin', 'Scout', 'Shadow', 'Sunny', 'Waffles']
+TRAITS = ['friendly', 'energetic', 'calm', 'shy', 'playful', 'gentle', 'curious', 'loyal',
+          'independent', 'vocal', 'cuddly', 'smart', 'goofy', 'quiet']
+LIKES = ['long walks', 'belly rubs', 'sunny windows', 'squeaky toys', 'treats', 'naps',
+         'other animals', 'children', 'car rides', 'fetch', 'being brushed']
+QUESTIONS = [
+    {'text': 'Do you own or rent your home?', 'type': 'multiple_choice',
+     'options': ['Own', 'Rent', 'Live with family']},
+    {'text': 'Do you have a fenced yard?', 'type': 'multiple_choice', 'options': ['Yes', 'No']},
+    {'text': 'How many hours a day would the pet be alone?', 'type': 'multiple_choice',
+     'options': ['0-2', '3-5', '6-8', 'More than 8']},
+    {'text': 'Do you have other pets?', 'type': 'multiple_choice', 'options': ['Yes', 'No']},
+    {'text': 'Tell us about your experience with pets.', 'type': 'text'},
+]
+# share of applications in each status
+APPLICATION_STATUSES = [(ApplicationStatus.PENDING, 45), (ApplicationStatus.APPROVED, 20),
+                        (ApplicationStatus.REJECTED, 35)]
+
+
+def user_email(index):
+    """Email of the index-th generated applicant."""
+    return f'user{index}@example.test'
+
+
+def staff_email(index):
+    """Email of the index-th generated staff member."""
+    return f'staff{index}@example.test'
+
+
+def staff_count(users):
+    """Number of staff accounts generated for a given number of users."""
+    return max(1, users // 200)
+
+
+def _timestamp(rng, days):
+    """
+    A time within the given number of days before BASE_EPOCH, as Unix seconds;
+    the INSERTs format it with datetime(?, 'unixepoch').
+    """
+    return BASE_EPOCH - rng.randrange(days * 86400)
+
+
+def _zipf_weights(count):
+    return [1 / (rank + 1) for rank in range(count)]
+
+
+class _BulkLoad:
+    """
+    Drop a table's triggers and secondary indexes for a bulk insert and put them
+    back afterwards; building an index once over sorted data beats updating it
+    row by row.
+    """
+    def __init__(self, cursor, table):
+        self.cursor = cursor
+        self.table = table
+        self.objects = []
+
+    def __enter__(self):
+        self.cursor.execute("SELECT type, name, sql FROM sqlite_master "
+                            "WHERE type IN ('trigger', 'index') AND tbl_name = ? "
+                            "AND sql IS NOT NULL", (self.table,))
+        self.objects = self.cursor.fetchall()
+        for kind, name, _ in self.objects:
+            self.cursor.execute(f'DROP {kind.upper()} {name}')
+        return self
+
+    def __exit__(self, *exc):
+        for _, _, sql in self.objects:
+            self.cursor.execute(sql)
+
+
+def _pets(rng, count):
+    """Pet rows, drawn a column at a time because choices(k=...) is much faster per value."""
+    species = rng.choices(list(SPECIES), [share for share, _ in SPECIES.values()], k=count)
+    breeds = {kind: iter(rng.choices(SPECIES[kind][1], _zipf_weights(len(SPECIES[kind][1])),
+                                     k=species.count(kind)))
+              for kind in SPECIES}
+    names = rng.choices(NAMES, k=count)
+    numbers = rng.choices(range(1000), k=count)
+    traits = rng.choices(TRAITS, k=2 * count)
+    likes = rng.choices(LIKES, k=2 * count)
+    ages = rng.choices(range(21), AGE_WEIGHTS, k=count)
+    created = rng.choices(range(BASE_EPOCH - 365 * 86400, BASE_EPOCH), k=count)
+    available = rng.choices([PetStatus.AVAILABLE.value, PetStatus.ADOPTED.value], [65, 35],
+                            k=count)
+    for i, kind in enumerate(species):
+        yield (
+            f'{names[i]} {numbers[i]}',
+            kind,
+            next(breeds[kind]),
+            ages[i],
+            f'{traits[2 * i].capitalize()} and {traits[2 * i + 1]}, '
+            f'loves {likes[2 * i]} and {likes[2 * i + 1]}.',
+            available[i],
+            None,
+            created[i],
+        )
+
+
+def _answer(rng, question):
+    if question['type'] == 'multiple_choice':
+        return rng.choice(question['options'])
+    return f'I have had {rng.randrange(6)} pets and love {rng.choice(LIKES)}.'
+
+
+def generate(pets=1000, users=100, applications=None, seed=0):
+    """
+    Fill an empty database (see init_db(first_run=True, mock_data=False)).
+    :param pets: Number of pets
+    :param users: Number of applicants; one admin and staff_count(users) staff are added
+    :param applications: Number of applications, defaults to two per applicant
+    :param seed: Random seed; equal seeds give equal data
+    :return: Dictionary with the number of rows written per table
+    """
+    rng = random.Random(seed)
+    if applications is None:
+        applications = users * 2
+    password_hash = hash_password(PASSWORD.encode('utf-8'))  # hashed once, shared by all
+    staff = staff_count(users)
+    first_user_id = staff + 2  # the admin is 1, then the staff
+    answered = {}
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+
+    with db.transaction(conn), _BulkLoad(cursor, 'pets'):
+        cursor.executemany('''
+            INSERT INTO pets (name, species, breed, age, description, status, image_url,
+                              created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'))
+        ''', _pets(rng, pets))
+        cursor.execute("INSERT INTO pets_fts (pets_fts) VALUES ('rebuild')")
+        cursor.execute("UPDATE change_versions SET version = version + 1, "
+                       "updated_at = CURRENT_TIMESTAMP WHERE name = 'pets'")
+
+    with db.transaction(conn):
+        cursor.execute('''
+            INSERT INTO users (email, password_hash, full_name, role, approved, created_at)
+            VALUES (?, ?, 'Admin', ?, 1, datetime(?, 'unixepoch'))
+        ''', (ADMIN_EMAIL, password_hash, Role.ADMIN, _timestamp(rng, 1000)))
+        cursor.executemany('''
+            INSERT INTO users (email, password_hash, full_name, role, approved, created_at)
+            VALUES (?, ?, ?, ?, ?, datetime(?, 'unixepoch'))
+        ''', [(staff_email(i), password_hash, f'Staff {i}', Role.STAFF, 1,
+               _timestamp(rng, 1000)) for i in range(staff)])
+
+        def applicants():
+            for i in range(users):
+                has_answers = rng.random() < 0.7
+                answered[first_user_id + i] = has_answers
+                yield (user_email(i), password_hash, f'{rng.choice(NAMES)} Applicant {i}',
+                       Role.USER, int(has_answers and rng.random() < 0.6),
+                       _timestamp(rng, 730))
+        cursor.executemany('''
+            INSERT INTO users (email, password_hash, full_name, role, approved, created_at)
+            VALUES (?, ?, ?, ?, ?, datetime(?, 'unixepoch'))
+        ''', applicants())
+
+    with db.transaction(conn):
+        version_id = publish_questionnaire(cursor, QUESTIONS)
+        cursor.execute('SELECT question_id FROM questions WHERE version_id = ? '
+                       'ORDER BY question_id', (version_id,))
+        question_ids = [row[0] for row in cursor.fetchall()]
+        cursor.executemany('''
+            INSERT INTO questionnaire_responses (user_id, question_id, answer_text)
+            VALUES (?, ?, ?)
+        ''', ((user_id, question_id, _answer(rng, question))
+              for user_id, has_answers in answered.items() if has_answers
+              for question_id, question in zip(question_ids, QUESTIONS)))
+        responses = cursor.rowcount
+
+    applicant_ids = [user_id for user_id, has_answers in answered.items() if has_answers]
+    reviewers = list(range(2, staff + 2))
+    statuses = [status for status, _ in APPLICATION_STATUSES]
+    status_weights = [weight for _, weight in APPLICATION_STATUSES]
+
+    def application_rows():
+        for _ in range(applications if applicant_ids and pets else 0):
+            status = rng.choices(statuses, status_weights)[0]
+            submitted = _timestamp(rng, 365)
+            reviewed = None if status == ApplicationStatus.PENDING \
+                else submitted + rng.randrange(14 * 86400)
+            yield (rng.choice(applicant_ids),
+                   int(pets * rng.random() ** 3) + 1,  # low IDs draw most of the interest
+                   status.value, submitted, reviewed,
+                   None if reviewed is None else rng.choice(reviewers))
+    with db.transaction(conn):
+        cursor.executemany('''
+            INSERT INTO applications (user_id, pet_id, status, submitted_at, reviewed_at,
+                                      reviewer_id)
+            VALUES (?, ?, ?, datetime(?, 'unixepoch'), datetime(?, 'unixepoch'), ?)
+        ''', application_rows())
+        application_count = max(cursor.rowcount, 0)
+    conn.close()
+    db.reset()  # in-process caches must not keep the pre-seed state
+    return {'pets': pets, 'users': users + staff + 1, 'questionnaire_responses': responses,
+            'applications': application_count}
+
+
+def main(argv=None):
+    """Recreate the database and fill it with generated data."""
+    parser = argparse.ArgumentParser(description='Generate a synthetic pet adoption database.')
+    parser.add_argument('--pets', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--applications', type=int, default=None,
+                        help='defaults to two per user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='database file, defaults to PETADOPTION_DB')
+    args = parser.parse_args(argv)
+    init_db(args.db, first_run=True, mock_data=False)
+    counts = generate(args.pets, args.users, args.applications, args.seed)
+    print(', '.join(f'{count} {table}' for table, count in counts.items()))
+    return counts
+
+
+if __name__ == '__main__':
+    main()
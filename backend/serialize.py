@@ -0,0 +1,138 @@
+"""
+JSON encoding for responses.
+
+init_app swaps Flask's JSON provider for one backed by orjson when that
+package is installed, so jsonify and request.json use it; without orjson the
+stdlib provider stays in place.
+
+RowSerializer turns query results into a JSON array in one pass. Column keys
+and enum columns are worked out once per query from cursor.description, and
+each row is zipped onto them and encoded, instead of converting every
+sqlite3.Row to a dict and then looping again to rename enum values.
+"""
+import json
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+MIMETYPE = 'application/json'
+
+
+def dumps(obj):
+    """
+    Encode a value as compact JSON.
+    :param obj: Value made of dicts, lists, strings, numbers, booleans and None
+    :return: UTF-8 encoded JSON bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider using orjson, with the stdlib provider's defaults."""
+    def _options(self, indent=None):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        # separators and ensure_ascii do not apply, orjson is always compact UTF-8
+        return orjson.dumps(obj, default=self.default,
+                            option=self._options(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def init_app(app):
+    """
+    Use the fastest available JSON provider for a Flask app.
+    :param app: Flask application
+    """
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+def enum_names(enum):
+    """
+    Map the stored values of an enum to the names the API returns.
+    :param enum: Enum class
+    :return: Dictionary value -> name
+    """
+    return {member.value: member.name for member in enum}
+
+
+class RowSerializer:
+    """Encodes rows of one query as a JSON array of objects."""
+    __slots__ = ('keys', 'mapped')
+
+    def __init__(self, columns, enums=None):
+        """
+        :param columns: Column names, in the order of the row values
+        :param enums: (optional) Column name -> mapping from stored value to output value,
+                      see enum_names; values missing from the mapping pass through
+        """
+        self.keys = tuple(columns)
+        enums = enums or {}
+        self.mapped = tuple((i, enums[key]) for i, key in enumerate(self.keys) if key in enums)
+
+    @classmethod
+    def for_cursor(cls, cursor, enums=None):
+        """
+        Build a serializer for the query a cursor just ran.
+        :param cursor: Cursor after execute
+        :param enums: (optional) See __init__
+        :return: RowSerializer
+        """
+        return cls([column[0] for column in cursor.description], enums)
+
+    def dicts(self, rows):
+        """
+        Convert rows to dictionaries, for callers that add fields before encoding.
+        :param rows: Tuples or sqlite3.Row objects
+        :return: List of dictionaries
+        """
+        keys = self.keys
+        if not self.mapped:
+            return [dict(zip(keys, row)) for row in rows]
+        result = []
+        for row in rows:
+            item = dict(zip(keys, row))
+            for i, mapping in self.mapped:
+                value = row[i]
+                item[keys[i]] = mapping.get(value, value)
+            result.append(item)
+        return result
+
+    def dumps(self, rows):
+        """
+        Encode rows as a JSON array.
+        :param rows: Tuples or sqlite3.Row objects
+        :return: UTF-8 encoded JSON bytes
+        """
+        return dumps(self.dicts(rows))
+
+
+def json_response(body, status=200, headers=None):
+    """
+    Send already encoded JSON.
+    :param body: JSON bytes, e.g. from RowSerializer.dumps
+    :param status: (optional) HTTP status code
+    :param headers: (optional) Extra headers
+    :return: Tuple of response, status and headers for a Flask view
+    """
+    return current_app.response_class(body, mimetype=MIMETYPE), status, headers or {}
@@ -0,0 +1,91 @@
+"""
+Production launcher: gunicorn with preloaded, threaded worker processes.
+
+    python serve.py                  # migrate, then serve on 0.0.0.0:5000
+    python serve.py --database-init  # recreate the database first
+    python serve.py --seed --pets 100000 --users 5000  # ...or fill it with seed.py data
+
+The database is migrated once, in the parent, before any worker exists. The
+app is then imported once (preload) and forked into the workers, each of which
+retires the connections it inherited and opens its own. Workers are recycled
+after a bounded number of requests, and SIGHUP reloads them gracefully.
+
+Settings come from the environment:
+
+    PETADOPTION_BIND              address to listen on (0.0.0.0:5000)
+    PETADOPTION_WORKERS           worker processes (one per CPU)
+    PETADOPTION_THREADS           threads per worker (4)
+    PETADOPTION_MAX_REQUESTS      requests before a worker is replaced (2000, 0 = never)
+    PETADOPTION_GRACEFUL_TIMEOUT  seconds a stopping worker may finish requests (30)
+    PETADOPTION_TIMEOUT           seconds before a stuck worker is killed (60)
+"""
+import os
+from sys import argv
+from gunicorn.app.base import BaseApplication
+import db
+from database import init_db
+from seed import main as seed_main
+
+
+def _post_fork(server, worker):  # pylint: disable=unused-argument
+    """SQLite handles must not be shared across a fork."""
+    db.reset()
+
+
+def gunicorn_options(environ=None):
+    """
+    Build the gunicorn settings from the environment.
+    :param environ: (optional) Mapping to read instead of os.environ
+    :return: Dictionary of gunicorn settings
+    """
+    environ = os.environ if environ is None else environ
+    threads = int(environ.get('PETADOPTION_THREADS', '4'))
+    max_requests = int(environ.get('PETADOPTION_MAX_REQUESTS', '2000'))
+    return {
+        'bind': environ.get('PETADOPTION_BIND', '0.0.0.0:5000'),
+        'workers': int(environ.get('PETADOPTION_WORKERS', str(os.cpu_count() or 1))),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests // 10,
+        'graceful_timeout': int(environ.get('PETADOPTION_GRACEFUL_TIMEOUT', '30')),
+        'timeout': int(environ.get('PETADOPTION_TIMEOUT', '60')),
+        'preload_app': True,
+        'post_fork': _post_fork,
+        'accesslog': '-',
+    }
+
+
+class Server(BaseApplication):
+    """gunicorn application serving the Flask app with the given settings."""
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def init(self, parser, opts, args):
+        """Settings come from gunicorn_options, not the command line."""
+
+    def load(self):
+        from main import app  # pylint: disable=import-outside-toplevel
+        return app
+
+
+def main():
+    """Migrate the database, then start the workers."""
+    if len(argv) > 1 and argv[1] == '--database-init':
+        init_db(first_run=True)
+        print("Database being (re)created.")
+    elif len(argv) > 1 and argv[1] == '--seed':
+        seed_main(argv[2:])  # e.g. --seed --pets 100000 --users 5000
+    else:
+        init_db()
+    db.reset()  # nothing opened in the parent should leak into the workers
+    Server(gunicorn_options()).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Slow-query log.
+
+Every statement that takes at least SLOW_QUERY_MS milliseconds is written as
+one JSON object per line to a rotating log file (PETADOPTION_SLOW_QUERY_LOG).
+Each record holds the SQL, its parameters, the duration, the Flask endpoint
+that ran it and the EXPLAIN QUERY PLAN output. Numbers and NULLs are logged as
+they are; text and blobs (emails, names, password hashes) only by length.
+
+A plan step that reads a whole table ("SCAN <table>" without an index) is
+listed under full_scans and sets full_scan to true.
+
+A slow BEGIN IMMEDIATE or COMMIT usually means the statement waited for
+another writer's lock rather than doing work; those are logged without a plan.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from flask import has_request_context, request
+import db
+
+SLOW_QUERY_MS = float(os.environ.get('PETADOPTION_SLOW_QUERY_MS', '200'))
+SLOW_QUERY_LOG = os.environ.get('PETADOPTION_SLOW_QUERY_LOG', 'slow_queries.log')
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+# "SCAN pets" (SQLite >= 3.36) or "SCAN TABLE pets"; not index or virtual table scans
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+_WHITESPACE = re.compile(r'\s+')
+
+_logger = logging.getLogger('petadoption.slow_queries')
+_logger.propagate = False
+_handler = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure(path=None, threshold_ms=None):
+    """
+    Change where slow queries are logged and/or the threshold.
+    :param path: (optional) Log file
+    :param threshold_ms: (optional) Minimum duration in milliseconds; negative disables the log
+    """
+    global SLOW_QUERY_LOG, SLOW_QUERY_MS, _handler  # pylint: disable=global-statement
+    with _lock:
+        if path is not None:
+            SLOW_QUERY_LOG = path
+        if threshold_ms is not None:
+            SLOW_QUERY_MS = threshold_ms
+        if _handler is not None:
+            _logger.removeHandler(_handler)
+            _handler.close()
+            _handler = None
+
+
+def _get_logger():
+    global _handler  # pylint: disable=global-statement
+    if _handler is None:
+        with _lock:
+            if _handler is None:
+                _handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=MAX_BYTES,
+                                               backupCount=BACKUP_COUNT, encoding='utf-8',
+                                               delay=True)
+                _handler.setFormatter(logging.Formatter('%(message)s'))
+                _logger.addHandler(_handler)
+                _logger.setLevel(logging.WARNING)
+    return _logger
+
+
+def _param(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, str):
+        return f'<{len(value)} chars>'
+    return value
+
+
+def explain(conn, sql, parameters):
+    """
+    Get the query plan of a statement.
+    :param conn: Connection to run EXPLAIN QUERY PLAN on
+    :param sql: Statement
+    :param parameters: Its parameters
+    :return: List of plan step descriptions
+    """
+    # A plain cursor, so the EXPLAIN itself is not reported back to us.
+    cursor = conn.cursor(sqlite3.Cursor)
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def full_scans(plan):
+    """
+    Find the tables a plan reads in full.
+    :param plan: Plan steps from explain
+    :return: List of table names
+    """
+    tables = []
+    for step in plan:
+        match = _FULL_SCAN.match(step)
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+@db.on_query
+def log_slow_query(cursor, sql, parameters, seconds):
+    """Write a record for a statement that took at least SLOW_QUERY_MS."""
+    duration_ms = seconds * 1000
+    if SLOW_QUERY_MS < 0 or duration_ms < SLOW_QUERY_MS or getattr(_local, 'busy', False):
+        return
+    _local.busy = True
+    try:
+        record = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'duration_ms': round(duration_ms, 3),
+            'threshold_ms': SLOW_QUERY_MS,
+            'sql': _WHITESPACE.sub(' ', sql).strip(),
+            'params': None,
+            'handler': None,
+            'plan': None,
+            'full_scan': False,
+            'full_scans': [],
+        }
+        if parameters is None:
+            record['executemany'] = True
+        elif isinstance(parameters, dict):
+            record['params'] = {key: _param(value) for key, value in parameters.items()}
+        else:
+            record['params'] = [_param(value) for value in parameters]
+        if has_request_context():
+            record['handler'] = request.endpoint
+            record['request'] = f'{request.method} {request.path}'
+        else:
+            record['handler'] = threading.current_thread().name
+        if parameters is not None and _EXPLAINABLE.match(sql):
+            try:
+                record['plan'] = explain(cursor.connection, sql, parameters)
+            except sqlite3.Error as e:
+                record['plan_error'] = str(e)
+            else:
+                record['full_scans'] = full_scans(record['plan'])
+                record['full_scan'] = bool(record['full_scans'])
+        _get_logger().warning(json.dumps(record, default=str))
+    finally:
+        _local.busy = False
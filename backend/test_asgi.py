@@ -0,0 +1,82 @@
+"""Tests for asgi.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import asyncio
+import io
+import json
+from unittest.mock import patch
+import asgi
+
+def call(method, path, body=b'', headers=(), query=b''):
+    """Runs one request through the ASGI app and returns the sent messages"""
+    chunks = [body[:5], body[5:]]
+    sent = []
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(k.encode(), v.encode()) for k, v in headers],
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+    asyncio.run(asgi.application(scope, receive, send))
+    return sent
+
+def test_lifespan_runs_migrations(pool):
+    """Tests that startup initialises the database"""
+    messages = [{'type': 'lifespan.startup'}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+        return {}
+
+    async def send(message):
+        sent.append(message)
+    with patch('asgi.init_db') as mock_init_db:
+        async def run():
+            task = asyncio.create_task(asgi.application({'type': 'lifespan'}, receive, send))
+            while not sent:
+                await asyncio.sleep(0.01)
+            task.cancel()
+        asyncio.run(run())
+    mock_init_db.assert_called_once()
+    assert sent == [{'type': 'lifespan.startup.complete'}]
+
+def test_json_request_and_session(schema):
+    """Tests a chunked JSON body, the session cookie and the query string"""
+    body = json.dumps({'email': 'a@example.com', 'password': 'secret',
+                       'full_name': 'A'}).encode()
+    sent = call('POST', '/register', body, [('content-type', 'application/json'),
+                                            ('content-length', str(len(body)))])
+    assert sent[0]['status'] == 201
+    sent = call('POST', '/login', body, [('content-type', 'application/json'),
+                                         ('content-length', str(len(body)))])
+    cookie = dict(sent[0]['headers'])[b'set-cookie'].decode().split(';')[0]
+    sent = call('GET', '/api/me', headers=[('cookie', cookie)])
+    assert json.loads(sent[1]['body'])['email'] == 'a@example.com'
+    sent = call('GET', '/api/pets', query=b'limit=2')
+    assert len(json.loads(sent[1]['body'])) == 2
+
+def test_large_response_is_streamed(schema):
+    """Tests that bodies above the threshold are sent in several messages"""
+    with patch('asgi.STREAM_THRESHOLD', 100):
+        sent = call('GET', '/api/pets')
+    assert sent[0]['type'] == 'http.response.start' and len(sent) > 2
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    assert len(json.loads(body)) == 8
+
+def test_chunked_body_without_content_length(schema):
+    """Tests that a body sent with Transfer-Encoding: chunked reaches the handler"""
+    body = json.dumps({'email': 'b@example.com', 'password': 'secret',
+                       'full_name': 'B'}).encode()
+    sent = call('POST', '/register', body, [('content-type', 'application/json'),
+                                            ('transfer-encoding', 'chunked')])
+    assert sent[0]['status'] == 201
+    environ = asgi.build_environ({'method': 'POST', 'path': '/', 'headers': []},
+                                 io.BytesIO(body))
+    assert environ['CONTENT_LENGTH'] == str(len(body)) and environ['wsgi.input'].tell() == 0
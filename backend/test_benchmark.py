@@ -0,0 +1,20 @@
+"""Tests for benchmark.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import benchmark
+import db
+
+def test_percentile():
+    """Tests nearest-rank percentiles"""
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 0.50) == 50
+    assert benchmark.percentile(values, 0.99) == 99
+    assert benchmark.percentile([], 0.5) is None
+
+def test_seed_scale(pool, tmp_path):
+    """Tests that the benchmark database has the requested number of rows"""
+    benchmark.seed(str(tmp_path / 'bench.db'), 300, 20, 1)
+    conn = db.get_db_connection()
+    row = conn.execute('SELECT COUNT(*), MIN(pet_id), MAX(pet_id) FROM pets').fetchone()
+    assert tuple(row) == (300, 1, 300)
+    assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 22  # admin and staff
+    conn.close()
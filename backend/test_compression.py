@@ -0,0 +1,39 @@
+"""Tests for compression.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import gzip
+from unittest.mock import patch
+import compression
+from main import app
+
+def test_negotiated_gzip(schema):
+    """Tests that large JSON is gzipped on request and small or unwanted bodies are not"""
+    client = app.test_client()
+    with patch('compression.COMPRESS_MIN_SIZE', 100), patch('compression.brotli', None):
+        plain = client.get('/api/pets')
+        assert 'Content-Encoding' not in plain.headers
+        assert 'Accept-Encoding' in plain.headers['Vary']
+        response = client.get('/api/pets', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.get_data()) == plain.get_data()
+        response = client.get('/api/pets', headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in response.headers
+    with patch('compression.COMPRESS_MIN_SIZE', len(plain.get_data()) + 1):
+        response = client.get('/api/pets', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+
+def test_compressed_bodies_cached(schema):
+    """Tests that tagged responses are compressed once and revalidate with their own tag"""
+    compression.cache.clear()
+    client = app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+    with patch('compression.COMPRESS_MIN_SIZE', 100), patch('compression.brotli', None):
+        first = client.get('/api/pets', headers=headers)
+        etag = first.headers['ETag']
+        assert etag.endswith('-gzip"')
+        with patch('compression._gzip', side_effect=AssertionError('compressed twice')):
+            second = client.get('/api/pets', headers=headers)
+        assert second.get_data() == first.get_data()
+        response = client.get('/api/pets', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 304 and response.headers['ETag'] == etag
+        plain = client.get('/api/pets')
+        assert plain.headers['ETag'] != etag
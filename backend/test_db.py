@@ -0,0 +1,111 @@
+"""Tests for db.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import sqlite3
+import threading
+import pytest
+from flask import Flask
+from migrations import MIGRATIONS, current_version, run_migrations
+from database import init_db
+
+def test_same_thread_reuses_connection(pool):
+    """Tests that a thread gets the same connection back after closing it"""
+    first = pool.get_db_connection()
+    first.close()
+    second = pool.get_db_connection()
+    second.close()
+    assert first is second
+    assert pool.pool_stats()['opened'] >= 1
+
+def test_pragmas_applied(pool):
+    """Tests that the PRAGMAs are set when the connection is opened"""
+    conn = pool.get_db_connection()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    conn.close()
+
+def test_release_rolls_back_open_transaction(pool):
+    """Tests that uncommitted work does not leak to the next caller"""
+    conn = pool.get_db_connection()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    conn.close()
+    conn = pool.get_db_connection()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    conn.close()
+
+def test_nested_release_keeps_outer_transaction(pool):
+    """Tests that an inner close() does not roll back the outer caller's work"""
+    outer = pool.get_db_connection()
+    outer.execute('CREATE TABLE t (x INTEGER)')
+    outer.commit()
+    outer.execute('INSERT INTO t VALUES (1)')
+    inner = pool.get_db_connection()
+    inner.close()
+    assert outer.in_transaction
+    outer.commit()
+    outer.close()
+
+def test_transaction_refuses_open_transaction(pool):
+    """Tests that transaction() does not commit work the caller left open"""
+    conn = pool.get_db_connection()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    with pytest.raises(sqlite3.ProgrammingError):
+        with pool.transaction(conn):
+            pass
+    conn.close()
+    conn = pool.get_db_connection()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    conn.close()
+
+def test_request_teardown_releases_leaked_connection(pool):
+    """Tests that a handler raising before close() does not keep the connection held"""
+    app = Flask(__name__)
+    pool.init_app(app)
+    @app.route('/boom')
+    def boom():
+        conn = pool.get_db_connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS t (x INTEGER)')
+        conn.execute('INSERT INTO t VALUES (1)')
+        raise KeyError('boom')
+    outer = pool.get_db_connection()  # held across the request, like a caller further up
+    assert app.test_client().get('/boom').status_code == 500
+    assert pool.held() == 1 and pool.pool_stats()['leaked'] >= 1
+    outer.close()
+    assert pool.held() == 0 and not outer.in_transaction
+
+def test_thread_exit_returns_connection_to_idle(pool):
+    """Tests that a finished thread's connection is reused by the next thread"""
+    seen = []
+    def work():
+        conn = pool.get_db_connection()
+        seen.append(id(conn))
+        conn.close()
+    for _ in range(2):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    assert seen[0] == seen[1]
+    assert pool.pool_stats()['reused_idle'] >= 1
+
+def test_migrations_are_recorded_and_idempotent(schema):
+    """Tests that init_db brings the schema to the latest version exactly once"""
+    conn = schema.get_db_connection()
+    assert current_version(conn) == MIGRATIONS[-1][0]
+    assert run_migrations(conn) == []
+    conn.close()
+    init_db()  # a normal restart keeps the data and applies nothing new
+    conn = schema.get_db_connection()
+    assert conn.execute('SELECT COUNT(*) FROM pets').fetchone()[0] == 8
+    conn.close()
+
+def test_status_lookup_uses_index(schema):
+    """Tests that filtering applications by status is an index lookup"""
+    conn = schema.get_db_connection()
+    plan = conn.execute('EXPLAIN QUERY PLAN SELECT * FROM applications WHERE status = ?',
+                        ('Pending',)).fetchall()
+    conn.close()
+    assert any('USING INDEX idx_applications_status' in row['detail'] for row in plan)
@@ -1,8 +1,14 @@
 """Tests for main.py"""
-#pylint: disable=redefined-outer-name
+#pylint: disable=redefined-outer-name,unused-argument
+import json
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 import pytest
 from main import app
+from db import get_db_connection, transaction
+from facets import facet_index
+from exports import run_export
+from questionnaire import answer_questionnaire
 from enums import Role
 
 @pytest.fixture
@@ -79,3 +85,354 @@ def test_create_pet_no_permission(mock_get_user_role, client):
     response = client.post('/api/pets', json={})
     assert response.status_code == 403
     assert response.json == {"error": "You do not have permission to access this resource"}
+
+def test_pets_keyset_pagination(client, schema):
+    """Tests walking the pet list forwards and back with cursors"""
+    seen = []
+    response = client.get('/api/pets?limit=3')
+    while True:
+        assert response.status_code == 200
+        seen.extend(pet['pet_id'] for pet in response.json)
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+        response = client.get(f'/api/pets?limit=3&cursor={cursor}')
+    assert seen == sorted(seen) and len(seen) == 8
+    previous = client.get(f"/api/pets?limit=3&cursor={response.headers['X-Prev-Cursor']}")
+    assert [pet['pet_id'] for pet in previous.json] == seen[3:6]
+
+def test_pets_invalid_cursor(client, schema):
+    """Tests that a garbled cursor is rejected"""
+    response = client.get('/api/pets?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+def test_pets_full_text_search(client, schema):
+    """Tests relevance search over descriptions with highlighting"""
+    response = client.get('/api/pets?q=cuddle')
+    assert response.status_code == 200
+    assert {pet['name'] for pet in response.json} == {'Barry', 'Harry'}
+    assert '<mark>cuddle</mark>' in response.json[0]['snippet']
+    response = client.get('/api/pets?q=cuddle&status=AVAILABLE')
+    assert response.status_code == 404
+
+def test_search_snippets_are_escaped_and_filtered(client, schema):
+    """Tests that snippets only carry <mark> markup and q= honours species and breed"""
+    with patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/pets', json={'name': 'Mallory', 'species': 'Cat', 'breed': 'Siamese',
+                                       'age': 2, 'description': '<img src=x onerror=alert(1)> '
+                                                                'loves to cuddle'})
+    snippets = {pet['name']: pet['snippet'] for pet in client.get('/api/pets?q=cuddle').json}
+    assert snippets['Mallory'] == ('&lt;img src=x onerror=alert(1)&gt; loves to '
+                                   '<mark>cuddle</mark>')
+    every = client.get('/api/pets?q=cuddle').json
+    response = client.get('/api/pets?q=cuddle&species=Cat&breed=Siamese')
+    assert [pet['name'] for pet in response.json] == [
+        pet['name'] for pet in every if (pet['species'], pet['breed']) == ('Cat', 'Siamese')]
+    assert len(response.json) < len(every)
+    assert client.get('/api/pets?q=cuddle&species=Fish').status_code == 404
+
+def test_pets_conditional_get(client, schema):
+    """Tests that an unchanged catalog answers If-None-Match with 304"""
+    response = client.get('/api/pets')
+    etag = response.headers['ETag']
+    with patch('main.get_all_pets') as mock_get_all_pets:
+        response = client.get('/api/pets', headers={'If-None-Match': etag})
+        mock_get_all_pets.assert_not_called()
+    assert response.status_code == 304
+    with patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/pets/1/status', json={'status': 'Adopted'})
+    response = client.get('/api/pets', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_pet_facets_follow_changes(client, schema):
+    """Tests that facet counts are updated when a pet changes status"""
+    facets = client.get('/api/pets/facets').json
+    assert facets['Dog']['breeds']['Beagle']['by_status'] == {'AVAILABLE': 1}
+    with patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/pets/3/status', json={'status': 'Adopted'})
+    facets = client.get('/api/pets/facets?status=AVAILABLE').json
+    assert 'Beagle' not in facets['Dog']['breeds']
+    assert client.get('/api/pets/breeds?status=AVAILABLE').json == [
+        'Bald Eagle', 'Cockatoo', 'Golden Retriever', 'Orange', 'Sable']
+
+def test_pet_facets_rebuild_reads_current_version(client, schema):
+    """Tests that a rebuild takes the version from the database, not the cached one"""
+    client.get('/api/pets/facets')
+    conn = get_db_connection()
+    with transaction(conn):  # another process: no invalidate, no facet update
+        conn.execute("UPDATE pets SET status = 'Adopted' WHERE pet_id = 3")
+        version = conn.execute(
+            "SELECT version FROM change_versions WHERE name = 'pets'").fetchone()[0]
+    conn.close()
+    facet_index.mark_stale()
+    facets = client.get('/api/pets/facets').json
+    assert facets['Dog']['breeds']['Beagle']['by_status'] == {'ADOPTED': 1}
+    # counts and version describe the same snapshot, so the change is not applied again
+    assert facet_index._version == version  # pylint: disable=protected-access
+
+def test_questionnaire_snapshot(client, schema):
+    """Tests that a published questionnaire is served from memory and validates answers"""
+    with patch('main.get_user_role', return_value=Role.ADMIN):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = client.post('/api/questionnaires', json={'questions': [
+            {'text': 'Do you have a yard?', 'type': 'multiple_choice', 'options': ['Yes', 'No']}]})
+        assert response.status_code == 201
+        first = client.get('/api/questionnaires')
+        with patch('questionnaire.get_db_connection') as mock_conn:
+            second = client.get('/api/questionnaires')
+            mock_conn.assert_not_called()
+        assert first.data == second.data
+        question_id = first.json[0]['id']
+        assert first.json[0]['options'] == ['Yes', 'No']
+        response = client.post('/api/questionnaires/submit', json={
+            'answers': [{'question_id': question_id, 'answer_text': 'Maybe'}]})
+        assert response.status_code == 400
+
+def test_questionnaire_rejects_malformed_json(client, schema):
+    """Tests that wrongly typed questions and answers are a 400, not a server error"""
+    with patch('main.get_user_role', return_value=Role.ADMIN):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        for questions in (['Do you have a yard?'], 'yard', [{'text': 'Yard?', 'type': 'text',
+                                                             'options': 'Yes'}]):
+            response = client.post('/api/questionnaires', json={'questions': questions})
+            assert response.status_code == 400
+        for answers in ([{'question_id': [1], 'answer_text': 'Yes'}],
+                        [{'question_id': 1, 'answer_text': {'a': 1}}], {'question_id': 1}):
+            response = client.post('/api/questionnaires/submit', json={'answers': answers})
+            assert response.status_code == 400
+
+def test_bulk_pet_intake(client, schema):
+    """Tests a CSV upload that mixes valid and invalid rows"""
+    upload = ("name,species,breed,age,description\n"
+              "Scout,Dog,Collie,2,Herds everything\n"
+              "Nameless,Dog,,3,No breed given\n")
+    with patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = client.post('/api/pets/bulk', data=upload, content_type='text/csv')
+    assert response.status_code == 201
+    assert response.json['inserted'] == 1
+    assert response.json['errors'] == [{"row": 3, "error": "breed is required"}]
+    assert client.get('/api/pets?q=herds').json[0]['name'] == 'Scout'
+
+def test_bulk_pet_intake_unreadable_or_empty(client, schema):
+    """Tests that rows read before a decoding error are kept and an empty upload is a 400"""
+    rows = ''.join(f"Pup {i},Dog,Collie,1,Bulk pup\n" for i in range(400))
+    upload = ("name,species,breed,age,description\n" + rows).encode() + b'\xff\xfe\n'
+    with patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = client.post('/api/pets/bulk', data=upload, content_type='text/csv')
+        assert response.status_code == 201 and response.json['inserted'] > 0
+        assert response.json['errors'][-1]['row'] is None
+        assert len(client.get('/api/pets?species=Dog&breed=Collie&limit=500').json) \
+            == response.json['inserted']
+        for empty in (b'', b'name,species,breed,age,description\n'):
+            response = client.post('/api/pets/bulk', data=empty, content_type='text/csv')
+            assert response.status_code == 400 and response.json['inserted'] == 0
+
+def test_bulk_pet_intake_rejects_wrong_types(client, schema):
+    """Tests that NDJSON rows with non-string text or non-integer ages fail on their own"""
+    rows = [{'description': {'x': 1}}, {'image_url': 5}, {'status': ['Adopted']},
+            {'age': 2.7}, {'age': True}, {'age': '²'}, {'age': ' 4 '}]
+    upload = ''.join(json.dumps({'name': 'Rex', 'species': 'Dog', 'breed': 'Mutt', 'age': 1,
+                                 **row}) + '\n' for row in rows)
+    with patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = client.post('/api/pets/bulk', data=upload,
+                               content_type='application/x-ndjson')
+    assert response.status_code == 201 and response.json['inserted'] == 1
+    assert [error['error'] for error in response.json['errors']] == [
+        "description must be a string", "image_url must be a string", "status must be a string",
+        "age must be a whole number", "age must be a whole number", "age must be a whole number"]
+
+def test_export_job(client, schema, tmp_path):
+    """Tests that an export job writes a downloadable file and reports progress"""
+    class InlineExecutor:  # pylint: disable=too-few-public-methods
+        """Runs the export on the calling thread"""
+        def submit(self, func, *args):
+            """Run func right away"""
+            func(*args)
+    client.post('/register', json={'email': 'staff@example.com', 'password': 'secret',
+                                   'full_name': 'Staff Member'})
+    with patch('exports.EXPORT_DIR', str(tmp_path)), \
+            patch('exports._get_executor', return_value=InlineExecutor()), \
+            patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = client.post('/api/exports', json={'kind': 'applications', 'format': 'csv'})
+        assert response.status_code == 202
+        job_id = response.json['job_id']
+        job = client.get(f'/api/exports/{job_id}').json
+        assert job['status'] == 'done' and job['progress'] == 1.0
+        download = client.get(f'/api/exports/{job_id}/download')
+        assert download.data.startswith(b'application_id,user_id,pet_id,status')
+        download.close()
+        response = client.post('/api/exports', json={'kind': 'users'})
+        assert response.status_code == 403
+
+def test_export_access_and_failure(client, schema, tmp_path):
+    """Tests that STAFF cannot read an ADMIN export and a failed run releases its connection"""
+    client.post('/register', json={'email': 'admin@example.com', 'password': 'secret',
+                                   'full_name': 'Admin'})
+    with patch('exports.EXPORT_DIR', str(tmp_path)), \
+            patch('exports._get_executor') as executor:
+        with patch('main.get_user_role', return_value=Role.ADMIN):
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+            job_id = client.post('/api/exports', json={'kind': 'users'}).json['job_id']
+        (_, _, kind, fmt, compressed), _ = executor.return_value.submit.call_args
+        with patch('exports._open_output', side_effect=OSError('disk full')):
+            run_export(job_id, kind, fmt, compressed)
+        conn = get_db_connection()
+        assert conn.depth == 1
+        conn.close()
+        with patch('main.get_user_role', return_value=Role.STAFF):
+            assert client.get(f'/api/exports/{job_id}').status_code == 403
+            assert client.get(f'/api/exports/{job_id}/download').status_code == 403
+        with patch('main.get_user_role', return_value=Role.ADMIN):
+            job = client.get(f'/api/exports/{job_id}').json
+            assert job['status'] == 'failed' and job['error'] == 'disk full'
+
+def test_batch_review(client, schema):
+    """Tests batch decisions with a mix of valid, unknown and malformed items"""
+    client.post('/register', json={'email': 'user@example.com', 'password': 'secret',
+                                   'full_name': 'Applicant'})
+    with patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/applications', json={'pet_id': 2})
+        response = client.post('/api/applications/batch', json={'decisions': [
+            {'application_id': 1, 'status': 'APPROVED'},
+            {'application_id': 99, 'status': 'Approved'},
+            {'application_id': 1, 'status': 'Maybe'}]})
+        assert response.status_code == 200
+        assert response.json['updated'] == 1
+        assert [r['ok'] for r in response.json['results']] == [True, False, False]
+        assert client.get('/api/applications/1').json['application']['status'] == 'Approved'
+        response = client.post('/api/users/approve/batch',
+                               json={'user_ids': [1, 42, [[1]], True, '1']})
+        assert response.json['approved'] == 1
+        assert response.json['results'][1] == {'user_id': 42, 'ok': False,
+                                               'error': 'User not found'}
+        assert [r['error'] for r in response.json['results'][2:]] == ['Invalid user_id'] * 3
+        response = client.post('/api/applications/batch', json={'decisions': [
+            {'application_id': True, 'status': 'APPROVED'},
+            {'application_id': 1, 'status': ['APPROVED']}]})
+        assert response.status_code == 200 and response.json['updated'] == 0
+
+def test_questionnaire_submit_once(client, schema):
+    """Tests that concurrent submits save one set of answers and that keys replay"""
+    client.post('/register', json={'email': 'user@example.com', 'password': 'secret',
+                                   'full_name': 'Applicant'})
+    with patch('main.get_user_role', return_value=Role.ADMIN):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/questionnaires', json={'questions': [
+            {'text': 'Why adopt?', 'type': 'text'}, {'text': 'Other pets?', 'type': 'text'}]})
+        questions = client.get('/api/questionnaires').json
+        body = {'answers': [{'question_id': q['id'], 'answer_text': 'Yes'} for q in questions]}
+
+        def submit(_):
+            with app.app_context():
+                return answer_questionnaire(1, body)[1]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            assert sorted(pool.map(submit, range(4))) == [201, 400, 400, 400]
+        assert len(client.get('/api/questionnaires/1').json) == 2
+
+        client.post('/register', json={'email': 'other@example.com', 'password': 'secret',
+                                       'full_name': 'Other Applicant'})
+        with client.session_transaction() as sess:
+            sess['user_id'] = 2
+        for replayed in (False, True):
+            response = client.post('/api/questionnaires/submit', json=body,
+                                   headers={'Idempotency-Key': 'abc'})
+            assert response.status_code == 201 and response.json['replayed'] is replayed
+        response = client.post('/api/questionnaires/submit', json=body)
+        assert response.status_code == 400
+
+def test_dashboard_counters(client, schema):
+    """Tests that the trigger-maintained counters match the tables they summarise"""
+    client.post('/register', json={'email': 'user@example.com', 'password': 'secret',
+                                   'full_name': 'Applicant'})
+    with patch('main.get_user_role', return_value=Role.ADMIN):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/questionnaires', json={'questions': [
+            {'text': 'Why adopt?', 'type': 'text'}, {'text': 'Other pets?', 'type': 'text'}]})
+        questions = client.get('/api/questionnaires').json
+        client.post('/api/questionnaires/submit', json={
+            'answers': [{'question_id': q['id'], 'answer_text': 'Yes'} for q in questions]})
+        for pet_id in (1, 2, 3):
+            client.post('/api/applications', json={'pet_id': pet_id})
+        client.post('/api/applications/batch', json={'decisions': [
+            {'application_id': 1, 'status': 'APPROVED'},
+            {'application_id': 2, 'status': 'REJECTED'}]})
+
+        summary = client.get('/api/dashboard/summary').json
+        assert summary == {'applications': {'total': 3, 'by_status': {
+            'PENDING': 1, 'APPROVED': 1, 'REJECTED': 1}}, 'open_questionnaires': 1}
+        assert client.get('/api/applications/count').json == {'application_count': 3}
+        response = client.get('/api/applications/count?status=PENDING')
+        assert response.json == {'application_count': 1}
+        assert client.get('/api/applications/count?status=Maybe').status_code == 400
+
+        client.post('/api/users/approve/batch', json={'user_ids': [1]})
+        assert client.get('/api/dashboard/summary').json['open_questionnaires'] == 0
+        conn = get_db_connection()
+        conn.execute('UPDATE users SET approved = 0 WHERE user_id = 1')
+        conn.execute('DELETE FROM applications WHERE application_id = 1')
+        conn.commit()
+        conn.close()
+        summary = client.get('/api/dashboard/summary').json
+        assert summary['open_questionnaires'] == 1
+        assert summary['applications']['total'] == 2
+        assert summary['applications']['by_status']['APPROVED'] == 0
+
+def test_review_packets(client, schema):
+    """Tests that review packets embed everything and take the same queries for any page size"""
+    with patch('main.get_user_role', return_value=Role.ADMIN):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/questionnaires', json={'questions': [
+            {'text': 'Why adopt?', 'type': 'text'}]})
+        for i in range(6):
+            client.post('/register', json={'email': f'user{i}@example.com',
+                                           'password': 'secret', 'full_name': f'Applicant {i}'})
+        question_id = client.get('/api/questionnaires').json[0]['id']
+        for user_id in range(1, 7):
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+            client.post('/api/questionnaires/submit', json={'answers': [
+                {'question_id': question_id, 'answer_text': f'Answer {user_id}'}]})
+            client.post('/api/applications', json={'pet_id': user_id})
+
+        statements = []
+        with patch('db._query_callbacks', [lambda cursor, sql, *_: statements.append(sql)]):
+            response = client.get('/api/applications/review?status=PENDING&limit=2')
+            small = len(statements)
+            statements.clear()
+            client.get('/api/applications/review?limit=6')
+            assert len(statements) == small
+        assert response.status_code == 200
+        packet = response.json[0]
+        assert packet['status'] == 'PENDING'
+        assert packet['applicant']['full_name'] == 'Applicant 0'
+        assert 'password_hash' not in packet['applicant']
+        assert packet['pet']['pet_id'] == packet['pet_id']
+        assert packet['answers'] == [{'question_id': question_id,
+                                      'question_text': 'Why adopt?', 'answer_text': 'Answer 1'}]
+        response = client.get('/api/applications/review?limit=2&cursor='
+                              + response.headers['X-Next-Cursor'])
+        assert [p['application_id'] for p in response.json] == [3, 4]
+        assert client.get('/api/applications/review?status=Maybe').status_code == 400
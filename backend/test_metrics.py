@@ -0,0 +1,45 @@
+"""Tests for metrics.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+from unittest.mock import patch
+import metrics
+from main import app
+from metrics import normalize_sql
+
+def test_normalize_sql():
+    """Tests that formatting and IN list lengths do not create new labels"""
+    assert normalize_sql('SELECT *\n    FROM pets WHERE pet_id IN (?, ?, ?)') == \
+        normalize_sql('SELECT * FROM pets WHERE pet_id IN (?,?)') == \
+        'SELECT * FROM pets WHERE pet_id IN (?)'
+
+def test_metrics_exposition(schema):
+    """Tests that requests and queries show up in /metrics"""
+    for metric in metrics.REGISTRY:
+        metric.values.clear()
+    client = app.test_client()
+    client.get('/api/pets/1')
+    client.get('/api/pets/1')
+    client.get('/no/such/page')
+    response = client.get('/metrics')
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert 'petadoption_http_requests_total{route="/api/pets/<int:pet_id>",method="GET",' \
+           'status="200"} 2' in text
+    assert 'route="unmatched",method="GET",status="404"' in text
+    assert 'petadoption_http_request_duration_seconds_count{route="/api/pets/<int:pet_id>",' \
+           'method="GET"} 2' in text
+    assert 'petadoption_http_requests_in_flight{route="/metrics"} 1' in text
+    assert 'petadoption_db_query_duration_seconds_count{statement="SELECT' in text
+    assert 'petadoption_db_pool{stat="opened"}' in text
+
+def test_metrics_access(schema):
+    """Tests that /metrics needs the token, or a direct local request without one"""
+    client = app.test_client()
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.5'}).status_code == 403
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.5'}).status_code == 403
+    with patch('metrics.METRICS_TOKEN', 'scrape-me'):
+        assert client.get('/metrics').status_code == 403
+        response = client.get('/metrics', headers={'Authorization': 'Bearer wrong'})
+        assert response.status_code == 403
+        response = client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.5'},
+                              headers={'Authorization': 'Bearer scrape-me'})
+        assert response.status_code == 200
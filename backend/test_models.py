@@ -0,0 +1,22 @@
+"""Tests for models.py"""
+from enums import ApplicationStatus, PetStatus, Role
+from models import Application, Pet, User
+
+def test_from_row_and_public():
+    """Tests typed construction from row tuples and the public projection"""
+    user = User.from_row((7, 'a@example.com', 'A', None, 2, 1, '2025-01-01', b'hash'))
+    assert user.role is Role.STAFF and user.approved is True
+    assert not hasattr(user, '__dict__')
+    assert 'password_hash' not in user.public() and 'hash' not in repr(user)
+    row = (1, 7, 3, 'Approved', None, None, None, None)
+    application = Application.from_row(row)
+    assert application.status is ApplicationStatus.APPROVED
+    assert application.public()['status'] == 'APPROVED'
+    assert Application.serializer().dicts([row]) == [application.public()]
+
+def test_unknown_enum_values_pass_through():
+    """Tests that a value outside the enum does not break loading"""
+    pet = Pet.from_row((1, 'Rex', 'Dog', 'Mutt', 3, None, 'On hold', None, None))
+    assert pet.status == 'On hold'
+    assert Pet.from_row((1, 'Rex', 'Dog', 'Mutt', 3, None, 'Adopted', None, None)).status \
+        is PetStatus.ADOPTED
@@ -0,0 +1,104 @@
+"""Tests for photos.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import hashlib
+import io
+import os
+import sqlite3
+import struct
+import zlib
+from unittest.mock import patch
+import pytest
+from PIL import Image
+import db
+import photos
+from enums import Role
+from main import app
+
+def png(width, height):
+    """A valid RGB PNG of one colour"""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    rows = b''.join(b'\x00' + b'\x10\x80\xf0' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+@pytest.fixture
+def staff(schema, tmp_path):
+    """A STAFF client with photos stored in a temporary directory and jobs run by hand"""
+    client = app.test_client()
+    with patch('photos.MEDIA_DIR', str(tmp_path / 'media')), \
+            patch('photos._get_executor') as executor, \
+            patch('main.get_user_role', return_value=Role.STAFF):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        yield client, executor.return_value
+
+def test_upload_is_content_addressed(staff):
+    """Tests that uploads are stored once by hash, shared by pets and cached forever"""
+    client, executor = staff
+    data = png(8, 4)
+    digest = hashlib.sha256(data).hexdigest()
+    response = client.post('/api/pets/1/photo', data=data, content_type='image/png')
+    assert response.status_code == 202
+    assert response.json['image_url'] == f'/media/{digest}.png'
+    assert response.json['status'] == 'pending'
+    executor.submit.assert_called_once_with(photos.make_thumbnails, digest)
+    response = client.post('/api/pets/2/photo', content_type='multipart/form-data',
+                           data={'photo': (io.BytesIO(data), 'other-name.png')})
+    assert response.json['content_hash'] == digest
+    assert client.get('/api/pets/2').json['image_url'] == f'/media/{digest}.png'
+    media = client.get(f'/media/{digest}.png')
+    assert media.get_data() == data and media.mimetype == 'image/png'
+    assert 'immutable' in media.headers['Cache-Control']
+    assert client.get('/media/../database.py').status_code == 404
+    assert client.get(f'/media/{digest}.exe').status_code == 404
+
+def test_upload_rejects_bad_input(staff):
+    """Tests that non-images, missing pets and oversized bodies are refused"""
+    client, _ = staff
+    assert client.post('/api/pets/1/photo', data=b'%PDF-1.4').status_code == 415
+    assert client.post('/api/pets/9999/photo', data=png(1, 1)).status_code == 404
+    assert not os.path.exists(photos.MEDIA_DIR)  # nothing stored for a missing pet
+    with patch('main.MAX_PHOTO_BYTES', 10), patch('photos.MAX_PHOTO_BYTES', 10):
+        assert client.post('/api/pets/1/photo', data=png(1, 1)).status_code == 413
+    assert client.get('/api/pets/3/photo').status_code == 404
+
+def test_unreadable_image_fails(staff):
+    """Tests that an image Pillow cannot decode is marked failed and retried on re-upload"""
+    client, executor = staff
+    data = png(2, 2)[:20]
+    digest = client.post('/api/pets/1/photo', data=data).json['content_hash']
+    photos.make_thumbnails(digest)
+    photo = client.get('/api/pets/1/photo').json
+    assert photo['status'] == 'failed' and photo['error'] and photo['thumbnail_url'] is None
+    assert client.post('/api/pets/1/photo', data=data).status_code == 202
+    assert executor.submit.call_count == 2
+
+def test_thumbnails(staff):
+    """Tests that thumbnails are rendered without upscaling and set on every pet"""
+    client, _ = staff
+    data = png(400, 200)
+    digest = client.post('/api/pets/1/photo', data=data).json['content_hash']
+    client.post('/api/pets/2/photo', data=data)
+    photos.make_thumbnails(digest)
+    photo = client.get('/api/pets/1/photo').json
+    assert photo['status'] == 'ready' and (photo['width'], photo['height']) == (400, 200)
+    assert len(photo['variants']) == 2 * len(photos.THUMBNAIL_WIDTHS)
+    for pet_id in (1, 2):
+        assert client.get(f'/api/pets/{pet_id}').json['thumbnail_url'] == photo['thumbnail_url']
+    assert client.get(photo['thumbnail_url']).mimetype == 'image/jpeg'
+    with Image.open(io.BytesIO(client.get(f'/media/{digest}-640.webp').get_data())) as large:
+        assert large.size == (400, 200)
+    response = client.post('/api/pets/3/photo', data=data)
+    assert response.status_code == 201 and response.json['thumbnail_url'] == photo['thumbnail_url']
+
+def test_thumbnail_worker_releases_connection(staff):
+    """Tests that a failed write in the worker does not keep its connection checked out"""
+    client, _ = staff
+    digest = client.post('/api/pets/1/photo', data=png(4, 4)).json['content_hash']
+    with patch('photos.transaction', side_effect=sqlite3.OperationalError('database is locked')):
+        with pytest.raises(sqlite3.OperationalError):
+            photos.make_thumbnails(digest)
+    assert db.held() == 0
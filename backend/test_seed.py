@@ -0,0 +1,41 @@
+"""Tests for seed.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import db
+from database import init_db
+from seed import generate, main, PASSWORD, user_email
+from user import login
+from main import app
+
+def dump():
+    """Everything generate() writes apart from the password hashes"""
+    conn = db.get_db_connection()
+    rows = [[tuple(row) for row in conn.execute(sql).fetchall()] for sql in (
+        'SELECT * FROM pets',
+        'SELECT user_id, email, full_name, role, approved, created_at FROM users',
+        'SELECT user_id, question_id, answer_text FROM questionnaire_responses',
+        'SELECT * FROM applications')]
+    conn.close()
+    return rows
+
+def test_generate_is_deterministic(pool):
+    """Tests that the same seed produces the same database"""
+    counts = main(['--pets', '200', '--users', '30', '--seed', '5'])
+    assert counts['pets'] == 200 and counts['applications'] == 60
+    first = dump()
+    init_db(first_run=True, mock_data=False)
+    generate(200, 30, seed=5)
+    assert dump() == first
+    init_db(first_run=True, mock_data=False)
+    generate(200, 30, seed=6)
+    assert dump() != first
+
+def test_generated_data_is_usable(pool):
+    """Tests that search, facets and logins work on generated data"""
+    init_db(first_run=True, mock_data=False)
+    generate(100, 10, seed=1)
+    client = app.test_client()
+    assert sum(species['total'] for species in client.get('/api/pets/facets').json.values()) \
+        == 100
+    assert client.get('/api/pets?q=friendly').status_code == 200
+    with app.test_request_context():
+        assert login(user_email(3), PASSWORD.encode('utf-8'))[1] == 200
@@ -0,0 +1,30 @@
+"""Tests for serialize.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import json
+from datetime import datetime, timezone
+from unittest.mock import patch
+from flask import jsonify
+from enums import ApplicationStatus
+from main import app
+from serialize import RowSerializer, enum_names
+
+def test_row_serializer():
+    """Tests that rows become objects with enum values renamed, with or without orjson"""
+    serializer = RowSerializer(['application_id', 'status'],
+                               {'status': enum_names(ApplicationStatus)})
+    rows = [(1, 'Pending'), (2, 'Approved'), (3, 'Unknown')]
+    expected = [{'application_id': 1, 'status': 'PENDING'},
+                {'application_id': 2, 'status': 'APPROVED'},
+                {'application_id': 3, 'status': 'Unknown'}]
+    assert serializer.dicts(rows) == expected
+    assert json.loads(serializer.dumps(rows)) == expected
+    with patch('serialize.orjson', None):
+        assert json.loads(serializer.dumps(rows)) == expected
+
+def test_json_provider():
+    """Tests that jsonify keeps Flask's output for dates and sorted keys"""
+    with app.test_request_context():
+        moment = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        body = jsonify({'b': moment, 'a': ApplicationStatus.PENDING}).get_data(as_text=True)
+        assert body == '{"a":"Pending","b":"Thu, 02 Jan 2025 03:04:05 GMT"}\n'
+        assert app.json.loads(b'{"x": [1, 2]}') == {'x': [1, 2]}
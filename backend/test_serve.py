@@ -0,0 +1,18 @@
+"""Tests for serve.py"""
+from unittest.mock import patch
+import serve
+
+def test_options_from_environment():
+    """Tests that worker settings are read from the environment"""
+    options = serve.gunicorn_options({'PETADOPTION_WORKERS': '3', 'PETADOPTION_THREADS': '1',
+                                      'PETADOPTION_MAX_REQUESTS': '500'})
+    assert options['workers'] == 3
+    assert options['worker_class'] == 'sync'
+    assert options['max_requests'] == 500 and options['max_requests_jitter'] == 50
+    assert options['preload_app'] is True
+
+def test_workers_drop_inherited_connections():
+    """Tests that a forked worker retires the parent's SQLite connections"""
+    with patch('serve.db.reset') as mock_reset:
+        serve.gunicorn_options({})['post_fork'](None, None)
+    mock_reset.assert_called_once()
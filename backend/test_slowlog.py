@@ -0,0 +1,42 @@
+"""Tests for slowlog.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import json
+import pytest
+import db
+import slowlog
+from main import app
+
+@pytest.fixture
+def slow_log(tmp_path):
+    """Logs every statement to a temporary file"""
+    path = tmp_path / 'slow.log'
+    threshold = slowlog.SLOW_QUERY_MS
+    slowlog.configure(path=str(path), threshold_ms=0)
+    yield lambda: [json.loads(line) for line in path.read_text().splitlines()]
+    slowlog.configure(threshold_ms=threshold)
+
+def test_full_scan_is_flagged(schema, slow_log):
+    """Tests that a table scan is flagged and an index lookup is not"""
+    conn = db.get_db_connection()
+    conn.execute('SELECT * FROM pets WHERE age > ?', (1,)).fetchall()
+    conn.execute('SELECT * FROM pets WHERE pet_id = ?', (1,)).fetchall()
+    conn.execute('UPDATE users SET password_hash = ? WHERE user_id = ?', (b'secret', 1))
+    conn.close()
+    scan, lookup, update = slow_log()[-3:]
+    assert scan['full_scan'] and scan['full_scans'] == ['pets'] and scan['params'] == [1]
+    assert not lookup['full_scan'] and lookup['plan']
+    assert update['params'] == ['<6 bytes>', 1]
+
+def test_text_parameters_are_redacted(schema, slow_log):
+    """Tests that emails and other text never reach the log"""
+    app.test_client().post('/login', json={'email': 'private@example.com', 'password': 'x'})
+    lookups = [r for r in slow_log() if 'WHERE email = ?' in r['sql']]
+    assert lookups and lookups[0]['params'] == ['<19 chars>']
+    assert 'private@example.com' not in json.dumps(slow_log())
+
+def test_handler_is_recorded(schema, slow_log):
+    """Tests that the Flask endpoint running the query is logged"""
+    app.test_client().get('/api/pets/2')
+    record = [r for r in slow_log() if r['sql'].startswith('SELECT')][-1]
+    assert record['handler'] == 'pet_detail_route'
+    assert record['request'] == 'GET /api/pets/2'
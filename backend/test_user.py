@@ -0,0 +1,87 @@
+"""Tests for user.py"""
+#pylint: disable=redefined-outer-name,unused-argument
+import threading
+from unittest.mock import patch
+import bcrypt
+import db
+import user
+from user import create_user, get_user_role, get_principal, login
+from questionnaire import approve_questionnaire
+from main import app
+from enums import Role
+
+def make_user(role=Role.USER):
+    """Inserts a user and returns its ID"""
+    with app.app_context():
+        response, _ = create_user({
+            "email": f"{role.name.lower()}@example.com",
+            "password_hash": bcrypt.hashpw(b"secret", bcrypt.gensalt(4)),
+            "full_name": "Test User",
+            "role": role,
+        })
+        return response.json["user_id"]
+
+def test_role_lookup_is_cached(schema):
+    """Tests that repeated role checks only query the database once"""
+    user_id = make_user(Role.STAFF)
+    assert get_user_role(user_id) == Role.STAFF
+    with patch.object(user, 'get_db_connection') as mock_conn:
+        assert get_user_role(user_id) == Role.STAFF
+        mock_conn.assert_not_called()
+
+def test_approval_invalidates_principal(schema):
+    """Tests that approving a questionnaire is reflected immediately"""
+    user_id = make_user()
+    assert get_principal(user_id) == (Role.USER, False)
+    with app.app_context():
+        approve_questionnaire(user_id)
+    assert get_principal(user_id) == (Role.USER, True)
+
+def test_unknown_user_is_guest(schema):
+    """Tests that a missing user has no permissions"""
+    assert get_user_role(999) == Role.GUEST
+
+def test_login_upgrades_weak_hash(schema):
+    """Tests that a successful login rehashes a password stored with a lower cost"""
+    user_id = make_user()
+    with app.test_request_context(), patch('passwords.BCRYPT_ROUNDS', 5):
+        assert login('user@example.com', b'wrong')[1] == 401
+        assert login('user@example.com', b'secret')[1] == 200
+    conn = db.get_db_connection()
+    stored = conn.execute('SELECT password_hash FROM users WHERE user_id = ?',
+                          (user_id,)).fetchone()[0]
+    conn.close()
+    assert stored.startswith(b'$2b$05$') and bcrypt.checkpw(b'secret', stored)
+
+def test_login_caches_same_principal(schema):
+    """Tests that logging in caches approval as a bool, like a role lookup does"""
+    user_id = make_user()
+    with app.test_request_context():
+        assert login('user@example.com', b'secret')[1] == 200
+    assert get_principal(user_id)[1] is False
+
+def test_hashing_queue_full(schema):
+    """Tests that logins are refused with 503 once the hashing queue is full"""
+    with patch('passwords._slots', threading.BoundedSemaphore(1)) as slots:
+        slots.acquire()
+        response = app.test_client().post('/login', json={'email': 'a@example.com',
+                                                          'password': 'x'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_user_listings_hide_password_hash(schema):
+    """Tests that every user endpoint returns the same public fields"""
+    user_id = make_user(Role.ADMIN)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    listed = client.get('/api/users')
+    assert listed.status_code == 200
+    single = client.get(f'/api/users/{user_id}')
+    assert listed.json == [single.json]
+    assert single.json == {'user_id': user_id, 'email': 'admin@example.com',
+                           'full_name': 'Test User', 'phone': None, 'role': Role.ADMIN,
+                           'approved': False, 'created_at': single.json['created_at']}
+    conn = db.get_db_connection()
+    assert conn.depth == 1  # nothing left open by the handlers on this thread
+    conn.close()
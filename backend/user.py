@@ -1,17 +1,24 @@
 """The module for managing user-related operations."""
-import sqlite3
+import os
+import threading
+from time import monotonic
 from flask import jsonify, make_response, session
-from bcrypt import hashpw
 from enums import Role
+from db import get_db_connection, on_reset
+from passwords import check_password, hash_password, needs_rehash, HashingBusy
+from pagination import keyset_query, page_rows, page_headers
+from models import User
+from serialize import json_response
 
-def get_db_connection():
-    """
-    Create a database connection to the SQLite database.
-    :return: SQLite connection object
-    """
-    conn = sqlite3.connect('petadoption.db')
-    conn.row_factory = sqlite3.Row  # Allows accessing columns by name
-    return conn
+# Authorization data (role, approved) cached per user so login_required does not
+# query the database on every request. Local writes invalidate their entry right
+# away; the TTL bounds how stale other worker processes can be.
+PRINCIPAL_TTL = float(os.environ.get('PETADOPTION_PRINCIPAL_TTL', '30'))
+PRINCIPAL_CACHE_SIZE = 10000
+_principal_cache = {}
+_principal_lock = threading.Lock()
+
+USER_KEYS = [('user_id', 'user_id')]
 
 def create_user(user_data: dict):
     """
@@ -38,6 +45,7 @@ def create_user(user_data: dict):
     ''', (user_data['email'],))
     count = cursor.fetchone()[0]
     if count > 0:
+        conn.close()
         return jsonify("Email already exists"), 400
     cursor.execute('''
         INSERT INTO Users (email, password_hash, full_name, phone, role, approved)
@@ -80,36 +88,35 @@ def get_user_by_id(user_id: int):
     :param user_id: ID of the user to retrieve
     :return: JSON response with the user details
     """
+    user = load_user(user_id)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify(user.public()), 200
+
+def load_user(user_id: int):
+    """
+    Load a user without their password hash.
+
+    :param user_id: ID of the user to load
+    :return: User, or None if there is no such user
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Users WHERE user_id = ?', (user_id,))
-    user = cursor.fetchone()
+    cursor.execute(f'SELECT {User.select_columns(public=True)} FROM users WHERE user_id = ?',
+                   (user_id,))
+    row = cursor.fetchone()
     conn.close()
-    if user is None:
-        return jsonify({"error": "User not found"}), 404
-    user = dict(user)
-    if 'password_hash' in user:
-        del user['password_hash']
-    return jsonify(user), 200
+    return User.from_row(row) if row else None
 
 def get_user_by_id_internal(user_id: int):
     """
     Retrieve a specific user by their ID.
 
     :param user_id: ID of the user to retrieve
-    :return: JSON response with the user details
+    :return: Dictionary with the public user details, or None if there is no such user
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Users WHERE user_id = ?', (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    if user is None:
-        return jsonify({"error": "User not found"}), 404
-    user = dict(user)
-    if 'password_hash' in user:
-        del user['password_hash']
-    return user
+    user = load_user(user_id)
+    return user.public() if user else None
 
 def get_user_by_email(email: str):
     """
@@ -120,35 +127,32 @@ def get_user_by_email(email: str):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM USERS WHERE email = ?', (email,))
-    user = cursor.fetchone()
+    cursor.execute(f'SELECT {User.select_columns(public=True)} FROM users WHERE email = ?',
+                   (email,))
+    row = cursor.fetchone()
     conn.close()
-    if user is None:
+    if row is None:
         return jsonify({"error": "User not found"}), 404
-    user = dict(user)
-    user['role'] = Role(user['role'])
-    if 'password_hash' in user:
-        del user['password_hash']
-    return jsonify(user), 200
+    return jsonify(User.from_row(row).public()), 200
 
-def get_all_users():
+def get_all_users(page=None):
     """
     Retrieve all users.
     
+    :param page: (optional) Page to return, see pagination.parse_page_args
     :return: JSON response with a list of users
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Users')
+    cursor.execute(*keyset_query(f'SELECT {User.select_columns(public=True)} FROM users', [], [],
+                                 USER_KEYS, page))
     users = cursor.fetchall()
     conn.close()
+    users, next_cursor, prev_cursor = page_rows(users, USER_KEYS, page)
     if not users:
         return jsonify({"error": "No users found"}), 404
-
-    users = [dict(user) for user in users]
-    for user in users:
-        user['role'] = Role(user['role'])
-    return jsonify(users), 200
+    return json_response(User.serializer().dumps(users), 200,
+                         page_headers(page, next_cursor, prev_cursor))
 
 def get_users_by_role(role: Role):
     """
@@ -159,88 +163,117 @@ def get_users_by_role(role: Role):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM Users WHERE role = ?', (role,))
+    cursor.execute(f'SELECT {User.select_columns(public=True)} FROM users WHERE role = ?',
+                   (role,))
     users = cursor.fetchall()
     conn.close()
     if not users:
         return jsonify({"error": "No users found"}), 404
+    return json_response(User.serializer().dumps(users))
 
-    users = [dict(user) for user in users]
-    for user in users:
-        user['role'] = Role(user['role'])
-    return jsonify(users), 200
-
-def get_user_role(user_id: str):
-    """
-    Retrieve the role of a user by their ID.
-    :param user_id: ID of the user to retrieve the role for
-    :return: ENUM corresponding to the user's role
-    """
-    response, status = get_user_by_id(user_id)
-    if status != 200:
+def _to_role(value):
+    try:
+        return Role(value)
+    except ValueError:
         return Role.GUEST
-    user = response.json
-    if user.get("role") == Role.ADMIN:
-        return Role.ADMIN
-    if user.get("role") == Role.STAFF:
-        return Role.STAFF
-    if user.get("role") == Role.USER:
-        return Role.USER
-    return Role.GUEST
 
-def get_pw_hash_from_email(email: str):
+def _cache_principal(user_id, role, approved):
+    now = monotonic()
+    with _principal_lock:
+        if len(_principal_cache) >= PRINCIPAL_CACHE_SIZE:
+            for key in [k for k, v in _principal_cache.items() if v[2] <= now]:
+                del _principal_cache[key]
+            if len(_principal_cache) >= PRINCIPAL_CACHE_SIZE:
+                _principal_cache.clear()
+        _principal_cache[user_id] = (role, approved, now + PRINCIPAL_TTL)
+
+def get_principal(user_id: int):
     """
-    Retrieve the password hash of a user by their email.
-    
-    :param email: Email of the user
-    :return: Password hash of the user
+    Retrieve the role and approval flag of a user, served from the principal cache.
+    :param user_id: ID of the user
+    :return: Tuple (Role, approved); unknown users are (Role.GUEST, False)
     """
+    entry = _principal_cache.get(user_id)
+    if entry is not None and entry[2] > monotonic():
+        return entry[0], entry[1]
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT password_hash FROM Users WHERE email = ?', (email,))
-    pw_hash = cursor.fetchone()
+    cursor.execute('SELECT role, approved FROM users WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
     conn.close()
-    return pw_hash[0] if pw_hash else None
+    if row is None:
+        role, approved = Role.GUEST, False
+    else:
+        role, approved = _to_role(row['role']), bool(row['approved'])
+    _cache_principal(user_id, role, approved)
+    return role, approved
+
+@on_reset
+def invalidate_principal(user_id: int = None):
+    """
+    Drop cached authorization data after a role or approval change.
+    :param user_id: ID of the user to forget, or None to clear the whole cache
+    """
+    with _principal_lock:
+        if user_id is None:
+            _principal_cache.clear()
+        else:
+            _principal_cache.pop(user_id, None)
+
+def get_user_role(user_id: int):
+    """
+    Retrieve the role of a user by their ID.
+    :param user_id: ID of the user to retrieve the role for
+    :return: ENUM corresponding to the user's role
+    """
+    return get_principal(user_id)[0]
 
 def login(email: str, guessed_password: bytearray):
     """
     Log in a user with the given email and password.
+    The password is checked on the hashing pool; a hash made with a lower
+    cost than BCRYPT_ROUNDS is replaced after a successful login.
     
     :param email: Email of the user
     :param password: Password of the user
     :return: JSON response with the login status
+    :raises HashingBusy: if too many logins are already being checked
     """
-    response, status = get_user_by_email(email)
-    if status != 200:
-        return jsonify({"error": "Invalid email or password"}), 401
-    user = response.get_json()
-    hashed_password = get_pw_hash_from_email(email)
-    if hashed_password is None:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {User.select_columns()} FROM users WHERE email = ?', (email,))
+    row = cursor.fetchone()
+    conn.close()
+    user = User.from_row(row) if row else None
+    if not check_password(guessed_password, user.password_hash if user else None):
         return jsonify({"error": "Invalid email or password"}), 401
-    guessed_hash = hashpw(guessed_password, hashed_password)
-    if guessed_hash == hashed_password:
-        if user.get("role") >= Role.STAFF:
-            response = {
-            "message": "Login successful",
-            "user_id": user.get("user_id"),
-            "full_name": user.get("full_name"),
-            "role": user.get("role"),
-            "approved": user.get("approved"),
-            "redirect_url": "/admin/dashboard",
-            }
-        else:
-            response = {
-            "message": "Login successful",
-            "user_id": user.get("user_id"),
-            "full_name": user.get("full_name"),
-            "role": user.get("role"),
-            "approved": user.get("approved"),
-            "redirect_url": "/home",
-            }
-        session.permanent = True
-        session['user_id'] = user.get("user_id")
-        return jsonify(response), 200
-    return jsonify({"error": "Invalid email or password"}), 401
+    if needs_rehash(user.password_hash):
+        _upgrade_hash(user.user_id, user.password_hash, guessed_password)
+    role = _to_role(user.role)
+    response = {
+        "message": "Login successful",
+        "user_id": user.user_id,
+        "full_name": user.full_name,
+        "role": role,
+        "approved": user.approved,
+        "redirect_url": "/admin/dashboard" if role >= Role.STAFF else "/home",
+    }
+    session.permanent = True
+    session['user_id'] = user.user_id
+    _cache_principal(user.user_id, role, bool(user.approved))
+    return jsonify(response), 200
+
+def _upgrade_hash(user_id, old_hash, password):
+    """Store a new hash at the current cost; a concurrent password change wins."""
+    try:
+        new_hash = hash_password(password)
+    except HashingBusy:
+        return  # try again on the next login
+    conn = get_db_connection()
+    conn.execute('UPDATE users SET password_hash = ? WHERE user_id = ? AND password_hash = ?',
+                 (new_hash, user_id, old_hash))
+    conn.commit()
+    conn.close()
 
 def logout():
     """
@@ -0,0 +1,59 @@
+"""
+Per-table change versions.
+
+Triggers (see migrations.py) bump a row in change_versions whenever pets or
+the questionnaire change. Readers use the version to build ETags and to tell
+whether an in-memory copy is still current.
+
+Versions are cached in-process. A handler that writes calls invalidate() so
+this process sees its own change immediately; changes made by other worker
+processes are picked up within VERSION_TTL seconds.
+"""
+import os
+import threading
+from datetime import datetime, timezone
+from time import monotonic
+from db import get_db_connection, on_reset
+
+VERSION_TTL = float(os.environ.get('PETADOPTION_VERSION_TTL', '1.0'))
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def get_version(name):
+    """
+    Get the current change version of a table group.
+    :param name: Version name, e.g. 'pets' or 'questionnaire'
+    :return: Tuple (version, updated_at as an aware datetime or None)
+    """
+    entry = _cache.get(name)
+    if entry is not None and entry[2] > monotonic():
+        return entry[0], entry[1]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version, updated_at FROM change_versions WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    conn.close()
+    if row is None:
+        version, updated_at = 0, None
+    else:
+        version = row['version']
+        updated_at = datetime.strptime(row['updated_at'], '%Y-%m-%d %H:%M:%S') \
+            .replace(tzinfo=timezone.utc)
+    with _lock:
+        _cache[name] = (version, updated_at, monotonic() + VERSION_TTL)
+    return version, updated_at
+
+
+@on_reset
+def invalidate(*names):
+    """
+    Forget cached versions after a local write.
+    :param names: Version names to forget, all of them if none are given
+    """
+    with _lock:
+        if not names:
+            _cache.clear()
+        for name in names:
+            _cache.pop(name, None)